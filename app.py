@@ -1,30 +1,178 @@
 import os
 import json
+import math
+import contextlib
+import copy
+import atexit
 import requests
 import logging
+import logging.handlers
 import sys
 import io
 import time
 import base64
+import random
+import hashlib
+import struct
+import uuid
+import sqlite3
+import tempfile
+import shutil
+import zipfile
+import mimetypes
+import socket
+import ipaddress
+import threading
+import bisect
+import weakref
+import queue
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+from collections import deque, OrderedDict
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
 from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+from urllib3.response import HTTPResponse
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.util.retry import Retry
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, redirect, url_for, stream_with_context, g, has_request_context
 from flask_cors import CORS
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NeedData
 from dotenv import load_dotenv
 
+# Pillow is only needed for optional upload pre-processing (PREPROCESS_UPLOADS)
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# HEIC decoding needs the pillow-heif plugin; without it HEIC uploads are forwarded untouched
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 
-# Configure detailed logging for production debugging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
-app.logger.setLevel(logging.INFO)
+# Logging: records are queued by the request thread and written to stdout by a background thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # DEBUG adds per-request validation and upstream details
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # text | json (one object per line)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Records waiting to be written; further records are dropped
+LOG_SAMPLE_RATES = json.loads(os.getenv('LOG_SAMPLE_RATES', '{}'))  # Share of requests per path keeping INFO/DEBUG lines, e.g. {"/api/upscale": 0.1, "*": 1}
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Span of the request being handled; tags log records here and is managed by the tracing helpers below
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def log_sample_rate(path):
+    """Share of requests to path whose INFO and DEBUG records are kept"""
+    return float(LOG_SAMPLE_RATES.get(path, LOG_SAMPLE_RATES.get('*', 1.0)))
+
+class RequestLogFilter(logging.Filter):
+    """Tag records with the current request id and drop INFO/DEBUG records of requests sampled out"""
+    
+    def filter(self, record):
+        span = _current_span.get()
+        if span is None:
+            record.request_id = None
+            return True
+        record.request_id = span.trace.request_id
+        return span.trace.keep_logs or record.levelno >= logging.WARNING
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per record; extra={'fields': {...}} adds structured fields"""
+    
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Hand records to a writer thread so request threads never block on stdout"""
+    
+    def __init__(self, *handlers, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+    
+    def _start_listener(self):
+        # A forked worker inherits the queue but not the writer thread, so each process starts its own
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+    
+    def prepare(self, record):
+        # Only the message is rendered here; formatting and the stdout write happen on the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+    
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        super().emit(record)
+    
+    def stats(self):
+        return {'format': LOG_FORMAT, 'level': LOG_LEVEL, 'queued': self.queue.qsize(), 'dropped': self.dropped}
+    
+    def close(self):
+        """Write out queued records and stop the writer thread"""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+        super().close()
+
+def configure_logging():
+    """Route all loggers through the request filter and the queued stdout writer"""
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    handler = QueueLogHandler(stream_handler)
+    handler.addFilter(RequestLogFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    app.logger.setLevel(LOG_LEVEL)
+    return handler
+
+log_handler = configure_logging()
 
 # Configure CORS - only allow requests from your frontend
 CORS(app, origins=['https://aifreeset.netlify.app'])
@@ -33,6 +181,164 @@ CORS(app, origins=['https://aifreeset.netlify.app'])
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'heic'}
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Read/stream uploads in chunks instead of whole-file copies
+STREAMING_UPLOADS = os.getenv('STREAMING_UPLOADS', 'false').lower() == 'true'  # Default for ?stream=
+
+# Optional pre-processing: downscale, strip EXIF and re-encode uploads before proxying (needs Pillow)
+PREPROCESS_UPLOADS = os.getenv('PREPROCESS_UPLOADS', 'false').lower() == 'true'
+PREPROCESS_QUALITY = int(os.getenv('PREPROCESS_QUALITY', '90'))  # JPEG/WEBP quality of re-encoded uploads
+
+# Leading bytes of each supported image format (enough for PNG and WEBP dimensions too)
+IMAGE_SNIFF_BYTES = 32
+HEIC_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+EXTENSION_FORMATS = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'webp': 'webp', 'heic': 'heic'}
+
+# Largest images accepted, checked from the header before any upstream call
+MAX_IMAGE_DIMENSION = int(os.getenv('MAX_IMAGE_DIMENSION', '12000'))  # Longest side in pixels
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(64 * 1000 * 1000)))  # Width x height
+
+# Upstream connection pool configuration (shared by all worker threads in a process)
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv('UPSTREAM_POOL_CONNECTIONS', '4'))  # Host pools kept per session
+UPSTREAM_POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', '16'))  # Idle connections kept per host
+UPSTREAM_POOL_BLOCK = os.getenv('UPSTREAM_POOL_BLOCK', 'false').lower() == 'true'
+UPSTREAM_TCP_KEEPALIVE = os.getenv('UPSTREAM_TCP_KEEPALIVE', 'true').lower() == 'true'
+
+# Upstream API endpoints (the base overrides point the app at staging or local mock servers)
+PIXELCUT_API_BASE = os.getenv('PIXELCUT_API_BASE', 'https://api.pixelcut.ai').rstrip('/')
+UNWATERMARK_API_BASE = os.getenv('UNWATERMARK_API_BASE', 'https://api.unwatermark.ai').rstrip('/')
+QWEN_API_BASE = os.getenv('QWEN_API_BASE', 'https://dashscope.aliyuncs.com').rstrip('/')
+PIXELCUT_BACKGROUND_REMOVE_URL = f'{PIXELCUT_API_BASE}/v1/background/remove'
+PIXELCUT_UPSCALE_URL = f'{PIXELCUT_API_BASE}/v1/upscale'
+PIXELCUT_ENHANCE_URL = f'{PIXELCUT_API_BASE}/v1/enhance'
+UNWATERMARK_REMOVE_URL = f'{UNWATERMARK_API_BASE}/v1/remove'
+QWEN_TEXT2IMAGE_URL = f'{QWEN_API_BASE}/api/v1/services/aigc/text2image/generation'
+
+# Upstream response handling
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+IMAGE_API_URL_FIELDS = ('output_url', 'result_url', 'url', 'image_url', 'processed_url', 'processed_image')
+UPSCALE_API_URL_FIELDS = ('output_url', 'result_url', 'url', 'processed_image')
+
+# Retry policy shared by every upstream call (replaces nested urllib3 + loop retries)
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '3'))  # Attempts per request, including the first
+RETRY_BUDGET_SECONDS = float(os.getenv('RETRY_BUDGET_SECONDS', '150'))  # Wall-clock cap per request incl. backoff
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1'))  # Backoff ceiling for the first retry
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '8'))  # Backoff ceiling for later retries
+RETRY_MIN_ATTEMPT_SECONDS = 1.0  # Don't start an attempt with less budget than this
+
+# Adaptive upstream timeouts; the static per-operation timeout becomes the read ceiling
+ADAPTIVE_TIMEOUTS = os.getenv('ADAPTIVE_TIMEOUTS', 'true').lower() == 'true'
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = int(os.getenv('ADAPTIVE_TIMEOUT_MIN_SAMPLES', '50'))  # Static timeouts until then
+ADAPTIVE_TIMEOUT_PERCENTILE = float(os.getenv('ADAPTIVE_TIMEOUT_PERCENTILE', '0.99'))
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv('ADAPTIVE_TIMEOUT_MULTIPLIER', '2'))  # Headroom over the percentile
+READ_TIMEOUT_FLOOR = float(os.getenv('READ_TIMEOUT_FLOOR', '15'))
+CONNECT_TIMEOUT_FLOOR = float(os.getenv('CONNECT_TIMEOUT_FLOOR', '1'))
+CONNECT_TIMEOUT_CEILING = float(os.getenv('CONNECT_TIMEOUT_CEILING', '10'))
+LATENCY_WINDOW_SECONDS = float(os.getenv('LATENCY_WINDOW_SECONDS', '300'))  # Histograms forget older calls
+LATENCY_BUCKETS = tuple(round(0.01 * 1.25 ** i, 4) for i in range(50))  # 10ms to ~10min, 25% apart
+
+# Prometheus metrics on /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # Seconds
+
+# Per-request tracing; the request id is always returned and sent upstream, spans only when exporting
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', 'none').lower()  # none | file | otlp
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')  # One JSON trace per line
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')  # OTLP/HTTP JSON collector
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))  # Fraction of requests whose spans are exported
+
+# Deterministic upstream fault injection for tests and load runs; leave unset in production.
+# Per provider: {"fault": ...} always, {"steps": [fault or null, ...], "repeat": false} in call order,
+# {"mix": [{"fault": ..., "rate": 0.1}], "seed": 1} seeded random. See FAULT_KINDS for the fault types.
+FAULT_INJECTION = json.loads(os.getenv('FAULT_INJECTION', '{}'))
+TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', '1000'))  # Traces waiting for export; extras are dropped
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'aifreeset-backend')
+
+# Circuit breaker per upstream: trip on a high failure rate, serve dummies while open
+CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', '60'))  # Failure-rate window
+CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))  # Calls needed in the window before tripping
+CIRCUIT_FAILURE_RATE = float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5'))  # Failure ratio that opens the circuit
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))  # Cool-down before a recovery probe
+
+# Bulkheads: per-upstream concurrency caps so one slow provider can't tie up every worker
+BULKHEAD_MAX_CONCURRENT = int(os.getenv('BULKHEAD_MAX_CONCURRENT', '8'))  # In-flight calls per upstream per process
+BULKHEAD_MAX_QUEUE = int(os.getenv('BULKHEAD_MAX_QUEUE', '8'))  # Callers allowed to wait for a slot
+BULKHEAD_QUEUE_TIMEOUT = float(os.getenv('BULKHEAD_QUEUE_TIMEOUT', '2'))  # Longest wait for a slot
+BULKHEAD_ON_FULL = os.getenv('BULKHEAD_ON_FULL', 'dummy').lower()  # dummy | reject (503 with Retry-After)
+BULKHEAD_LIMITS = json.loads(os.getenv('BULKHEAD_LIMITS', '{}'))  # Per provider, e.g. {"qwen": {"max_concurrent": 4}}
+
+# Client-side rate limiting per upstream API key, on top of the upstream's own rate-limit headers
+RATE_LIMITS = json.loads(os.getenv('RATE_LIMITS', '{}'))  # Per provider in requests/s, e.g. {"qwen": {"rate": 2, "burst": 5}}
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '10'))  # Longest a call queues for a request slot
+RATE_LIMIT_DEFAULT_COOLDOWN = float(os.getenv('RATE_LIMIT_DEFAULT_COOLDOWN', '5'))  # Pause after a 429 without Retry-After
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory').lower()  # memory | sqlite
+RATE_LIMIT_STORE_PATH = os.getenv('RATE_LIMIT_STORE_PATH', 'ratelimits.sqlite3')  # SQLite file shared by all workers
+
+# Inbound rate limiting per client (API token, else IP) on POST /api/* routes, checked before the body is read
+INBOUND_RATE_LIMIT = int(os.getenv('INBOUND_RATE_LIMIT', '0'))  # Requests per client per route per window; 0 disables
+INBOUND_RATE_WINDOW_SECONDS = float(os.getenv('INBOUND_RATE_WINDOW_SECONDS', '60'))
+INBOUND_ROUTE_LIMITS = json.loads(os.getenv('INBOUND_ROUTE_LIMITS', '{}'))  # Per route, e.g. {"/api/ai-art": 10}
+INBOUND_TRUSTED_PROXIES = int(os.getenv('INBOUND_TRUSTED_PROXIES', '0'))  # Proxies appending to X-Forwarded-For
+INBOUND_API_KEYS = {key.strip() for key in os.getenv('INBOUND_API_KEYS', '').split(',') if key.strip()}  # Keys that get their own budget
+INBOUND_RATE_MAX_CLIENTS = int(os.getenv('INBOUND_RATE_MAX_CLIENTS', '100000'))  # In-memory counters kept (LRU)
+INBOUND_RATE_STORE = os.getenv('INBOUND_RATE_STORE', 'memory').lower()  # memory | sqlite
+INBOUND_RATE_STORE_PATH = os.getenv('INBOUND_RATE_STORE_PATH', 'inbound_limits.sqlite3')  # SQLite file shared by all workers
+
+# Content-addressed result cache for image operations
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '512'))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # In-memory tier size cap
+RESULT_CACHE_TTL_SECONDS = float(os.getenv('RESULT_CACHE_TTL_SECONDS', '3600'))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')  # Optional on-disk tier shared by all workers
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024)))  # On-disk tier size cap
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_DISK_MAX_ENTRIES', '10000'))
+RESULT_CACHE_DISK_SWEEP_SECONDS = float(os.getenv('RESULT_CACHE_DISK_SWEEP_SECONDS', '60'))  # Min gap between disk sweeps per worker
+
+# Prompt-level cache for /api/ai-art (DashScope result URLs stay valid for about a day)
+AI_ART_CACHE_MAX_ENTRIES = int(os.getenv('AI_ART_CACHE_MAX_ENTRIES', '1024'))
+AI_ART_CACHE_TTL_SECONDS = float(os.getenv('AI_ART_CACHE_TTL_SECONDS', '1800'))
+
+# Stored binary results for ?response=url (served from /api/results/<id>)
+RESULT_STORE_MAX_BYTES = int(os.getenv('RESULT_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+RESULT_STORE_TTL_SECONDS = float(os.getenv('RESULT_STORE_TTL_SECONDS', '3600'))
+RESULT_STORE_DIR = os.getenv('RESULT_STORE_DIR')  # Optional on-disk tier shared by all workers
+RESULT_STORE_DISK_MAX_BYTES = int(os.getenv('RESULT_STORE_DISK_MAX_BYTES', str(1024 * 1024 * 1024)))  # On-disk tier size cap
+RESULT_STORE_DISK_MAX_ENTRIES = int(os.getenv('RESULT_STORE_DISK_MAX_ENTRIES', '10000'))
+RESULT_ID_LENGTH = 32  # Hex characters of the sha256 used as a stored result id
+RESPONSE_MODES = ('json', 'binary', 'url')
+
+# Asynchronous job API (?async=1): job state lives in a pluggable store
+JOB_STORE = os.getenv('JOB_STORE', 'memory').lower()  # memory | sqlite
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', 'jobs.sqlite3')  # SQLite file shared by all workers
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # Threads executing jobs per process
+JOB_TTL_SECONDS = float(os.getenv('JOB_TTL_SECONDS', '86400'))  # Finished jobs are pruned after this
+JOB_WEBHOOK_TIMEOUT = float(os.getenv('JOB_WEBHOOK_TIMEOUT', '10'))
+JOB_WEBHOOK_ALLOW_PRIVATE = os.getenv('JOB_WEBHOOK_ALLOW_PRIVATE', 'false').lower() == 'true'  # Loopback/private webhooks (local development)
+
+# Batch endpoint: many images (or zip archives) per request, results streamed as NDJSON
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))  # Images per batch after unzipping
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))  # Images processed in parallel per batch
+BATCH_MAX_REQUEST_SIZE = int(os.getenv('BATCH_MAX_REQUEST_SIZE', str(100 * 1024 * 1024)))  # Whole batch body
+
+# Pipeline endpoint: one upload run through several operations server-side
+PIPELINE_MAX_STAGES = int(os.getenv('PIPELINE_MAX_STAGES', '4'))
+PIPELINE_DOWNLOAD_TIMEOUT = float(os.getenv('PIPELINE_DOWNLOAD_TIMEOUT', '60'))  # Fetching URL results between stages
+
+# Provider failover and hedged requests
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'false').lower() == 'true'  # Race the next provider once the first is slow
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))  # Latency samples needed before a provider's p95 is trusted
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv('HEDGE_MIN_DELAY_SECONDS', '0.5'))  # Never hedge sooner than this
+HEDGE_WORKERS = int(os.getenv('HEDGE_WORKERS', '32'))  # Threads running hedged upstream calls per process
+OPERATION_ALTERNATES = json.loads(os.getenv('OPERATION_ALTERNATES', '{}'))  # {"unblur": [{"provider": ..., "url": ...}]}
+
+class AppRequest(Request):
+    """Request with a larger body limit for the batch endpoint"""
+    
+    @property
+    def max_content_length(self):
+        if self.path == '/api/batch':
+            return BATCH_MAX_REQUEST_SIZE
+        return super().max_content_length
+
+app.request_class = AppRequest
 
 # API Keys from environment variables with proper validation
 PIXELCUT_API_KEY = os.getenv('PIXELCUT_API_KEY', 'sk_2d205bd00cad484db6ce55ef0f936db2')
@@ -41,11 +347,64 @@ QWEN_API_KEY = os.getenv('QWEN_API_KEY', 'sk-or-v1-4ce8bd6b0bdda545864bbd42de07f
 
 # Log API key status at startup (without exposing actual keys)
 app.logger.info("=== API KEYS STATUS ===")
-app.logger.info(f"Pixelcut API Key: {'✓ Loaded' if PIXELCUT_API_KEY else '✗ Missing'}")
-app.logger.info(f"Unwatermark API Key: {'✓ Loaded' if UNWATERMARK_API_KEY else '✗ Missing'}")
-app.logger.info(f"Qwen API Key: {'✓ Loaded' if QWEN_API_KEY else '✗ Missing'}")
+app.logger.info("Pixelcut API Key: %s", '✓ Loaded' if PIXELCUT_API_KEY else '✗ Missing')
+app.logger.info("Unwatermark API Key: %s", '✓ Loaded' if UNWATERMARK_API_KEY else '✗ Missing')
+app.logger.info("Qwen API Key: %s", '✓ Loaded' if QWEN_API_KEY else '✗ Missing')
 app.logger.info("=========================")
 
+# Upstream providers and how to authenticate with them
+PROVIDERS = {
+    'pixelcut': {'api_key': PIXELCUT_API_KEY, 'auth_header': 'Authorization', 'auth_prefix': 'Bearer '},
+    'unwatermark': {'api_key': UNWATERMARK_API_KEY, 'auth_header': 'Authorization', 'auth_prefix': 'Bearer '},
+    'qwen': {'api_key': QWEN_API_KEY, 'auth_header': 'Authorization', 'auth_prefix': 'Bearer '}
+}
+
+# Every operation as a declarative spec; one engine (run_image_operation) executes all image operations.
+#   input: 'image' (multipart upload) or 'prompt' (JSON)
+#   params: extra form fields, also part of the result cache key
+#   url_fields / source: where the output URL is found in JSON responses and how results are tagged
+#   max_dimension: longest side the operation can use; larger uploads are shrunk when PREPROCESS_UPLOADS is on
+#   build_request / parse_response: prompt operations' JSON payload builder and result parser (registered below them)
+OPERATIONS = {
+    'background-remove': {
+        'label': 'Background removal', 'input': 'image', 'provider': 'pixelcut',
+        'url': PIXELCUT_BACKGROUND_REMOVE_URL, 'timeout': 90, 'max_dimension': 2048
+    },
+    'upscale': {
+        'label': 'Image upscale', 'input': 'image', 'provider': 'pixelcut',
+        'url': PIXELCUT_UPSCALE_URL, 'timeout': 90, 'params': {'scale': '2'},
+        'url_fields': UPSCALE_API_URL_FIELDS, 'source': 'pixelcut',
+        'max_dimension': 1536  # Output is 2x, so this already yields 3072px
+    },
+    'unblur': {
+        'label': 'Image enhancement', 'input': 'image', 'provider': 'pixelcut',
+        'url': PIXELCUT_ENHANCE_URL, 'timeout': 90, 'max_dimension': 2560
+    },
+    'watermark-remove': {
+        'label': 'Watermark removal', 'input': 'image', 'provider': 'unwatermark',
+        'url': UNWATERMARK_REMOVE_URL, 'timeout': 120, 'max_dimension': 2560
+    },
+    'ai-art': {
+        'label': 'AI art generation', 'input': 'prompt', 'provider': 'qwen',
+        'url': QWEN_TEXT2IMAGE_URL, 'timeout': 120
+    }
+}
+
+# Alternates are tried after the operation's own provider; they inherit every field they don't override.
+#   priority: lower goes first (the primary is 0, alternates default to 1)
+#   weight: relative share among providers with the same priority
+for _name, _alternates in OPERATION_ALTERNATES.items():
+    for _alternate in _alternates:
+        if _name not in OPERATIONS or _alternate.get('provider') not in PROVIDERS:
+            app.logger.warning("Ignoring alternate provider %s for %s", _alternate.get('provider'), _name)
+            continue
+        OPERATIONS[_name].setdefault('alternates', []).append(_alternate)
+
+IMAGE_OPERATIONS = {name: spec for name, spec in OPERATIONS.items() if spec['input'] == 'image'}
+
+# Which upstream serves each endpoint
+ENDPOINT_UPSTREAMS = {name: spec['provider'] for name, spec in OPERATIONS.items()}
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     if not filename or '.' not in filename:
@@ -55,7 +414,7 @@ def allowed_file(filename):
 
 def validate_image_upload(request):
     """Validate uploaded image file with comprehensive logging"""
-    app.logger.info("Starting file validation...")
+    app.logger.debug("Starting file validation...")
     
     # Check if file is in request
     if 'image' not in request.files:
@@ -71,26 +430,25 @@ def validate_image_upload(request):
     
     # Log file details
     filename = secure_filename(file.filename)
-    app.logger.info(f"File received: {filename}")
-    app.logger.info(f"Content-Type: {file.content_type}")
+    app.logger.debug("File received: %s", filename)
+    app.logger.debug("Content-Type: %s", file.content_type)
     
     # Validate file type
     if not allowed_file(filename):
-        app.logger.warning(f"Invalid file type: {filename}")
+        app.logger.warning("Invalid file type: %s", filename)
         return None, {
             'success': False, 
             'error': 'Unsupported file type. Allowed: JPG, PNG, WEBP, HEIC'
         }
     
-    # Check file size by reading content
-    file.seek(0)
-    file_content = file.read()
-    file_size = len(file_content)
+    # The spooled upload knows its length, so size checks don't read the body
+    file.stream.seek(0, os.SEEK_END)
+    file_size = file.stream.tell()
     
-    app.logger.info(f"File size: {file_size} bytes ({file_size / (1024*1024):.2f} MB)")
+    app.logger.debug("File size: %s bytes (%.2f MB)", file_size, file_size / (1024*1024))
     
     if file_size > MAX_FILE_SIZE:
-        app.logger.warning(f"File too large: {file_size} bytes")
+        app.logger.warning("File too large: %s bytes", file_size)
         return None, {
             'success': False, 
             'error': 'File size exceeds 10MB limit'
@@ -103,393 +461,3394 @@ def validate_image_upload(request):
             'error': 'Empty file received'
         }
     
+    # Check the real format and dimensions from the header, without decoding pixels
+    image_format, dimensions = probe_image(file.stream)
+    error = check_image_header(filename, image_format, dimensions)
+    if error:
+        app.logger.warning("Rejected %s: %s", filename, error)
+        return None, {'success': False, 'error': error}
+    
+    file.image_format = image_format
+    file.width, file.height = dimensions or (None, None)
+    app.logger.debug("Image header: %s %sx%s", image_format, file.width, file.height)
+    
+    # Content hash keys the result cache for this upload (one chunked pass, no full copy)
+    file.seek(0)
+    digest = hashlib.sha256()
+    while True:
+        chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    file.sha256 = digest.hexdigest()
+    
     # Reset file pointer and return file with content
     file.seek(0)
-    app.logger.info("File validation successful")
+    app.logger.debug("File validation successful")
     return file, None
 
-def create_retry_session():
+def sniff_image_format(head):
+    """Identify jpeg/png/webp/heic from the first bytes of a file (None if unsupported)"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in HEIC_BRANDS:
+        return 'heic'
+    return None
+
+def _probe_png(head):
+    """(width, height) from the IHDR chunk"""
+    if len(head) >= 24 and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    return None
+
+def _probe_webp(head):
+    """(width, height) from the VP8, VP8L or VP8X chunk header"""
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and len(head) >= 30 and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and len(head) >= 25 and head[20] == 0x2f:
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X' and len(head) >= 30:
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None
+
+def _probe_jpeg(stream):
+    """(width, height) from the first SOF segment, skipping other segments by their length"""
+    stream.seek(2)
+    while True:
+        marker = stream.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:  # Fill bytes before the marker code
+            fill = stream.read(1)
+            if not fill:
+                return None
+            code = fill[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD7:  # Standalone markers without a length
+            continue
+        if code in (0xD9, 0xDA):  # End of image or start of scan before any frame header
+            return None
+        
+        length = stream.read(2)
+        if len(length) < 2 or int.from_bytes(length, 'big') < 2:
+            return None
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            frame = stream.read(5)
+            if len(frame) < 5:
+                return None
+            return int.from_bytes(frame[3:5], 'big'), int.from_bytes(frame[1:3], 'big')
+        stream.seek(int.from_bytes(length, 'big') - 2, os.SEEK_CUR)
+
+def _iter_boxes(stream, start, end):
+    """Yield (type, body_start, box_end) for the ISO-BMFF boxes between start and end"""
+    position = start
+    while position + 8 <= end:
+        stream.seek(position)
+        header = stream.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        body = position + 8
+        if size == 1:
+            large = stream.read(8)
+            if len(large) < 8:
+                return
+            size, body = struct.unpack('>Q', large)[0], position + 16
+        elif size == 0:
+            size = end - position
+        if size < body - position or position + size > end:
+            return
+        yield box_type, body, position + size
+        position += size
+
+def _probe_heic(stream):
+    """(width, height) of the largest 'ispe' property in meta/iprp/ipco (the primary image)"""
+    end = stream.seek(0, os.SEEK_END)
+    sizes = []
+    for box_type, body, box_end in _iter_boxes(stream, 0, end):
+        if box_type != b'meta':
+            continue
+        # meta is a full box: skip its version and flags
+        for child_type, child_body, child_end in _iter_boxes(stream, body + 4, box_end):
+            if child_type != b'iprp':
+                continue
+            for container_type, container_body, container_end in _iter_boxes(stream, child_body, child_end):
+                if container_type != b'ipco':
+                    continue
+                for property_type, property_body, property_end in _iter_boxes(stream, container_body, container_end):
+                    if property_type == b'ispe' and property_end - property_body >= 12:
+                        stream.seek(property_body + 4)
+                        sizes.append(struct.unpack('>II', stream.read(8)))
+        break
+    return max(sizes, key=lambda size: size[0] * size[1]) if sizes else None
+
+def probe_image(stream):
+    """Format and (width, height) from the image header only; dimensions are None if unreadable"""
+    stream.seek(0)
+    head = stream.read(IMAGE_SNIFF_BYTES)
+    image_format = sniff_image_format(head)
+    dimensions = None
+    if image_format == 'png':
+        dimensions = _probe_png(head)
+    elif image_format == 'webp':
+        dimensions = _probe_webp(head)
+    elif image_format == 'jpeg':
+        dimensions = _probe_jpeg(stream)
+    elif image_format == 'heic':
+        dimensions = _probe_heic(stream)
+    stream.seek(0)
+    return image_format, dimensions
+
+def check_image_header(filename, image_format, dimensions, require_dimensions=True):
+    """Error message if the content doesn't match the extension or has unusable dimensions, else None"""
+    if image_format is None:
+        return 'File content is not a supported image'
+    
+    extension = filename.rsplit('.', 1)[1].lower()
+    if EXTENSION_FORMATS.get(extension) != image_format:
+        return f"File content ({image_format.upper()}) does not match its .{extension} extension"
+    
+    if dimensions is None:
+        # HEIC files may keep their sizes in uncommon places; the upstream decides those
+        if require_dimensions and image_format != 'heic':
+            return 'Could not read image dimensions'
+        return None
+    
+    width, height = dimensions
+    if not width or not height:
+        return 'Image has invalid dimensions'
+    if max(width, height) > MAX_IMAGE_DIMENSION or width * height > MAX_IMAGE_PIXELS:
+        return f"Image dimensions {width}x{height} exceed the allowed size"
+    return None
+
+class UploadRejected(Exception):
+    """Streaming upload failed inline validation"""
+
+class UploadTooLarge(UploadRejected):
+    """Streaming upload passed MAX_FILE_SIZE (answered 413 rather than 400)"""
+
+class StreamingUploadRelay:
+    """Re-frame an incoming multipart upload for the upstream while validating it inline"""
+    
+    def __init__(self, boundary, fields=None, field_name='image'):
+        self.field_name = field_name
+        self.filename = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self._boundary}'
+        self._fields = fields or {}
+        self._part_header = None
+        self._head = b''
+        self._in_image = False
+        self._image_done = False
+    
+    def feed(self, chunk):
+        """Consume a client chunk and return the bytes to forward upstream"""
+        self._decoder.receive_data(chunk)
+        forward = []
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, (NeedData, Epilogue)):
+                break
+            if isinstance(event, File) and event.name == self.field_name and not self._image_done:
+                self._start_image(event)
+            elif isinstance(event, Data) and self._in_image:
+                forward.extend(self._image_data(event.data))
+                if not event.more_data:
+                    self._end_image(forward)
+            elif not isinstance(event, Data):
+                self._in_image = False
+        return forward
+    
+    def finish(self):
+        """Flush the decoder and return the closing bytes for the upstream body"""
+        forward = self.feed(None)
+        if not self._image_done:
+            raise UploadRejected('No image file provided' if self.filename is None else 'Empty file received')
+        forward.append(f'--{self._boundary}--\r\n'.encode('utf-8'))
+        return forward
+    
+    def _start_image(self, event):
+        filename = secure_filename(event.filename or '')
+        if not filename:
+            raise UploadRejected('No image file selected')
+        if not allowed_file(filename):
+            raise UploadRejected('Unsupported file type. Allowed: JPG, PNG, WEBP, HEIC')
+        
+        self.filename = filename
+        self._in_image = True
+        content_type = event.headers.get('content-type', 'image/jpeg')
+        preamble = ''.join(
+            f'--{self._boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in self._fields.items()
+        )
+        self._part_header = (
+            f'{preamble}--{self._boundary}\r\nContent-Disposition: form-data; name="{self.field_name}"; '
+            f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+    
+    def _image_data(self, data):
+        self.size += len(data)
+        if self.size > MAX_FILE_SIZE:
+            raise UploadTooLarge('File size exceeds 10MB limit')
+        self.digest.update(data)
+        
+        if self._part_header is None:
+            return [data]
+        
+        # Hold everything back until the magic bytes prove this is an image
+        self._head += data
+        if len(self._head) < IMAGE_SNIFF_BYTES:
+            return []
+        return self._release_head()
+    
+    def _release_head(self):
+        # Only the held-back head is available, so dimensions are checked when it contains them
+        image_format, dimensions = probe_image(io.BytesIO(self._head))
+        error = check_image_header(self.filename, image_format, dimensions, require_dimensions=False)
+        if error:
+            raise UploadRejected(error)
+        forward = [self._part_header, self._head]
+        self._part_header = None
+        self._head = b''
+        return forward
+    
+    def _end_image(self, forward):
+        if self.size == 0:
+            raise UploadRejected('Empty file received')
+        if self._part_header is not None:
+            forward.extend(self._release_head())
+        forward.append(b'\r\n')
+        self._in_image = False
+        self._image_done = True
+
+class MultipartFileBody:
+    """Streaming multipart/form-data body that reads file parts in chunks instead of copying them"""
+    
+    def __init__(self, files, fields=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._parts = []  # bytes or (stream, length)
+        self._length = 0
+        
+        for name, value in (fields or {}).items():
+            self._add_bytes(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            )
+        
+        for name, (filename, stream, content_type) in files.items():
+            stream.seek(0, os.SEEK_END)
+            size = stream.tell()
+            stream.seek(0)
+            filename = filename.replace('"', '%22')
+            self._add_bytes(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8')
+            )
+            self._parts.append((stream, size))
+            self._length += size
+            self._add_bytes(b'\r\n')
+        
+        self._add_bytes(f'--{boundary}--\r\n'.encode('utf-8'))
+        self._index = 0
+        self._offset = 0
+    
+    def _add_bytes(self, data):
+        self._parts.append(data)
+        self._length += len(data)
+    
+    def __len__(self):
+        return self._length
+    
+    def read(self, size=-1):
+        """Return the next chunk from the current part (b'' once the body is exhausted)"""
+        if size is None or size < 0:
+            size = UPLOAD_CHUNK_SIZE
+        
+        while self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                chunk = part[self._offset:self._offset + size]
+            else:
+                stream, length = part
+                chunk = stream.read(min(size, length - self._offset)) if self._offset < length else b''
+            
+            if chunk:
+                self._offset += len(chunk)
+                return chunk
+            self._index += 1
+            self._offset = 0
+        return b''
+    
+    def __iter__(self):
+        while True:
+            chunk = self.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+def create_retry_session(pool_connections=10, pool_maxsize=10, pool_block=False, adapter_class=HTTPAdapter, retry_strategy=None):
     """Create a requests session with retry logic for better reliability"""
     session = requests.Session()
     
     # Define retry strategy - Fixed: replaced method_whitelist with allowed_methods
-    retry_strategy = Retry(
-        total=3,  # Total number of retries
-        status_forcelist=[429, 500, 502, 503, 504],  # HTTP status codes to retry on
-        allowed_methods=["HEAD", "GET", "POST"],  # HTTP methods to retry (fixed deprecated parameter)
-        backoff_factor=1,  # Backoff factor for exponential delay
-        raise_on_redirect=False,
-        raise_on_status=False
-    )
+    if retry_strategy is None:
+        retry_strategy = Retry(
+            total=3,  # Total number of retries
+            status_forcelist=[429, 500, 502, 503, 504],  # HTTP status codes to retry on
+            allowed_methods=["HEAD", "GET", "POST"],  # HTTP methods to retry (fixed deprecated parameter)
+            backoff_factor=1,  # Backoff factor for exponential delay
+            raise_on_redirect=False,
+            raise_on_status=False
+        )
     
     # Mount adapter with retry strategy
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter = adapter_class(
+        max_retries=retry_strategy,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block
+    )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     
     return session
 
-def create_dummy_response(endpoint_type, message="API temporarily unavailable, using dummy response"):
-    """Create standardized dummy fallback response for failed API calls"""
-    dummy_data = {
-        'background-remove': {
-            'processed_image': 'https://via.placeholder.com/512x512.png?text=Background+Removed',
-            'result': 'Background removal placeholder'
-        },
-        'upscale': {
-            'processed_image': 'https://via.placeholder.com/1024x1024.png?text=Upscaled+2x',
-            'result': 'Image upscaled placeholder'
-        },
-        'unblur': {
-            'processed_image': 'https://via.placeholder.com/512x512.png?text=Enhanced+Image',
-            'result': 'Image enhancement placeholder'
-        },
-        'watermark-remove': {
-            'processed_image': 'https://via.placeholder.com/512x512.png?text=Watermark+Removed',
-            'result': 'Watermark removal placeholder'
-        },
-        'ai-art': {
-            'processed_image': 'https://via.placeholder.com/1024x1024.png?text=AI+Generated+Art',
-            'text': 'This is a dummy AI-generated art response',
-            'result': 'AI art generation placeholder'
+# Pool checkout statistics per upstream host: a hit reuses an open keep-alive
+# connection, a miss pays a fresh DNS lookup, TCP connect and TLS handshake
+_pool_stats = {}
+_pool_stats_lock = threading.Lock()
+
+def record_pool_checkout(host, reused):
+    """Count a connection checkout from an upstream pool"""
+    with _pool_stats_lock:
+        stats = _pool_stats.setdefault(host, {'hits': 0, 'misses': 0})
+        stats['hits' if reused else 'misses'] += 1
+
+class _PoolStatsMixin:
+    """Connection pool mixin that records whether a checkout reused a live socket"""
+    
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        record_pool_checkout(self.host, getattr(conn, 'sock', None) is not None)
+        return conn
+
+class _TimedConnectMixin:
+    """Connection mixin that feeds TCP connect (and TLS handshake) time into the host's connect histogram"""
+    
+    def connect(self):
+        started = time.monotonic()
+        try:
+            super().connect()
+        except ConnectTimeoutError:
+            record_connect_latency(self.host, time.monotonic() - started)
+            raise
+        record_connect_latency(self.host, time.monotonic() - started)
+
+class TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+class StatsHTTPConnectionPool(_PoolStatsMixin, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class StatsHTTPSConnectionPool(_PoolStatsMixin, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that keeps connections alive and reports pool hit/miss stats"""
+    
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if UPSTREAM_TCP_KEEPALIVE:
+            pool_kwargs.setdefault(
+                'socket_options',
+                HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            )
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': StatsHTTPConnectionPool,
+            'https': StatsHTTPSConnectionPool
         }
-    }
+    
+    def send(self, request, **kwargs):
+        fault = fault_injector.next_fault(request.url) if fault_injector.plans else None
+        if fault is None:
+            return super().send(request, **kwargs)
+        return send_with_fault(self, request, fault, **kwargs)
+
+# Long-lived sessions keyed by upstream origin, created lazily after gunicorn forks
+_upstream_sessions = {}
+_upstream_sessions_lock = threading.Lock()
+
+def get_upstream_session(api_url):
+    """Return the process-wide pooled session for the origin of api_url"""
+    parts = urlsplit(api_url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    
+    session = _upstream_sessions.get(origin)
+    if session is None:
+        with _upstream_sessions_lock:
+            session = _upstream_sessions.get(origin)
+            if session is None:
+                app.logger.info("Creating pooled upstream session for %s", origin)
+                session = create_retry_session(
+                    pool_connections=UPSTREAM_POOL_CONNECTIONS,
+                    pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+                    pool_block=UPSTREAM_POOL_BLOCK,
+                    adapter_class=PooledHTTPAdapter,
+                    retry_strategy=Retry(0, read=False)  # Retries are owned by call_with_retry()
+                )
+                _upstream_sessions[origin] = session
+    return session
+
+def get_pool_stats():
+    """Snapshot of upstream pool configuration and per-host hit/miss counters"""
+    with _pool_stats_lock:
+        hosts = {host: dict(stats) for host, stats in _pool_stats.items()}
+    
+    for stats in hosts.values():
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 4) if total else 0.0
     
     return {
-        'success': True,
-        'source': 'dummy',
-        'error': message,
-        'data': dummy_data.get(endpoint_type, {
-            'processed_image': 'https://via.placeholder.com/512x512.png?text=Dummy+Response',
-            'result': 'Generic placeholder response'
-        })
+        'pool_connections': UPSTREAM_POOL_CONNECTIONS,
+        'pool_maxsize': UPSTREAM_POOL_MAXSIZE,
+        'pool_block': UPSTREAM_POOL_BLOCK,
+        'tcp_keepalive': UPSTREAM_TCP_KEEPALIVE,
+        'sessions': sorted(_upstream_sessions),
+        'hosts': hosts
     }
 
-def make_api_request_with_fallback(api_function, endpoint_type, *args, **kwargs):
-    """Wrapper to make API requests with automatic fallback to dummy responses"""
-    try:
-        return api_function(*args, **kwargs)
-    except Exception as e:
-        app.logger.error(f"API call failed for {endpoint_type}: {str(e)}")
-        app.logger.info(f"Returning dummy fallback response for {endpoint_type}")
-        return create_dummy_response(endpoint_type)
+class HostNotAllowed(ValueError):
+    """A client-supplied URL points at a loopback, private or otherwise non-public address; never retried"""
 
-def make_image_api_request(api_url, files, headers, timeout=90, max_attempts=3):
-    """Generic helper function for image processing API calls with retry logic"""
-    session = create_retry_session()
-    
-    for attempt in range(max_attempts):
-        try:
-            app.logger.info(f"API request attempt {attempt + 1}/{max_attempts} to {api_url}")
-            
-            response = session.post(
-                api_url,
-                files=files,
-                headers=headers,
-                timeout=timeout
-            )
-            
-            app.logger.info(f"API response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    result = response.json()
-                    # Try multiple URL field names
-                    output_url = (
-                        result.get('output_url') or 
-                        result.get('result_url') or 
-                        result.get('url') or 
-                        result.get('image_url') or
-                        result.get('processed_url') or
-                        result.get('processed_image')
-                    )
-                    
-                    if output_url:
-                        return {'success': True, 'processed_image': output_url, 'source': 'api'}
-                    else:
-                        raise Exception('No output URL found in API response')
-                        
-                except json.JSONDecodeError:
-                    # Handle binary image data
-                    if response.headers.get('content-type', '').startswith('image/'):
-                        try:
-                            image_data = base64.b64encode(response.content).decode('utf-8')
-                            content_type = response.headers.get('content-type', 'image/png')
-                            image_data_url = f"data:{content_type};base64,{image_data}"
-                            return {'success': True, 'image_data': image_data_url, 'source': 'api'}
-                        except Exception as base64_error:
-                            app.logger.error(f"Failed to encode binary response: {base64_error}")
-                    
-                    raise Exception('Invalid response format from API')
-            
-            elif response.status_code in [429, 500, 502, 503, 504]:
-                if attempt < max_attempts - 1:
-                    wait_time = (2 ** attempt) + 1
-                    app.logger.warning(f"API error {response.status_code}, retrying in {wait_time}s")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    raise Exception(f"API failed after retries: HTTP {response.status_code}")
-            else:
-                raise Exception(f"API error: HTTP {response.status_code} - {response.text[:200]}")
-                
-        except requests.exceptions.Timeout as e:
-            if attempt < max_attempts - 1:
-                wait_time = (2 ** attempt) + 2
-                app.logger.warning(f"Timeout (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            else:
-                raise Exception(f"Timeout after {max_attempts} attempts: {str(e)}")
-                
-        except requests.exceptions.ConnectionError as e:
-            if attempt < max_attempts - 1:
-                wait_time = (2 ** attempt) + 2
-                app.logger.warning(f"Connection error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            else:
-                raise Exception(f"Connection error after {max_attempts} attempts: {str(e)}")
-                
-        except requests.exceptions.RequestException as e:
-            if attempt < max_attempts - 1:
-                wait_time = (2 ** attempt) + 2
-                app.logger.warning(f"Request error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            else:
-                raise Exception(f"Request error after {max_attempts} attempts: {str(e)}")
-                
-        except Exception as e:
-            if attempt < max_attempts - 1:
-                wait_time = (2 ** attempt) + 2
-                app.logger.warning(f"Unexpected error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            else:
-                raise Exception(f"Unexpected error after {max_attempts} attempts: {str(e)}")
+def is_public_address(address):
+    """True for a globally routable unicast address: not loopback, private, link-local, reserved or multicast"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not (ip.is_multicast or ip.is_reserved or ip.is_unspecified)
+
+class _PublicOnlyConnectMixin:
+    """Connection mixin that refuses sockets to non-public addresses, checked after DNS so rebinding can't slip past"""
     
-    raise Exception("All retry attempts exhausted")
+    def _new_conn(self):
+        sock = super()._new_conn()
+        address = sock.getpeername()[0]
+        if not is_public_address(address):
+            sock.close()
+            raise HostNotAllowed(f"{self.host} resolves to non-public address {address}")
+        return sock
 
-@app.route('/', methods=['GET'])
-def health_check():
-    """Health check endpoint with API status"""
-    app.logger.info("Health check requested")
-    return jsonify({
-        'status': 'AiFreeSet backend running',
-        'api_keys_loaded': {
-            'pixelcut': bool(PIXELCUT_API_KEY),
-            'unwatermark': bool(UNWATERMARK_API_KEY),
-            'qwen': bool(QWEN_API_KEY)
-        }
-    })
+class PublicHTTPConnection(_PublicOnlyConnectMixin, HTTPConnection):
+    pass
 
-@app.route('/api/background-remove', methods=['POST'])
-def remove_background():
-    """Remove background using Pixelcut API with graceful fallback"""
-    app.logger.info("=== BACKGROUND REMOVE REQUEST STARTED ===")
+class PublicHTTPSConnection(_PublicOnlyConnectMixin, HTTPSConnection):
+    pass
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+class PublicOnlyHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter for client-supplied URLs: only public addresses, including after redirects"""
     
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': PublicHTTPConnectionPool,
+            'https': PublicHTTPSConnectionPool
+        }
+
+@contextlib.contextmanager
+def external_session(public_only=True):
+    """Short-lived session for one-off hosts (webhooks, result downloads)
+
+    Unlike get_upstream_session() nothing is cached per origin and no pool or connect stats are
+    kept, so arbitrary hosts can't grow process state. The pool is closed on exit.
+    """
+    session = requests.Session()
+    session.trust_env = False  # A proxy would hide the address the public-only check looks at
+    if public_only:
+        adapter = PublicOnlyHTTPAdapter(max_retries=Retry(0, read=False))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
     try:
-        # Validate file upload first
-        file, error = validate_image_upload(request)
-        if error:
-            return jsonify(error), 400
-        
-        filename = secure_filename(file.filename)
-        app.logger.info(f"Processing background removal for: {filename}")
-        
-        # Attempt real API call with fallback
-        def _make_background_remove_request():
-            if not PIXELCUT_API_KEY:
-                app.logger.error("Pixelcut API key not configured")
-                raise Exception("API key not configured")
-            
-            file.seek(0)
-            file_content = file.read()
-            
-            files = {'image': (filename, io.BytesIO(file_content), file.content_type or 'image/jpeg')}
-            headers = {
-                'Authorization': f'Bearer {PIXELCUT_API_KEY}',
-                'User-Agent': 'AiFreeSet-Backend/1.0'
-            }
-            
-            return make_image_api_request(
-                'https://api.pixelcut.ai/v1/background/remove',
-                files,
-                headers,
-                timeout=90
-            )
-        
-        # Make request with automatic fallback
-        result = make_api_request_with_fallback(_make_background_remove_request, 'background-remove')
-        return jsonify(result)
-        
-    except Exception as e:
-        app.logger.error(f"Unexpected error in background removal endpoint: {str(e)}")
-        # Return dummy response as final fallback
-        dummy_response = create_dummy_response('background-remove', 'Background removal service temporarily unavailable')
-        return jsonify(dummy_response)
+        yield session
+    finally:
+        session.close()
 
-@app.route('/api/upscale', methods=['POST'])
-def upscale_image():
-    """Upscale image using Pixelcut API with graceful fallback"""
-    app.logger.info("=== UPSCALE REQUEST STARTED ===")
-    
+def check_public_host(url):
+    """Raise HostNotAllowed (a ValueError) unless every address url's host resolves to is public"""
+    parts = urlsplit(url)
     try:
-        # Validate file upload first
-        file, error = validate_image_upload(request)
-        if error:
-            return jsonify(error), 400
-        
-        filename = secure_filename(file.filename)
-        app.logger.info(f"Processing upscale for: {filename}")
-        
-        # Attempt real API call with fallback
-        def _make_upscale_request():
-            if not PIXELCUT_API_KEY:
-                app.logger.error("Pixelcut API key not configured")
-                raise Exception("API key not configured")
-            
-            file.seek(0)
-            file_content = file.read()
-            
-            files = {'image': (filename, io.BytesIO(file_content), file.content_type or 'image/jpeg')}
-            headers = {
-                'Authorization': f'Bearer {PIXELCUT_API_KEY}',
-                'User-Agent': 'AiFreeSet-Backend/1.0'
-            }
-            
-            # Add scale parameter for upscaling
-            session = create_retry_session()
-            response = session.post(
-                'https://api.pixelcut.ai/v1/upscale',
-                files=files,
-                headers=headers,
-                data={'scale': '2'},
-                timeout=90
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                output_url = (
-                    result.get('output_url') or 
-                    result.get('result_url') or 
-                    result.get('url') or
-                    result.get('processed_image')
-                )
-                if output_url:
-                    return {'success': True, 'processed_image': output_url, 'source': 'pixelcut'}
-                else:
-                    raise Exception('No output URL received from Pixelcut')
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                                       type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise HostNotAllowed(f"{parts.hostname} does not resolve")
+    for *_, sockaddr in addresses:
+        if not is_public_address(sockaddr[0]):
+            raise HostNotAllowed(f"{parts.hostname} resolves to non-public address {sockaddr[0]}")
+
+# Fault types and what they do to one upstream call. Every fault accepts 'delay' (seconds first).
+#   latency: wait 'seconds', then make the real call (a read timeout if that exceeds the read timeout)
+#   drop: connection reset; connect_timeout: no connection within the connect timeout
+#   status: answer 'status' (default 500) with optional 'headers' and 'body'
+#   partial: declare the full 'body' but close after 'bytes' of it
+#   slowloris: deliver 'body' 'chunk' bytes every 'interval' seconds (a read timeout only if interval exceeds it)
+#   malformed_json: answer 200 with a truncated JSON body
+FAULT_KINDS = ('latency', 'drop', 'connect_timeout', 'status', 'partial', 'slowloris', 'malformed_json')
+FAULT_DEFAULT_BODY = b'{"output_url": "https://example.invalid/injected.png"}'
+
+class FaultPlan:
+    """Faults for one provider: fixed steps in call order, then a seeded random mix"""
+    
+    def __init__(self, steps=None, repeat=False, mix=None, seed=0):
+        self.steps = list(steps or [])
+        self.repeat = repeat
+        self.mix = list(mix or [])
+        for fault in self.steps + self.mix:
+            if fault is not None and fault.get('fault') not in FAULT_KINDS:
+                raise ValueError(f"Unknown fault {fault!r}; expected one of {', '.join(FAULT_KINDS)}")
+        self.injected = {}
+        self._random = random.Random(seed)
+        self._calls = 0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        if 'fault' in config:
+            return cls(mix=[config])
+        return cls(**config)
+    
+    def next_fault(self):
+        """The fault for the next call, or None to let it through"""
+        with self._lock:
+            index = self._calls
+            self._calls += 1
+            if self.steps and (index < len(self.steps) or self.repeat):
+                fault = self.steps[index % len(self.steps)]
             else:
-                raise Exception(f"Pixelcut API error: HTTP {response.status_code}")
-        
-        # Make request with automatic fallback
-        result = make_api_request_with_fallback(_make_upscale_request, 'upscale')
-        return jsonify(result)
-        
-    except Exception as e:
-        app.logger.error(f"Unexpected error in upscale endpoint: {str(e)}")
-        # Return dummy response as final fallback
-        dummy_response = create_dummy_response('upscale', 'Image upscale service temporarily unavailable')
-        return jsonify(dummy_response)
+                fault = None
+                roll = self._random.random()
+                for candidate in self.mix:
+                    roll -= candidate.get('rate', 1.0)
+                    if roll < 0:
+                        fault = candidate
+                        break
+            if fault is not None:
+                self.injected[fault['fault']] = self.injected.get(fault['fault'], 0) + 1
+            return fault
 
-@app.route('/api/unblur', methods=['POST'])
-def unblur_image():
-    """Enhance/sharpen image using Pixelcut API with graceful fallback"""
-    app.logger.info("=== UNBLUR REQUEST STARTED ===")
+def upstream_provider(url):
+    """Provider whose registered operation endpoint is url (None for other URLs)"""
+    url = url.split('?', 1)[0]
+    for spec in OPERATIONS.values():
+        for target in [spec, *spec.get('alternates', ())]:
+            if target.get('url', spec['url']) == url:
+                return target.get('provider', spec['provider'])
+    return None
+
+class FaultInjector:
+    """Per-provider fault plans consulted by the sync and async upstream clients"""
+    
+    def __init__(self, config=None):
+        self.plans = {provider: FaultPlan.from_config(plan) for provider, plan in (config or {}).items()}
+    
+    def next_fault(self, url):
+        plan = self.plans.get(upstream_provider(url))
+        return plan.next_fault() if plan is not None else None
     
+    def stats(self):
+        return {provider: dict(plan.injected) for provider, plan in self.plans.items()}
+
+fault_injector = FaultInjector(FAULT_INJECTION)
+if FAULT_INJECTION:
+    app.logger.warning("Upstream fault injection enabled for %s", ', '.join(sorted(FAULT_INJECTION)))
+
+@contextlib.contextmanager
+def inject_faults(provider, *steps, repeat=False, mix=None, seed=0):
+    """Apply a fault plan to provider's upstream calls for the duration of the block (for tests)"""
+    previous = fault_injector.plans.get(provider)
+    plan = fault_injector.plans[provider] = FaultPlan(steps, repeat, mix, seed)
     try:
-        # Validate file upload first
-        file, error = validate_image_upload(request)
-        if error:
-            return jsonify(error), 400
+        yield plan
+    finally:
+        if previous is None:
+            fault_injector.plans.pop(provider, None)
+        else:
+            fault_injector.plans[provider] = previous
+
+def fault_response(fault):
+    """Status, headers, declared body and bytes actually delivered for a fault that answers"""
+    kind = fault['fault']
+    body = fault.get('body')
+    if body is None:
+        body = b'{"error": "injected fault"}' if kind == 'status' else FAULT_DEFAULT_BODY
+    elif not isinstance(body, (bytes, str)):
+        body = json.dumps(body)
+    body = body.encode('utf-8') if isinstance(body, str) else body
+    if kind == 'malformed_json':
+        body = body[:max(1, len(body) // 2)]
+    delivered = fault.get('bytes', len(body) // 2) if kind == 'partial' else len(body)
+    headers = {
+        'Content-Type': fault.get('content_type', 'application/json'),
+        'Content-Length': str(len(body)),
+        **fault.get('headers', {})
+    }
+    return fault.get('status', 500 if kind == 'status' else 200), headers, body, delivered
+
+def split_timeout(timeout):
+    """(connect, read) seconds from a requests/httpx style timeout"""
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+class _FaultBody(io.RawIOBase):
+    """Response body delivering the first 'delivered' bytes, 'chunk' bytes every 'interval' seconds"""
+    
+    def __init__(self, url, body, delivered, chunk=None, interval=0.0, read_timeout=None):
+        self.url = url
+        self.data = body[:delivered]
+        self.position = 0
+        self.chunk = chunk or len(self.data) or 1
+        self.interval = interval
+        self.read_timeout = read_timeout
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if self.position >= len(self.data):
+            return 0
+        if self.interval:
+            if self.read_timeout is not None and self.interval > self.read_timeout:
+                time.sleep(self.read_timeout)
+                raise ReadTimeoutError(None, self.url, f"Read timed out. (read timeout={self.read_timeout})")
+            time.sleep(self.interval)
+        piece = self.data[self.position:self.position + min(self.chunk, len(buffer))]
+        buffer[:len(piece)] = piece
+        self.position += len(piece)
+        return len(piece)
+
+def send_with_fault(adapter, request, fault, timeout=None, **kwargs):
+    """Apply one injected fault to a sync upstream call, failing the way a real socket would"""
+    connect_timeout, read_timeout = split_timeout(timeout)
+    kind = fault['fault']
+    time.sleep(fault.get('delay', 0))
+    
+    if kind == 'latency':
+        if read_timeout is not None and fault.get('seconds', 0) > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.exceptions.ReadTimeout(f"Injected {fault['seconds']}s latency exceeds the read timeout", request=request)
+        time.sleep(fault.get('seconds', 0))
+        return HTTPAdapter.send(adapter, request, timeout=timeout, **kwargs)
+    if kind == 'drop':
+        raise requests.exceptions.ConnectionError(ConnectionResetError(104, 'Connection reset by peer (injected)'), request=request)
+    if kind == 'connect_timeout':
+        time.sleep(connect_timeout or 0)
+        raise requests.exceptions.ConnectTimeout('Injected connect timeout', request=request)
+    
+    status, headers, body, delivered = fault_response(fault)
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ''
+    slow = kind == 'slowloris'
+    raw = HTTPResponse(
+        body=_FaultBody(
+            request.url, body, delivered,
+            chunk=fault.get('chunk', 1) if slow else None,
+            interval=fault.get('interval', 1.0) if slow else 0.0,
+            read_timeout=read_timeout
+        ),
+        headers=headers,
+        status=status,
+        reason=reason,
+        preload_content=False,
+        decode_content=False,
+        request_url=request.url,
+        enforce_content_length=True
+    )
+    return adapter.build_response(request, raw)
+
+class MetricsRegistry:
+    """Prometheus counters and histograms aggregated per thread
+
+    Each thread only ever writes to its own shard, so recording takes no lock and
+    allocates nothing once a label set has been seen. Shards are summed at scrape time;
+    shards of finished threads are folded into a retired total so counters stay monotonic.
+    """
+    
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._families = {}  # name -> (type, help, label names, buckets)
+        self._local = threading.local()
+        self._shards = []  # (weakref to thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name, help_text, labels=()):
+        self._families[name] = ('counter', help_text, labels, None)
+    
+    def histogram(self, name, help_text, labels=(), buckets=METRICS_BUCKETS):
+        self._families[name] = ('histogram', help_text, labels, buckets)
+    
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._fold_finished()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+    
+    def inc(self, name, labels=(), amount=1):
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+    
+    def observe(self, name, labels, value):
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the running sum
+            counts = shard[key] = [0] * (len(self._families[name][3]) + 2)
+        counts[bisect.bisect_left(self._families[name][3], value)] += 1
+        counts[-1] += value
+    
+    @staticmethod
+    def _merge(total, shard):
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                merged = total.setdefault(key, [0] * len(value))
+                for index, count in enumerate(value):
+                    merged[index] += count
+            else:
+                total[key] = total.get(key, 0) + value
+    
+    def _fold_finished(self):
+        live = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is None or not thread.is_alive():
+                self._merge(self._retired, shard)
+            else:
+                live.append((thread_ref, shard))
+        self._shards = live
+    
+    def collect(self):
+        """Sum of every shard: {(name, label values): value or histogram counts}"""
+        with self._lock:
+            self._fold_finished()
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, shard)
+        return total
+    
+    def render(self):
+        """Text exposition format of every registered family"""
+        samples = self.collect()
+        lines = []
+        for name, (kind, help_text, label_names, buckets) in self._families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (family, labels), value in sorted(samples.items(), key=lambda item: item[0]):
+                if family != name:
+                    continue
+                pairs = list(zip(label_names, labels))
+                if kind == 'counter':
+                    lines.append(f'{name}{format_metric_labels(pairs)} {value:g}')
+                    continue
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_metric_labels(pairs + [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{format_metric_labels(pairs)} {value[-1]:g}')
+                lines.append(f'{name}_count{format_metric_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def format_metric_labels(pairs):
+    """{name="value",...} with Prometheus escaping, or '' without labels"""
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def format_metric_family(name, kind, help_text, samples):
+    """Exposition lines for a scrape-time family from (label pairs, value) samples"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines.extend(f'{name}{format_metric_labels(pairs)} {value:g}' for pairs, value in samples)
+    return lines
+
+metrics = MetricsRegistry()
+metrics.counter('http_requests_total', 'Requests served, by route, method and status', ('route', 'method', 'status'))
+metrics.histogram('http_request_duration_seconds', 'Time to produce a response, by route', ('route', 'method'))
+metrics.histogram('upstream_attempt_duration_seconds', 'Upstream attempt latency, by provider', ('provider',))
+metrics.counter('upstream_timeouts_total', 'Upstream attempts that timed out, by provider', ('provider',))
+metrics.counter('fallback_responses_total', 'Dummy fallback responses served, by endpoint', ('endpoint',))
+
+# Registered before any other request hook, so requests turned away early are still counted
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', (route, request.method, str(response.status_code)))
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe('http_request_duration_seconds', (route, request.method), time.perf_counter() - started)
+    return response
+
+class Span:
+    """One timed phase of a request"""
+    
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes')
+    
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+    
+    def end(self):
+        self.end_ns = time.time_ns()
+
+class Trace:
+    """Span tree of one request; request_id is the id the client and upstreams see"""
+    
+    def __init__(self, request_id, sampled, keep_logs=True):
+        self.trace_id = os.urandom(16).hex()
+        self.request_id = request_id
+        self.sampled = sampled
+        self.keep_logs = keep_logs
+        self.spans = []
+    
+    def start_span(self, name, parent_id=None, **attributes):
+        span = Span(self, name, parent_id, attributes)
+        if self.sampled:
+            self.spans.append(span)
+        return span
+    
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'request_id': self.request_id,
+            'spans': [{
+                'name': span.name,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'start': span.start_ns / 1e9,
+                'duration_ms': round(((span.end_ns or span.start_ns) - span.start_ns) / 1e6, 3),
+                'attributes': span.attributes
+            } for span in self.spans]
+        }
+
+def clean_request_id(value):
+    """A client-supplied request id if it is short and plain enough to echo and forward"""
+    if value and len(value) <= 64 and value.replace('-', '').replace('_', '').replace('.', '').isalnum():
+        return value
+    return None
+
+def start_trace(name, request_id=None, path=None, **attributes):
+    """Begin a request's trace and make its root span current"""
+    sampled = TRACE_EXPORT != 'none' and random.random() < TRACE_SAMPLE_RATE
+    keep_logs = path is None or random.random() < log_sample_rate(path)
+    trace = Trace(clean_request_id(request_id) or uuid.uuid4().hex, sampled, keep_logs)
+    root = trace.start_span(name, kind='server', **attributes)
+    _current_span.set(root)
+    return root
+
+def finish_trace(root):
+    """End the root span, clear the current span and queue the trace for export"""
+    root.end()
+    _current_span.set(None)
+    if root.trace.sampled:
+        trace_exporter.submit(root.trace)
+
+@contextlib.contextmanager
+def trace_span(name, **attributes):
+    """Time a phase as a child of the current span (a no-op outside a sampled trace)"""
+    parent = _current_span.get()
+    if parent is None or not parent.trace.sampled:
+        yield None
+        return
+    
+    span = parent.trace.start_span(name, parent.span_id, **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.attributes['error'] = f"{type(e).__name__}: {e}"[:200]
+        raise
+    finally:
+        span.end()
+        _current_span.reset(token)
+
+def trace_headers():
+    """X-Request-ID and W3C traceparent for an upstream call made within the current request"""
+    span = _current_span.get()
+    if span is None:
+        return {}
+    return {
+        'X-Request-ID': span.trace.request_id,
+        'traceparent': f"00-{span.trace.trace_id}-{span.span_id}-{'01' if span.trace.sampled else '00'}"
+    }
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def otlp_payload(traces):
+    """OTLP/HTTP JSON body for a batch of finished traces"""
+    spans = []
+    for trace in traces:
+        for span in trace.spans:
+            attributes = {**span.attributes, 'request.id': trace.request_id}
+            kind = attributes.pop('kind', None)
+            spans.append({
+                'traceId': trace.trace_id,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_id or '',
+                'name': span.name,
+                'kind': 2 if kind == 'server' else 1,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns or span.start_ns),
+                'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()],
+                'status': {'code': 2 if 'error' in attributes else 0}
+            })
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': TRACE_SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': 'aifreeset'}, 'spans': spans}]
+    }]}
+
+class TraceExporter:
+    """Writes finished traces from a background thread, so requests never wait on export"""
+    
+    def __init__(self, mode=TRACE_EXPORT, path=TRACE_FILE, endpoint=TRACE_OTLP_ENDPOINT, max_queue=TRACE_QUEUE_SIZE):
+        self.mode = mode
+        self.path = path
+        self.endpoint = endpoint
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def submit(self, trace):
+        # The thread is started lazily so it is created after gunicorn forks
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+    
+    def flush(self):
+        """Wait until every queued trace has been exported"""
+        if self._thread is not None:
+            self._queue.join()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 64:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                app.logger.warning("Trace export failed: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def export(self, traces):
+        if self.mode == 'file':
+            with open(self.path, 'a', encoding='utf-8') as output:
+                output.write(''.join(json.dumps(trace.to_dict()) + '\n' for trace in traces))
+        elif self.mode == 'otlp':
+            response = requests.post(self.endpoint, json=otlp_payload(traces), timeout=5)
+            response.raise_for_status()
+    
+    def stats(self):
+        return {
+            'export': self.mode,
+            'sample_rate': TRACE_SAMPLE_RATE,
+            'exported': self.exported,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'queued': self._queue.qsize()
+        }
+
+trace_exporter = TraceExporter()
+
+@app.before_request
+def start_request_trace():
+    g.trace_root = start_trace(
+        f"{request.method} {request.path}", request.headers.get('X-Request-ID'), request.path, method=request.method
+    )
+
+@app.after_request
+def tag_request_trace(response):
+    root = g.get('trace_root')
+    if root is not None:
+        root.attributes['status_code'] = response.status_code
+        if request.url_rule:
+            root.name = f"{request.method} {request.url_rule.rule}"
+        response.headers['X-Request-ID'] = root.trace.request_id
+    return response
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    root = g.pop('trace_root', None)
+    if root is not None:
+        finish_trace(root)
+
+class LatencyHistogram:
+    """Bucketed latency histogram over a sliding window of the current and previous interval"""
+    
+    def __init__(self, window_seconds=LATENCY_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._current = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._previous = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _rotate(self, now):
+        elapsed = now - self._rotated_at
+        if elapsed < self.window_seconds:
+            return
+        self._previous = self._current if elapsed < 2 * self.window_seconds else [0] * len(self._current)
+        self._current = [0] * len(self._current)
+        self._rotated_at = now
+    
+    def observe(self, seconds):
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            self._rotate(time.monotonic())
+            self._current[index] += 1
+    
+    def _counts(self):
+        with self._lock:
+            self._rotate(time.monotonic())
+            return [current + previous for current, previous in zip(self._current, self._previous)]
+    
+    def count(self):
+        return sum(self._counts())
+    
+    def percentile(self, q, counts=None):
+        """Upper bound of the bucket holding the q-th quantile, or None when empty"""
+        counts = counts or self._counts()
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank:
+                return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+    
+    def snapshot(self):
+        counts = self._counts()
+        return {
+            'count': sum(counts),
+            'p50': self.percentile(0.5, counts),
+            'p95': self.percentile(0.95, counts),
+            'p99': self.percentile(0.99, counts)
+        }
+
+# Attempt latency per provider and connect latency per host
+_latency_histograms = {}
+_connect_histograms = {}
+_histograms_lock = threading.Lock()
+
+def _get_histogram(histograms, key):
+    histogram = histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = histograms.setdefault(key, LatencyHistogram())
+    return histogram
+
+def record_provider_latency(provider, seconds):
+    _get_histogram(_latency_histograms, provider).observe(seconds)
+    metrics.observe('upstream_attempt_duration_seconds', (provider,), seconds)
+
+def record_connect_latency(host, seconds):
+    _get_histogram(_connect_histograms, host).observe(seconds)
+
+def upstream_timeouts(provider, api_url, ceiling):
+    """(connect, read) timeouts from the upstream's observed latency, clamped to the floors and ceilings
+
+    Each side keeps its static ceiling until ADAPTIVE_TIMEOUT_MIN_SAMPLES calls have been seen.
+    """
+    connect, read = min(CONNECT_TIMEOUT_CEILING, ceiling), ceiling
+    if not ADAPTIVE_TIMEOUTS:
+        return connect, read
+    
+    histogram = _latency_histograms.get(provider)
+    if histogram and histogram.count() >= ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+        observed = histogram.percentile(ADAPTIVE_TIMEOUT_PERCENTILE) * ADAPTIVE_TIMEOUT_MULTIPLIER
+        read = min(ceiling, max(READ_TIMEOUT_FLOOR, observed))
+    
+    histogram = _connect_histograms.get(urlsplit(api_url).hostname)
+    if histogram and histogram.count() >= ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+        observed = histogram.percentile(ADAPTIVE_TIMEOUT_PERCENTILE) * ADAPTIVE_TIMEOUT_MULTIPLIER
+        connect = min(connect, max(CONNECT_TIMEOUT_FLOOR, observed))
+    return connect, read
+
+def get_latency_stats():
+    """Latency percentiles per provider and connect percentiles per host"""
+    return {
+        'adaptive_timeouts': ADAPTIVE_TIMEOUTS,
+        'providers': {name: histogram.snapshot() for name, histogram in list(_latency_histograms.items())},
+        'connect': {host: histogram.snapshot() for host, histogram in list(_connect_histograms.items())}
+    }
+
+class RetryableUpstreamError(Exception):
+    """Upstream answered with an HTTP status that is worth retrying"""
+    
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f"HTTP {status_code}")
+        self.status_code = status_code
+
+# Exceptions that trigger another attempt; anything else fails the call immediately
+UPSTREAM_RETRY_EXCEPTIONS = (
+    RetryableUpstreamError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError
+)
+
+# Retry counters per upstream provider
+_retry_stats = {}
+_retry_stats_lock = threading.Lock()
+
+def record_retry_event(provider, event):
+    """Increment a retry counter (calls, attempts, retries, successes, failures, budget_exhausted)"""
+    with _retry_stats_lock:
+        stats = _retry_stats.setdefault(provider, {
+            'calls': 0, 'attempts': 0, 'retries': 0,
+            'successes': 0, 'failures': 0, 'budget_exhausted': 0
+        })
+        stats[event] += 1
+
+def get_retry_stats():
+    """Snapshot of retry counters with attempts spent per call"""
+    with _retry_stats_lock:
+        providers = {provider: dict(stats) for provider, stats in _retry_stats.items()}
+    
+    for stats in providers.values():
+        stats['attempts_per_call'] = round(stats['attempts'] / stats['calls'], 3) if stats['calls'] else 0.0
+    
+    return {
+        'max_attempts': RETRY_MAX_ATTEMPTS,
+        'budget_seconds': RETRY_BUDGET_SECONDS,
+        'providers': providers
+    }
+
+class RetryPolicy:
+    """Attempt limit, wall-clock budget and jittered backoff for upstream calls"""
+    
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, budget_seconds=RETRY_BUDGET_SECONDS,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.budget_seconds = budget_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def start(self, provider):
+        """Open a fresh budget for one logical upstream request, drawing on the operation's budget if one is open"""
+        record_retry_event(provider, 'calls')
+        return RetryBudget(self, provider, shared=_operation_budget.get())
+
+class RetryBudget:
+    """Attempts and time remaining for a single logical upstream request"""
+    
+    def __init__(self, policy, provider, shared=None):
+        self.policy = policy
+        self.provider = provider
+        self.shared = shared
+        self.attempts = 0
+        self.started = time.monotonic()
+        self.deadline = shared.deadline if shared is not None else self.started + policy.budget_seconds
+        self._lock = threading.Lock()
+    
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+    
+    def total_attempts(self):
+        """Attempts spent here plus, under a shared budget, by every other target and hedge"""
+        return self.shared.attempts if self.shared is not None else self.attempts
+    
+    def begin_attempt(self, timeout):
+        """Count an attempt and return its timeout clipped to the remaining budget"""
+        self.attempts += 1
+        if self.shared is not None:
+            # Hedged targets spend from the shared budget concurrently
+            with self.shared._lock:
+                self.shared.attempts += 1
+        record_retry_event(self.provider, 'attempts')
+        return max(RETRY_MIN_ATTEMPT_SECONDS, min(timeout, self.remaining()))
+    
+    def next_delay(self, error):
+        """Return a full-jitter backoff delay, or raise once attempts or time run out"""
+        delay = random.uniform(0, min(self.policy.max_delay, self.policy.base_delay * (2 ** (self.attempts - 1))))
+        
+        if self.total_attempts() >= self.policy.max_attempts or self.remaining() - delay < RETRY_MIN_ATTEMPT_SECONDS:
+            elapsed = time.monotonic() - self.started
+            record_retry_event(self.provider, 'budget_exhausted')
+            record_retry_event(self.provider, 'failures')
+            raise Exception(f"{self.provider} failed after {self.attempts} attempts in {elapsed:.1f}s: {error}")
+        
+        record_retry_event(self.provider, 'retries')
+        return delay
+    
+    def succeeded(self):
+        record_retry_event(self.provider, 'successes')
+    
+    def failed(self):
+        record_retry_event(self.provider, 'failures')
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# Budget shared by every target and hedge of the current call_operation(); hedge threads and tasks inherit it
+_operation_budget = contextvars.ContextVar('operation_budget', default=None)
+
+@contextlib.contextmanager
+def operation_retry_budget(operation):
+    """Open one retry budget that all providers tried for this operation draw from"""
+    token = _operation_budget.set(RetryBudget(DEFAULT_RETRY_POLICY, operation))
+    try:
+        yield
+    finally:
+        _operation_budget.reset(token)
+
+def call_with_retry(provider, send_request, timeout, policy=None, api_url=None):
+    """Run send_request(attempt_timeout) under the shared retry budget
+
+    With api_url, timeout is only the ceiling: attempts get a (connect, read) tuple derived
+    from the upstream's observed latency.
+    """
+    # Upstreams with a bulkhead hold one of its slots for the whole logical request
+    with trace_span('upstream', provider=provider), BULKHEADS.get(provider) or contextlib.nullcontext():
+        budget = (policy or DEFAULT_RETRY_POLICY).start(provider)
+        connect_timeout, read_timeout = upstream_timeouts(provider, api_url, timeout) if api_url else (None, timeout)
         
-        filename = secure_filename(file.filename)
-        app.logger.info(f"Processing unblur for: {filename}")
+        while True:
+            try:
+                rate_limiter.acquire(provider, max(0.0, budget.remaining() - RETRY_MIN_ATTEMPT_SECONDS))
+            except RateLimited:
+                budget.failed()
+                raise
+            
+            attempt_timeout = budget.begin_attempt(read_timeout)
+            started = time.monotonic()
+            try:
+                with trace_span('attempt', number=budget.attempts, timeout=round(attempt_timeout, 2)):
+                    app.logger.debug("%s request attempt %s/%s (timeout %.1fs)", provider, budget.attempts, budget.policy.max_attempts, attempt_timeout)
+                    result = send_request((min(connect_timeout, attempt_timeout), attempt_timeout) if api_url else attempt_timeout)
+            except UPSTREAM_RETRY_EXCEPTIONS as e:
+                if isinstance(e, requests.exceptions.Timeout):
+                    metrics.inc('upstream_timeouts_total', (provider,))
+                if isinstance(e, requests.exceptions.ReadTimeout):
+                    # A timed-out attempt still tells us the upstream took at least this long
+                    record_provider_latency(provider, time.monotonic() - started)
+                delay = budget.next_delay(e)
+                app.logger.warning("%s attempt %s failed: %s, retrying in %.2fs", provider, budget.attempts, e, delay)
+                with trace_span('backoff', seconds=round(delay, 3)):
+                    time.sleep(delay)
+                continue
+            except Exception:
+                budget.failed()
+                raise
+            
+            record_provider_latency(provider, time.monotonic() - started)
+            budget.succeeded()
+            return result
+
+def check_upstream_status(response, label='API'):
+    """Raise for non-200 upstream responses, marking retryable statuses"""
+    if response.status_code == 200:
+        return
+    if response.status_code in RETRYABLE_STATUS_CODES:
+        raise RetryableUpstreamError(response.status_code, f"{label} error: HTTP {response.status_code}")
+    if response.status_code == 401:
+        app.logger.error("%s authentication failed - Status: %s", label, response.status_code)
+        raise Exception(f"{label} authentication failed - check API key")
+    raise Exception(f"{label} error: HTTP {response.status_code} - {response.text[:200]}")
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by the failure rate over a sliding window"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name, failure_rate=CIRCUIT_FAILURE_RATE, min_calls=CIRCUIT_MIN_CALLS,
+                 window_seconds=CIRCUIT_WINDOW_SECONDS, open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.short_circuited = 0
+        self._outcomes = deque(maxlen=1000)  # (timestamp, succeeded)
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def _prune(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+    
+    def allow_request(self):
+        """Return True if a call may go upstream; half-open lets a single probe through"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                app.logger.info("Circuit %s half-open, sending recovery probe", self.name)
+            
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            
+            self.short_circuited += 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                app.logger.info("Circuit %s closed after successful probe", self.name)
+                self.state = self.CLOSED
+                self._probe_in_flight = False
+                self._outcomes.clear()
+            self._outcomes.append((now, True))
+            self._prune(now)
+    
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                self._trip(now)
+                return
+            
+            self._outcomes.append((now, False))
+            self._prune(now)
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            if (self.state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._trip(now)
+    
+    def record_ignored(self):
+        """The call never reached the upstream (e.g. its bulkhead was full); frees a half-open probe slot"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def _trip(self, now):
+        app.logger.warning("Circuit %s opened for %.0fs", self.name, self.open_seconds)
+        self.state = self.OPEN
+        self.opened_at = now
+        self._probe_in_flight = False
+        self._outcomes.clear()
+    
+    def snapshot(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            return {
+                'state': self.state,
+                'window_calls': len(self._outcomes),
+                'window_failures': failures,
+                'short_circuited': self.short_circuited
+            }
+
+CIRCUIT_BREAKERS = {name: CircuitBreaker(name) for name in sorted(PROVIDERS)}
+
+def get_circuit_breaker(endpoint_type):
+    """Return the breaker guarding the upstream behind endpoint_type (None if unknown)"""
+    return CIRCUIT_BREAKERS.get(ENDPOINT_UPSTREAMS.get(endpoint_type))
+
+def get_circuit_stats():
+    """Snapshot of every upstream circuit breaker"""
+    return {name: breaker.snapshot() for name, breaker in CIRCUIT_BREAKERS.items()}
+
+class BulkheadFull(Exception):
+    """An upstream's bulkhead had no free slot within its queue limits"""
+    
+    def __init__(self, provider, message, retry_after=BULKHEAD_QUEUE_TIMEOUT):
+        super().__init__(message)
+        self.provider = provider
+        self.retry_after = retry_after
+
+def bulkhead_limits(provider, max_concurrent=BULKHEAD_MAX_CONCURRENT):
+    """Bulkhead settings for provider: the defaults overridden by its BULKHEAD_LIMITS entry"""
+    return {
+        'max_concurrent': max_concurrent,
+        'max_queue': BULKHEAD_MAX_QUEUE,
+        'queue_timeout': BULKHEAD_QUEUE_TIMEOUT,
+        **BULKHEAD_LIMITS.get(provider, {})
+    }
+
+class Bulkhead:
+    """Caps concurrent calls to one upstream; extra callers wait in a bounded queue for up to queue_timeout"""
+    
+    def __init__(self, name, max_concurrent=BULKHEAD_MAX_CONCURRENT, max_queue=BULKHEAD_MAX_QUEUE,
+                 queue_timeout=BULKHEAD_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        """Take a slot, raising BulkheadFull at once if the queue is full or after queue_timeout"""
+        with self._condition:
+            # Waiting callers go first, so a newcomer can't take a slot just freed for them
+            if self.in_flight < self.max_concurrent and not self.queued:
+                self.in_flight += 1
+                return
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise BulkheadFull(self.name, f"{self.name} is at capacity ({self.in_flight} in flight, {self.queued} queued)")
+            
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise BulkheadFull(self.name, f"{self.name} is at capacity (no slot within {self.queue_timeout:.1f}s)")
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+    
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    def snapshot(self):
+        with self._condition:
+            return {
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out
+            }
+
+BULKHEADS = {name: Bulkhead(name, **bulkhead_limits(name)) for name in sorted(PROVIDERS)}
+
+def get_bulkhead_stats():
+    """Snapshot of every upstream bulkhead"""
+    return {name: bulkhead.snapshot() for name, bulkhead in BULKHEADS.items()}
+
+def bulkhead_fallback(endpoint_type, error):
+    """Dummy response for a call turned away by a full bulkhead, or re-raise it when BULKHEAD_ON_FULL is 'reject'"""
+    if BULKHEAD_ON_FULL == 'reject':
+        raise error
+    app.logger.warning("%s, returning dummy response for %s", error, endpoint_type)
+    return create_dummy_response(endpoint_type, f"{str(error)}, using dummy response")
+
+class RateLimited(BulkheadFull):
+    """The provider's rate limit has no request slot within the caller's wait limit
+
+    Handled like a full bulkhead: the call never reached the upstream.
+    """
+
+def parse_retry_after(value, now):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+def _header_number(headers, *names):
+    """First of names present in headers as a number (None if absent or not numeric)"""
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+class MemoryRateLimitStore:
+    """Rate-limit state in a process-local dict (single worker or local testing)"""
+    
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def update(self, key, apply):
+        """Run apply(state) on key's state dict atomically and return its result"""
+        with self._lock:
+            return apply(self._buckets.setdefault(key, {}))
+    
+    def items(self):
+        with self._lock:
+            return {key: dict(state) for key, state in self._buckets.items()}
+
+class SQLiteRateLimitStore:
+    """Rate-limit state in a local SQLite file, so every worker process draws from the same buckets"""
+    
+    def __init__(self, path=RATE_LIMIT_STORE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, data TEXT NOT NULL)')
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+    
+    def update(self, key, apply):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM buckets WHERE key = ?', (key,)).fetchone()
+            state = json.loads(row[0]) if row else {}
+            result = apply(state)
+            conn.execute('INSERT OR REPLACE INTO buckets (key, data) VALUES (?, ?)', (key, json.dumps(state)))
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+    
+    def items(self):
+        with self._connect() as conn:
+            return {key: json.loads(data) for key, data in conn.execute('SELECT key, data FROM buckets')}
+
+def _count(state, field, amount=1):
+    state[field] = state.get(field, 0) + amount
+
+class RateLimiter:
+    """Token bucket per provider API key, also paced by the upstream's Retry-After and X-RateLimit headers
+
+    A bucket is kept as the time its next request is due (GCRA), so callers over the rate
+    are queued at evenly spaced slots instead of bursting and collecting 429s.
+    """
+    
+    def __init__(self, store, limits=None, max_wait=RATE_LIMIT_MAX_WAIT):
+        self.store = store
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.max_wait = max_wait
+    
+    def _limit(self, provider):
+        limit = self.limits.get(provider) or {}
+        rate = float(limit.get('rate') or 0)
+        return rate, max(1, int(limit.get('burst', math.ceil(rate) or 1)))
+    
+    def reserve(self, provider, max_wait=None):
+        """Claim provider's next request slot and return the seconds until it; RateLimited if that's over max_wait"""
+        if provider not in PROVIDERS:
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        rate, burst = self._limit(provider)
+        interval = 1 / rate if rate else 0.0
+        
+        def _reserve(state):
+            now = time.time()
+            due = max(state.get('due_at', now), now)
+            start = max(now, due - (burst - 1) * interval, state.get('blocked_until', 0))
+            if state.get('remaining') == 0 and state.get('reset_at', 0) > now:
+                start = max(start, state['reset_at'])
+            wait = start - now
+            if wait > max_wait:
+                _count(state, 'rejected')
+                return False, wait
+            state['due_at'] = max(due, start) + interval
+            if state.get('remaining'):
+                state['remaining'] -= 1
+            if wait > 0:
+                _count(state, 'throttled')
+                _count(state, 'waited_seconds', wait)
+            return True, wait
+        
+        reserved, wait = self.store.update(provider, _reserve)
+        if not reserved:
+            raise RateLimited(provider, f"{provider} is rate limited (next request slot in {wait:.1f}s)", retry_after=wait)
+        return wait
+    
+    def acquire(self, provider, max_wait=None):
+        """Block until provider's next request slot (see reserve)"""
+        wait = self.reserve(provider, max_wait)
+        if wait > 0:
+            app.logger.info("%s rate limit: waiting %.2fs for a request slot", provider, wait)
+            with trace_span('rate_limit_wait', seconds=round(wait, 3)):
+                time.sleep(wait)
+    
+    def observe(self, provider, response):
+        """Update provider's bucket from a response's status and rate-limit headers"""
+        if provider not in PROVIDERS:
+            return
+        headers = response.headers
+        now = time.time()
+        retry_after = parse_retry_after(headers.get('Retry-After'), now)
+        remaining = _header_number(headers, 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+        limit = _header_number(headers, 'X-RateLimit-Limit', 'RateLimit-Limit')
+        reset = _header_number(headers, 'X-RateLimit-Reset', 'RateLimit-Reset')
+        if response.status_code != 429 and retry_after is None and remaining is None and reset is None:
+            return
+        
+        def _observe(state):
+            if remaining is not None:
+                state['remaining'] = int(remaining)
+            if limit is not None:
+                state['limit'] = int(limit)
+            if reset is not None:
+                # Providers send either an epoch timestamp or seconds from now
+                state['reset_at'] = reset if reset > 1e9 else now + reset
+            
+            pause = None
+            if response.status_code == 429:
+                _count(state, 'upstream_429')
+                if retry_after is not None:
+                    pause = retry_after
+                else:
+                    pause = max(0.0, state.get('reset_at', 0) - now) or RATE_LIMIT_DEFAULT_COOLDOWN
+            elif response.status_code == 503:
+                pause = retry_after
+            if pause:
+                state['blocked_until'] = max(state.get('blocked_until', 0), now + pause)
+            return pause
+        
+        pause = self.store.update(provider, _observe)
+        if pause:
+            app.logger.warning("%s answered HTTP %s, pausing its requests for %.1fs", provider, response.status_code, pause)
+    
+    def snapshot(self):
+        """Remaining-quota gauges and throttling counters per provider"""
+        now = time.time()
+        states = self.store.items()
+        stats = {}
+        for provider in sorted(set(PROVIDERS) | set(states)):
+            state = states.get(provider, {})
+            rate, burst = self._limit(provider)
+            reset_at = state.get('reset_at')
+            stats[provider] = {
+                'rate': rate or None,
+                'burst': burst if rate else None,
+                # Negative while callers are queued for future slots
+                'tokens': round(burst - max(0.0, state.get('due_at', now) - now) * rate, 2) if rate else None,
+                'upstream_limit': state.get('limit'),
+                'upstream_remaining': state.get('remaining'),
+                'reset_in': round(max(0.0, reset_at - now), 1) if reset_at else None,
+                'paused_for': round(max(0.0, state.get('blocked_until', 0) - now), 1),
+                'throttled': state.get('throttled', 0),
+                'waited_seconds': round(state.get('waited_seconds', 0), 2),
+                'rejected': state.get('rejected', 0),
+                'upstream_429': state.get('upstream_429', 0)
+            }
+        return stats
+
+def create_rate_limit_store():
+    """Build the rate-limit store selected by RATE_LIMIT_STORE"""
+    if RATE_LIMIT_STORE == 'sqlite':
+        app.logger.info("Using SQLite rate-limit store at %s", RATE_LIMIT_STORE_PATH)
+        return SQLiteRateLimitStore(RATE_LIMIT_STORE_PATH)
+    return MemoryRateLimitStore()
+
+rate_limiter = RateLimiter(create_rate_limit_store())
+
+def get_rate_limit_stats():
+    """Snapshot of the client-side rate limiter"""
+    return {
+        'store': RATE_LIMIT_STORE,
+        'max_wait_seconds': RATE_LIMIT_MAX_WAIT,
+        'providers': rate_limiter.snapshot()
+    }
+
+def inbound_rate_limit(method, path):
+    """Requests allowed per window for a client on this route (0 if the route isn't limited)"""
+    if method != 'POST' or not path.startswith('/api/'):
+        return 0
+    return INBOUND_ROUTE_LIMITS.get(path, INBOUND_RATE_LIMIT)
+
+def inbound_client_id(headers, remote_addr):
+    """Identify the caller by API key when it is one of INBOUND_API_KEYS, else by IP address"""
+    authorization = headers.get('Authorization', '')
+    token = headers.get('X-API-Key') or (authorization[7:] if authorization.startswith('Bearer ') else None)
+    # Made-up tokens would each get a fresh budget, so only issued keys are trusted
+    if token and token in INBOUND_API_KEYS:
+        return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+    if INBOUND_TRUSTED_PROXIES:
+        # Each trusted proxy appends the address it saw; the client is the one before them
+        forwarded = [hop.strip() for hop in headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(forwarded) >= INBOUND_TRUSTED_PROXIES:
+            return 'ip:' + forwarded[-INBOUND_TRUSTED_PROXIES]
+    return f'ip:{remote_addr}'
+
+def _window_hit(counts, limit, window_seconds, now):
+    """Count one request in counts ([window index, current, previous]) if the sliding estimate allows it
+
+    Returns (allowed, remaining, retry_after); the estimate weights the previous window's
+    count by how much of it still overlaps the trailing window.
+    """
+    position = now / window_seconds
+    index = int(position)
+    if counts[0] != index:
+        counts[2] = counts[1] if counts[0] == index - 1 else 0
+        counts[0], counts[1] = index, 0
+    elapsed = position - index
+    current, previous = counts[1], counts[2]
+    estimate = previous * (1 - elapsed) + current
+    if estimate + 1 <= limit:
+        counts[1] += 1
+        return True, int(limit - estimate - 1), 0.0
+    
+    if current + 1 <= limit:
+        # Wait for enough of the previous window to slide out
+        retry_after = (1 - (limit - current - 1) / previous - elapsed) * window_seconds
+    else:
+        # This window is used up; wait into the next one until its share has decayed enough
+        retry_after = (1 - elapsed + max(0.0, 1 - (limit - 1) / current)) * window_seconds
+    return False, 0, max(0.0, retry_after)
+
+class MemoryWindowStore:
+    """Sliding-window counters in a bounded process-local LRU, three numbers per client and route"""
+    
+    def __init__(self, max_clients=INBOUND_RATE_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def hit(self, key, limit, window_seconds, now):
+        with self._lock:
+            counts = self._windows.get(key)
+            if counts is None:
+                counts = self._windows[key] = [0, 0, 0]
+                if len(self._windows) > self.max_clients:
+                    self._windows.popitem(last=False)
+            else:
+                self._windows.move_to_end(key)
+            return _window_hit(counts, limit, window_seconds, now)
+    
+    def __len__(self):
+        return len(self._windows)
+
+class SQLiteWindowStore:
+    """Sliding-window counters in a local SQLite file, so limits hold across worker processes"""
+    
+    def __init__(self, path=INBOUND_RATE_STORE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS windows ('
+                'key TEXT PRIMARY KEY, window INTEGER NOT NULL, current INTEGER NOT NULL, previous INTEGER NOT NULL)'
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+    
+    def hit(self, key, limit, window_seconds, now):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT window, current, previous FROM windows WHERE key = ?', (key,)).fetchone()
+            counts = list(row) if row else [0, 0, 0]
+            result = _window_hit(counts, limit, window_seconds, now)
+            conn.execute('INSERT OR REPLACE INTO windows (key, window, current, previous) VALUES (?, ?, ?, ?)', (key, *counts))
+            if random.random() < 0.01:
+                # Clients idle for two windows carry no weight any more
+                conn.execute('DELETE FROM windows WHERE window < ?', (counts[0] - 1,))
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+    
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM windows').fetchone()[0]
+
+class InboundRateLimiter:
+    """Per-client, per-route sliding-window limits for the upstream-backed endpoints"""
+    
+    def __init__(self, store, window_seconds=INBOUND_RATE_WINDOW_SECONDS):
+        self.store = store
+        self.window_seconds = window_seconds
+        self.rejected = {}
+        self._lock = threading.Lock()
+    
+    def hit(self, client_id, path, limit):
+        """Count a request; returns (allowed, remaining, retry_after)"""
+        allowed, remaining, retry_after = self.store.hit(f'{client_id}|{path}', limit, self.window_seconds, time.time())
+        if not allowed:
+            with self._lock:
+                self.rejected[path] = self.rejected.get(path, 0) + 1
+        return allowed, remaining, retry_after
+    
+    def stats(self):
+        with self._lock:
+            rejected = dict(self.rejected)
+        return {
+            'store': INBOUND_RATE_STORE,
+            'limit': INBOUND_RATE_LIMIT,
+            'route_limits': INBOUND_ROUTE_LIMITS,
+            'window_seconds': self.window_seconds,
+            'tracked': len(self.store),
+            'rejected': rejected
+        }
+
+def create_inbound_rate_store():
+    """Build the inbound rate-limit store selected by INBOUND_RATE_STORE"""
+    if INBOUND_RATE_STORE == 'sqlite':
+        app.logger.info("Using SQLite inbound rate-limit store at %s", INBOUND_RATE_STORE_PATH)
+        return SQLiteWindowStore(INBOUND_RATE_STORE_PATH)
+    return MemoryWindowStore()
+
+inbound_limiter = InboundRateLimiter(create_inbound_rate_store())
+
+def inbound_rate_headers(limit, remaining, retry_after=None):
+    """X-RateLimit-* headers for a limited route, plus Retry-After on rejection"""
+    headers = {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining)}
+    if retry_after is not None:
+        headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return headers
+
+def inbound_rejection(limit):
+    """Body of the 429 sent to a client over its limit"""
+    return {'success': False, 'error': f'Rate limit exceeded: {limit} requests per {INBOUND_RATE_WINDOW_SECONDS:.0f}s'}
+
+@app.before_request
+def enforce_inbound_rate_limit():
+    """Answer 429 to clients over their limit before the upload is read or validated"""
+    limit = inbound_rate_limit(request.method, request.path)
+    if not limit:
+        return None
+    allowed, remaining, retry_after = inbound_limiter.hit(
+        inbound_client_id(request.headers, request.remote_addr), request.path, limit
+    )
+    if allowed:
+        g.inbound_rate_headers = inbound_rate_headers(limit, remaining)
+        return None
+    
+    app.logger.warning("Rate limit exceeded on %s by %s", request.path, request.remote_addr)
+    response = jsonify(inbound_rejection(limit))
+    response.status_code = 429
+    response.headers.update(inbound_rate_headers(limit, 0, retry_after))
+    return response
+
+@app.after_request
+def add_inbound_rate_headers(response):
+    headers = g.pop('inbound_rate_headers', None)
+    if headers:
+        response.headers.update(headers)
+    return response
+
+def _cache_value_size(value):
+    """Approximate in-memory footprint of a cached value"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k)) + _cache_value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_cache_value_size(v) for v in value)
+    return 8
+
+def _encode_cache_bytes(value):
+    """json.dumps() hook so binary results survive the on-disk tier"""
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _decode_cache_bytes(obj):
+    if len(obj) == 1 and '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+class ResultCache:
+    """In-memory LRU (entry, byte and TTL bounded) with an optional on-disk tier
+
+    The disk tier is bounded too: writes periodically sweep it, deleting expired files and then
+    the oldest ones (by mtime) until it is back under its entry and byte caps.
+    """
+    
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds=RESULT_CACHE_TTL_SECONDS, disk_dir=None, disk_max_entries=RESULT_CACHE_DISK_MAX_ENTRIES,
+                 disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES, sweep_seconds=RESULT_CACHE_DISK_SWEEP_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.sweep_seconds = sweep_seconds
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._written_since_sweep = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                       'disk_evictions': 0, 'disk_expirations': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+    
+    def get(self, key):
+        """Return the cached value or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return entry[2]
+                self._remove(key)
+                self._stats['expirations'] += 1
+        
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+        self._memory_set(key, value)
+        return value
+    
+    def set(self, key, value):
+        """Store a JSON-serializable value in both tiers"""
+        self._memory_set(key, value)
+        if self.disk_dir:
+            self._disk_set(key, json.dumps(value, default=_encode_cache_bytes))
+    
+    def _memory_set(self, key, value):
+        size = _cache_value_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl_seconds, size, value)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+    
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+    
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+    
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl_seconds <= now:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f, object_hook=_decode_cache_bytes)
+        except (OSError, ValueError):
+            return None
+    
+    def _disk_set(self, key, encoded):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)  # Atomic so other workers never read a partial entry
+        except OSError as e:
+            app.logger.warning("Result cache disk write failed: %s", e)
+            return
+        
+        # Sweep on a timer, or early once a tenth of the byte cap has been written since the last one
+        with self._sweep_lock:
+            self._written_since_sweep += len(encoded)
+            due = (time.time() - self._last_sweep >= self.sweep_seconds
+                   or self._written_since_sweep > self.disk_max_bytes / 10)
+            if due:
+                self._last_sweep, self._written_since_sweep = time.time(), 0
+        if due:
+            self.sweep_disk()
+    
+    def sweep_disk(self):
+        """Delete expired disk entries, then the oldest until the tier fits its entry and byte caps"""
+        if not self.disk_dir:
+            return
+        now = time.time()
+        files = []
+        expired = 0
+        for directory, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    # Leftover temp files from crashed writers age out with the entries
+                    if stat.st_mtime + self.ttl_seconds <= now:
+                        os.remove(path)
+                        expired += name.endswith('.json')
+                    elif name.endswith('.json'):
+                        files.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    continue  # Removed by another worker meanwhile
+        
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, path in files:
+            if len(files) - evicted <= self.disk_max_entries and total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            evicted += 1
+        
+        with self._lock:
+            self._stats['disk_expirations'] += expired
+            self._stats['disk_evictions'] += evicted
+        if expired or evicted:
+            app.logger.info("Result cache disk sweep: %s expired, %s evicted, %s bytes kept", expired, evicted, total)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['size_bytes'] = self.size_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['disk_tier'] = bool(self.disk_dir)
+        return stats
+
+result_cache = ResultCache(disk_dir=RESULT_CACHE_DIR)
+
+def make_result_cache_key(content_hash, operation, params=None):
+    """Cache key from the upload hash plus the operation and its parameters"""
+    key_material = f"{operation}|{json.dumps(params or {}, sort_keys=True)}|{content_hash}"
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+def cached_image_operation(file, endpoint_type, api_function, params=None):
+    """Serve an image operation from the result cache, calling api_function() (which handles its own fallback) on a miss"""
+    cache_key = make_result_cache_key(file.sha256, endpoint_type, params)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        app.logger.info("Result cache hit for %s", endpoint_type)
+        return cached, True
+    
+    result = api_function()
+    if result.get('success') and result.get('source') != 'dummy':
+        result_cache.set(cache_key, result)
+    return result, False
+
+result_store = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=RESULT_STORE_MAX_BYTES,
+    ttl_seconds=RESULT_STORE_TTL_SECONDS,
+    disk_dir=RESULT_STORE_DIR,
+    disk_max_entries=RESULT_STORE_DISK_MAX_ENTRIES,
+    disk_max_bytes=RESULT_STORE_DISK_MAX_BYTES
+)
+
+def is_result_id(result_id):
+    """Stored result ids are fixed-length lowercase hex, so nothing else reaches the filesystem"""
+    return len(result_id) == RESULT_ID_LENGTH and not result_id.strip('0123456789abcdef')
+
+def store_result_image(image_bytes, content_type):
+    """Keep binary output for later download and return its short id"""
+    result_id = hashlib.sha256(image_bytes).hexdigest()[:RESULT_ID_LENGTH]
+    result_store.set(result_id, {'image_bytes': image_bytes, 'content_type': content_type})
+    return result_id
+
+def get_response_mode(mode_param, accept_header):
+    """Pick json/binary/url from ?response= or an image/* Accept header"""
+    mode = (mode_param or '').lower()
+    if mode in RESPONSE_MODES:
+        return mode
+    preferred = (accept_header or '').split(',')[0].split(';')[0].strip().lower()
+    return 'binary' if preferred.startswith('image/') else 'json'
+
+def result_output_url(result):
+    """Output image URL of a URL-style result (dummy responses nest it under 'data')"""
+    return result.get('processed_image') or (result.get('data') or {}).get('processed_image')
+
+def prepare_image_result(result, mode, result_url):
+    """Decide how to send a result without base64 unless JSON needs it
+
+    Returns ('json', payload), ('binary', image_bytes, content_type) or ('redirect', url).
+    """
+    image_bytes = result.get('image_bytes')
+    if image_bytes is not None:
+        content_type = result.get('content_type', 'image/png')
+        if mode == 'binary':
+            return ('binary', image_bytes, content_type)
+        
+        payload = {k: v for k, v in result.items() if k not in ('image_bytes', 'content_type')}
+        if mode == 'url':
+            payload['processed_image'] = result_url(store_result_image(image_bytes, content_type))
+        else:
+            image_data = base64.b64encode(image_bytes).decode('utf-8')
+            payload['image_data'] = f"data:{content_type};base64,{image_data}"
+        return ('json', payload)
+    
+    if mode == 'binary':
+        output_url = result_output_url(result)
+        if output_url and not output_url.startswith('data:'):
+            return ('redirect', output_url)
+    return ('json', result)
+
+def cache_status_response(result, cache_hit):
+    """Render a result in the requested response mode and tag it with an X-Cache header"""
+    mode = get_response_mode(request.args.get('response'), request.headers.get('Accept'))
+    with trace_span('encode', mode=mode):
+        prepared = prepare_image_result(
+            result, mode, lambda result_id: url_for('get_stored_result', result_id=result_id, _external=True)
+        )
+        
+        if prepared[0] == 'binary':
+            response = Response(prepared[1], mimetype=prepared[2])
+        elif prepared[0] == 'redirect':
+            response = redirect(prepared[1], code=302)
+        else:
+            response = jsonify(prepared[1])
+    response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+    response.headers['X-Result-Source'] = result.get('source', 'api')
+    if 'upload_bytes_saved' in g:
+        response.headers['X-Upload-Bytes-Saved'] = str(g.upload_bytes_saved)
+    return response
+
+class _FlightCall:
+    """One in-progress call that concurrent duplicates wait on"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into a single execution"""
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'executions': 0, 'coalesced': 0}
+    
+    def do(self, key, fn):
+        """Run fn() once per key at a time; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+                self._stats['executions'] += 1
+            else:
+                self._stats['coalesced'] += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+ai_art_cache = ResultCache(max_entries=AI_ART_CACHE_MAX_ENTRIES, ttl_seconds=AI_ART_CACHE_TTL_SECONDS)
+ai_art_flight = SingleFlight()
+
+def normalize_prompt(prompt):
+    """Case- and whitespace-insensitive form of a prompt for cache keys"""
+    return ' '.join(prompt.split()).lower()
+
+def make_prompt_cache_key(prompt):
+    """Cache key from the normalized prompt plus the Qwen model and parameters"""
+    payload = build_qwen_payload(normalize_prompt(prompt))
+    key_material = json.dumps(payload, sort_keys=True)
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+def get_ai_art_cache_stats():
+    """Hit-rate and coalescing counters for /api/ai-art"""
+    return {'cache': ai_art_cache.stats(), 'single_flight': ai_art_flight.stats()}
+
+def create_dummy_response(endpoint_type, message="API temporarily unavailable, using dummy response"):
+    """Create standardized dummy fallback response for failed API calls"""
+    metrics.inc('fallback_responses_total', (endpoint_type,))
+    dummy_data = {
+        'background-remove': {
+            'processed_image': 'https://via.placeholder.com/512x512.png?text=Background+Removed',
+            'result': 'Background removal placeholder'
+        },
+        'upscale': {
+            'processed_image': 'https://via.placeholder.com/1024x1024.png?text=Upscaled+2x',
+            'result': 'Image upscaled placeholder'
+        },
+        'unblur': {
+            'processed_image': 'https://via.placeholder.com/512x512.png?text=Enhanced+Image',
+            'result': 'Image enhancement placeholder'
+        },
+        'watermark-remove': {
+            'processed_image': 'https://via.placeholder.com/512x512.png?text=Watermark+Removed',
+            'result': 'Watermark removal placeholder'
+        },
+        'ai-art': {
+            'processed_image': 'https://via.placeholder.com/1024x1024.png?text=AI+Generated+Art',
+            'text': 'This is a dummy AI-generated art response',
+            'result': 'AI art generation placeholder'
+        }
+    }
+    
+    return {
+        'success': True,
+        'source': 'dummy',
+        'error': message,
+        'data': dummy_data.get(endpoint_type, {
+            'processed_image': 'https://via.placeholder.com/512x512.png?text=Dummy+Response',
+            'result': 'Generic placeholder response'
+        })
+    }
+
+def make_api_request_with_fallback(api_function, endpoint_type, *args, **kwargs):
+    """Wrapper to make API requests with automatic fallback to dummy responses"""
+    breaker = get_circuit_breaker(endpoint_type)
+    if breaker and not breaker.allow_request():
+        app.logger.warning("Circuit %s open, short-circuiting %s to dummy response", breaker.name, endpoint_type)
+        return create_dummy_response(endpoint_type, f"{breaker.name} circuit open, using dummy response")
+    
+    try:
+        result = api_function(*args, **kwargs)
+    except BulkheadFull as e:
+        if breaker:
+            breaker.record_ignored()
+        return bulkhead_fallback(endpoint_type, e)
+    except Exception as e:
+        if breaker:
+            breaker.record_failure()
+        app.logger.error("API call failed for %s: %s", endpoint_type, e)
+        app.logger.info("Returning dummy fallback response for %s", endpoint_type)
+        return create_dummy_response(endpoint_type)
+    
+    if breaker:
+        breaker.record_success()
+    return result
+
+def extract_output_url(result, fields=IMAGE_API_URL_FIELDS):
+    """Return the first output URL found in an upstream JSON result"""
+    for field in fields:
+        if result.get(field):
+            return result[field]
+    return None
+
+def parse_image_api_response(response, url_fields=IMAGE_API_URL_FIELDS, source='api'):
+    """Build a result dict from a successful image API response (requests or httpx)"""
+    content_type = response.headers.get('content-type', '')
+    if content_type.startswith('image/'):
+        # Keep binary results raw; base64 only happens if the client asks for JSON
+        return {'success': True, 'image_bytes': response.content, 'content_type': content_type, 'source': source}
+    
+    try:
+        result = response.json()
+        # Try multiple URL field names
+        output_url = extract_output_url(result, url_fields)
         
-        # Attempt real API call with fallback
-        def _make_unblur_request():
-            if not PIXELCUT_API_KEY:
-                app.logger.error("Pixelcut API key not configured")
-                raise Exception("API key not configured")
+        if output_url:
+            return {'success': True, 'processed_image': output_url, 'source': source}
+        else:
+            raise Exception('No output URL found in API response')
             
-            file.seek(0)
-            file_content = file.read()
+    except json.JSONDecodeError:
+        raise Exception('Invalid response format from API')
+
+def build_qwen_payload(prompt):
+    """Qwen API payload structure"""
+    return {
+        'model': 'wanx-v1',
+        'input': {
+            'prompt': prompt
+        },
+        'parameters': {
+            'style': '<auto>',
+            'size': '1024*1024',
+            'n': 1
+        }
+    }
+
+def parse_qwen_response(result, prompt):
+    """Build the ai-art result dict from a successful Qwen API response"""
+    # Handle Qwen response format
+    if 'output' in result and 'results' in result['output']:
+        results = result['output']['results']
+        if results and len(results) > 0:
+            # Try to get image URL or base64 data
+            image_result = results[0]
+            output_url = image_result.get('url')
             
-            files = {'image': (filename, io.BytesIO(file_content), file.content_type or 'image/jpeg')}
-            headers = {
-                'Authorization': f'Bearer {PIXELCUT_API_KEY}',
-                'User-Agent': 'AiFreeSet-Backend/1.0'
+            if not output_url:
+                # Check for base64 image data
+                base64_data = image_result.get('image')
+                if not base64_data:
+                    raise Exception('No image URL or base64 data found in Qwen response')
+                # Format as data URI
+                output_url = f"data:image/png;base64,{base64_data}"
+            
+            return {
+                'success': True,
+                'source': 'qwen',
+                'data': {
+                    'processed_image': output_url,
+                    'text': f'AI-generated art for prompt: {prompt[:50]}...',
+                    'result': 'AI art generation successful'
+                }
             }
+        else:
+            raise Exception('No results found in Qwen response')
+    else:
+        raise Exception('Invalid response format from Qwen API')
+
+OPERATIONS['ai-art'].update(build_request=build_qwen_payload, parse_response=parse_qwen_response)
+
+_preprocess_stats = {'uploads': 0, 'resized': 0, 'skipped': 0, 'bytes_in': 0, 'bytes_out': 0}
+_preprocess_stats_lock = threading.Lock()
+
+def get_preprocess_stats():
+    """Pre-processing counters, including total bytes saved"""
+    with _preprocess_stats_lock:
+        stats = dict(_preprocess_stats)
+    stats['enabled'] = PREPROCESS_UPLOADS and Image is not None
+    stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    return stats
+
+def preprocess_upload(image, max_dimension):
+    """Downscale to max_dimension, strip EXIF and re-encode an upload tuple (filename, stream, content_type)
+
+    Returns (image, stats); the original tuple comes back when pre-processing is off or doesn't help.
+    """
+    filename, stream, content_type = image
+    if not PREPROCESS_UPLOADS or not max_dimension or Image is None:
+        return image, None
+    
+    started = time.monotonic()
+    stream.seek(0)
+    original = stream.read()
+    stream.seek(0)
+    
+    try:
+        with Image.open(io.BytesIO(original)) as decoded:
+            # JPEGs can be decoded straight at a reduced scale, skipping most of the pixel work
+            decoded.draft('RGB', (max_dimension, max_dimension))
+            # Bake the EXIF orientation into the pixels before the metadata is dropped
+            picture = ImageOps.exif_transpose(decoded)
+            resized = max(picture.size) > max_dimension
+            if resized:
+                picture.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
             
-            return make_image_api_request(
-                'https://api.pixelcut.ai/v1/enhance',
-                files,
-                headers,
-                timeout=90
-            )
+            has_alpha = picture.mode in ('RGBA', 'LA') or (picture.mode == 'P' and 'transparency' in picture.info)
+            output = io.BytesIO()
+            if has_alpha:
+                picture.convert('RGBA').save(output, 'WEBP', quality=PREPROCESS_QUALITY)
+                processed_type, extension = 'image/webp', '.webp'
+            else:
+                picture.convert('RGB').save(output, 'JPEG', quality=PREPROCESS_QUALITY, optimize=True)
+                processed_type, extension = 'image/jpeg', '.jpg'
+    except Exception as e:
+        app.logger.warning("Pre-processing skipped for %s: %s", filename, e)
+        with _preprocess_stats_lock:
+            _preprocess_stats['skipped'] += 1
+        return image, None
+    
+    processed = output.getvalue()
+    use_processed = resized or len(processed) < len(original)
+    sent = len(processed) if use_processed else len(original)
+    stats = {
+        'original_bytes': len(original),
+        'sent_bytes': sent,
+        'bytes_saved': len(original) - sent,
+        'resized': resized,
+        'ms': round((time.monotonic() - started) * 1000, 1)
+    }
+    with _preprocess_stats_lock:
+        _preprocess_stats['uploads'] += 1
+        _preprocess_stats['resized'] += int(resized)
+        _preprocess_stats['bytes_in'] += len(original)
+        _preprocess_stats['bytes_out'] += sent
+    app.logger.info("Pre-processed %s: %s -> %s bytes in %sms", filename, len(original), sent, stats['ms'])
+    
+    if not use_processed:
+        return image, stats
+    return (f"{os.path.splitext(filename)[0]}{extension}", io.BytesIO(processed), processed_type), stats
+
+def record_bytes_saved(stats):
+    """Accumulate bytes saved by pre-processing for this request's X-Upload-Bytes-Saved header"""
+    if stats and has_request_context():
+        g.upload_bytes_saved = g.get('upload_bytes_saved', 0) + stats['bytes_saved']
+
+def make_image_api_request(api_url, files, headers, timeout=90, provider=None, data=None, parse_response=parse_image_api_response):
+    """Generic helper function for image processing API calls with retry logic"""
+    session = get_upstream_session(api_url)
+    provider = provider or urlsplit(api_url).hostname
+    
+    def _send(attempt_timeout):
+        # Fresh body per attempt rewinds the upload; file bytes are streamed, not copied
+        body = MultipartFileBody(files, data)
         
-        # Make request with automatic fallback
-        result = make_api_request_with_fallback(_make_unblur_request, 'unblur')
-        return jsonify(result)
+        response = session.post(
+            api_url,
+            data=body,
+            headers={**headers, 'Content-Type': body.content_type},
+            timeout=attempt_timeout
+        )
         
-    except Exception as e:
-        app.logger.error(f"Unexpected error in unblur endpoint: {str(e)}")
-        # Return dummy response as final fallback
-        dummy_response = create_dummy_response('unblur', 'Image enhancement service temporarily unavailable')
-        return jsonify(dummy_response)
+        app.logger.debug("API response status: %s", response.status_code)
+        rate_limiter.observe(provider, response)
+        check_upstream_status(response)
+        return parse_response(response)
+    
+    return call_with_retry(provider, _send, timeout, api_url=api_url)
 
-@app.route('/api/watermark-remove', methods=['POST'])
-def remove_watermark():
-    """Remove watermark using Unwatermark.ai API with graceful fallback"""
-    app.logger.info("=== WATERMARK REMOVE REQUEST STARTED ===")
+def wants_streaming_upload():
+    """Streaming proxy mode is opt-in per request (?stream=1) or via STREAMING_UPLOADS"""
+    flag = request.args.get('stream')
+    if flag is None:
+        return STREAMING_UPLOADS and request.mimetype == 'multipart/form-data'
+    return flag.lower() in ('1', 'true', 'yes') and request.mimetype == 'multipart/form-data'
+
+# A streamed body can't be replayed, so streaming calls get exactly one attempt
+STREAMING_RETRY_POLICY = RetryPolicy(max_attempts=1)
+
+def stream_image_operation(endpoint_type):
+    """Forward the client's multipart upload to the upstream chunk by chunk, validating inline"""
+    spec = IMAGE_OPERATIONS[endpoint_type]
+    provider, api_url, fields = spec['provider'], spec['url'], spec.get('params')
+    parse_response = operation_parser(spec)
+    app.logger.info("Streaming %s upload to %s", endpoint_type, provider)
     
+    breaker = get_circuit_breaker(endpoint_type)
+    if breaker and not breaker.allow_request():
+        app.logger.warning("Circuit %s open, short-circuiting %s to dummy response", breaker.name, endpoint_type)
+        return jsonify(create_dummy_response(endpoint_type, f"{breaker.name} circuit open, using dummy response"))
+    
+    # Exits that never got an upstream answer (bad or oversized upload, client gone, full bulkhead) free a
+    # half-open probe without counting against the provider
+    outcome_recorded = False
     try:
-        # Validate file upload first
-        file, error = validate_image_upload(request)
-        if error:
-            return jsonify(error), 400
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return jsonify({'success': False, 'error': 'No image file provided'}), 400
+        relay = StreamingUploadRelay(boundary, fields)
         
-        filename = secure_filename(file.filename)
-        app.logger.info(f"Processing watermark removal for: {filename}")
+        def _body():
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield from relay.feed(chunk)
+            yield from relay.finish()
+        
+        def _send(attempt_timeout):
+            response = get_upstream_session(api_url).post(
+                api_url,
+                data=_body(),
+                headers={**provider_headers(provider), 'Content-Type': relay.content_type},
+                timeout=attempt_timeout
+            )
+            app.logger.debug("API response status: %s", response.status_code)
+            rate_limiter.observe(provider, response)
+            check_upstream_status(response)
+            return parse_response(response)
+        
+        try:
+            result = call_with_retry(provider, _send, spec['timeout'], policy=STREAMING_RETRY_POLICY, api_url=api_url)
+        except (UploadTooLarge, RequestEntityTooLarge):
+            app.logger.warning("Streaming %s upload exceeds the size limit", endpoint_type)
+            return jsonify({'success': False, 'error': 'File size exceeds 10MB limit'}), 413
+        except UploadRejected as e:
+            app.logger.warning("Streaming upload rejected: %s", e)
+            return jsonify({'success': False, 'error': str(e)}), 400
+        except ClientDisconnected:
+            app.logger.warning("Client disconnected during %s streaming upload", endpoint_type)
+            return jsonify({'success': False, 'error': 'Upload incomplete'}), 400
+        except BulkheadFull as e:
+            return jsonify(bulkhead_fallback(endpoint_type, e))
+        except Exception as e:
+            if breaker:
+                breaker.record_failure()
+                outcome_recorded = True
+            app.logger.error("API call failed for %s: %s", endpoint_type, e)
+            app.logger.info("Returning dummy fallback response for %s", endpoint_type)
+            return jsonify(create_dummy_response(endpoint_type))
+        
+        if breaker:
+            breaker.record_success()
+            outcome_recorded = True
+    finally:
+        if breaker and not outcome_recorded:
+            breaker.record_ignored()
+    
+    # The hash is only known once the stream is done; seed the cache for buffered requests
+    app.logger.info("Streamed %s bytes for %s", relay.size, relay.filename)
+    result_cache.set(make_result_cache_key(relay.digest.hexdigest(), endpoint_type, fields), result)
+    return cache_status_response(result, False)
+
+class MemoryJobStore:
+    """Job state in a process-local dict (single worker or local testing)"""
+    
+    def __init__(self, ttl_seconds=JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+    
+    def create(self, job):
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            for job_id in [job_id for job_id, stored in self._jobs.items() if stored['updated_at'] < cutoff]:
+                del self._jobs[job_id]
+            self._jobs[job['job_id']] = dict(job)
+        return dict(job)
+    
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields, updated_at=time.time())
+            return dict(job)
+
+class SQLiteJobStore:
+    """Job state in a local SQLite file, visible to every worker process"""
+    
+    def __init__(self, path=JOB_STORE_PATH, ttl_seconds=JOB_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+    
+    def create(self, job):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE updated_at < ?', (time.time() - self.ttl_seconds,))
+            conn.execute(
+                'INSERT INTO jobs (job_id, data, updated_at) VALUES (?, ?, ?)',
+                (job['job_id'], json.dumps(job), job['updated_at'])
+            )
+        return dict(job)
+    
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def update(self, job_id, **fields):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            job = json.loads(row[0])
+            job.update(fields, updated_at=time.time())
+            conn.execute(
+                'UPDATE jobs SET data = ?, updated_at = ? WHERE job_id = ?',
+                (json.dumps(job), job['updated_at'], job_id)
+            )
+            conn.commit()
+            return job
+        finally:
+            conn.close()
+
+def create_job_store():
+    """Build the job store selected by JOB_STORE"""
+    if JOB_STORE == 'sqlite':
+        app.logger.info("Using SQLite job store at %s", JOB_STORE_PATH)
+        return SQLiteJobStore(JOB_STORE_PATH)
+    return MemoryJobStore()
+
+job_store = create_job_store()
+
+# Job threads are started lazily so they are created after gunicorn forks
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+def get_job_executor():
+    """Return the process-wide job worker pool"""
+    global _job_executor
+    if _job_executor is None:
+        with _job_executor_lock:
+            if _job_executor is None:
+                _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+    return _job_executor
+
+def wants_async_job():
+    """Job mode is requested with ?async=1 or a Prefer: respond-async header"""
+    flag = request.args.get('async', '').lower()
+    return flag in ('1', 'true', 'yes') or 'respond-async' in request.headers.get('Prefer', '')
+
+def validate_webhook_url(webhook_url):
+    """Return webhook_url (or None if not given), raising ValueError unless it is absolute http(s) on a public host"""
+    if not webhook_url:
+        return None
+    parts = urlsplit(webhook_url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('webhook_url must be an absolute http(s) URL')
+    if not JOB_WEBHOOK_ALLOW_PRIVATE:
+        try:
+            check_public_host(webhook_url)
+        except ValueError as e:
+            raise ValueError(f'webhook_url not allowed: {e}')
+    return webhook_url
+
+def get_webhook_url(data=None):
+    """Optional webhook URL from the query string, JSON body or form"""
+    webhook_url = request.args.get('webhook_url') or (data or {}).get('webhook_url')
+    if not webhook_url and request.mimetype == 'multipart/form-data':
+        webhook_url = request.form.get('webhook_url')
+    return validate_webhook_url(webhook_url)
+
+def detach_upload(file):
+    """Copy a validated upload out of the request so a job can use it after the response"""
+    copy = tempfile.SpooledTemporaryFile(max_size=512 * 1024)
+    file.seek(0)
+    shutil.copyfileobj(file.stream, copy, UPLOAD_CHUNK_SIZE)
+    copy.seek(0)
+    detached = FileStorage(stream=copy, filename=file.filename, content_type=file.content_type)
+    detached.sha256 = file.sha256
+    return detached
+
+def new_job(operation, webhook_url=None):
+    """Initial state for a queued job"""
+    now = time.time()
+    return {
+        'job_id': uuid.uuid4().hex,
+        'operation': operation,
+        'status': 'queued',
+        'result': None,
+        'error': None,
+        'webhook_url': webhook_url,
+        'created_at': now,
+        'updated_at': now
+    }
+
+def job_result_payload(result, base_url):
+    """JSON-safe job result; binary output is stored and linked instead of inlined"""
+    return prepare_image_result(result, 'url', lambda result_id: f"{base_url}/api/results/{result_id}")[1]
+
+def public_job(job):
+    """Job fields returned to clients"""
+    return {key: value for key, value in job.items() if key != 'webhook_url'}
+
+def deliver_webhook(job):
+    """POST the finished job to its webhook, within the shared retry budget"""
+    webhook_url = job.get('webhook_url')
+    if not webhook_url:
+        return
+    
+    # The URL is client-supplied: no per-origin pool, and its address is checked again at connect time
+    with external_session(public_only=not JOB_WEBHOOK_ALLOW_PRIVATE) as session:
+        def _send(attempt_timeout):
+            response = session.post(webhook_url, json=public_job(job), timeout=attempt_timeout, allow_redirects=False)
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                raise RetryableUpstreamError(response.status_code, f"Webhook error: HTTP {response.status_code}")
+            return response.status_code
         
-        # Attempt real API call with fallback
-        def _make_watermark_remove_request():
-            if not UNWATERMARK_API_KEY:
-                app.logger.error("Unwatermark API key not configured")
-                raise Exception("API key not configured")
+        try:
+            status = call_with_retry('webhook', _send, JOB_WEBHOOK_TIMEOUT)
+            app.logger.info("Webhook for job %s delivered: HTTP %s", job['job_id'], status)
+        except Exception as e:
+            app.logger.error("Webhook for job %s failed: %s", job['job_id'], e)
+
+def run_job(job_id, operation_function, base_url):
+    """Execute a job on the worker pool and record its outcome"""
+    job_store.update(job_id, status='running')
+    try:
+        result = operation_function()
+        job = job_store.update(job_id, status='succeeded', result=job_result_payload(result, base_url))
+    except Exception as e:
+        app.logger.error("Job %s failed: %s", job_id, e)
+        job = job_store.update(job_id, status='failed', error=str(e))
+    deliver_webhook(job)
+
+def submit_job(operation, operation_function, webhook_url=None):
+    """Queue operation_function() as a job and return the 202 response"""
+    job = job_store.create(new_job(operation, webhook_url))
+    base_url = request.host_url.rstrip('/')
+    get_job_executor().submit(run_job, job['job_id'], operation_function, base_url)
+    app.logger.info("Queued %s job %s", operation, job['job_id'])
+    
+    response = jsonify({
+        'success': True,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': f"{base_url}/api/jobs/{job['job_id']}"
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['job_id']}"
+    return response
+
+def provider_headers(provider_name):
+    """Auth and client headers for a provider, raising if its API key isn't configured"""
+    provider = PROVIDERS[provider_name]
+    if not provider['api_key']:
+        app.logger.error("%s API key not configured", provider_name)
+        raise Exception("API key not configured")
+    return {
+        provider['auth_header']: f"{provider['auth_prefix']}{provider['api_key']}",
+        'User-Agent': 'AiFreeSet-Backend/1.0',
+        **trace_headers()
+    }
+
+def operation_parser(spec):
+    """Response parser for an operation spec"""
+    url_fields = spec.get('url_fields', IMAGE_API_URL_FIELDS)
+    source = spec.get('source', 'api')
+    return lambda response: parse_image_api_response(response, url_fields, source)
+
+class UploadView:
+    """Read-only view with its own position over a shared upload, so concurrent attempts can send the same bytes"""
+    
+    def __init__(self, stream, lock):
+        self._stream = stream
+        self._lock = lock
+        self._position = 0
+    
+    def read(self, size=-1):
+        with self._lock:
+            self._stream.seek(self._position)
+            data = self._stream.read() if size is None or size < 0 else self._stream.read(size)
+        self._position += len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_END:
+            with self._lock:
+                offset += self._stream.seek(0, os.SEEK_END)
+        elif whence == os.SEEK_CUR:
+            offset += self._position
+        self._position = offset
+        return self._position
+    
+    def tell(self):
+        return self._position
+    
+    def seekable(self):
+        return True
+
+def get_hedge_delay(provider):
+    """Seconds to wait on provider before hedging: its recent p95, or None until enough calls have been seen"""
+    histogram = _latency_histograms.get(provider)
+    if histogram is None or histogram.count() < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY_SECONDS, histogram.percentile(0.95))
+
+# Failover counters per operation
+_failover_stats = {}
+_failover_stats_lock = threading.Lock()
+
+def record_failover_event(operation, event):
+    """Increment a failover counter (calls, failovers, hedges, hedge_wins, exhausted)"""
+    with _failover_stats_lock:
+        stats = _failover_stats.setdefault(operation, {
+            'calls': 0, 'failovers': 0, 'hedges': 0, 'hedge_wins': 0, 'exhausted': 0
+        })
+        stats[event] += 1
+
+def get_failover_stats():
+    """Failover and hedging counters plus the current hedge delay per provider"""
+    with _failover_stats_lock:
+        operations = {operation: dict(stats) for operation, stats in _failover_stats.items()}
+    return {
+        'hedging': HEDGE_REQUESTS,
+        'operations': operations,
+        'hedge_delays': {provider: get_hedge_delay(provider) for provider in PROVIDERS}
+    }
+
+def operation_targets(spec):
+    """The operation's providers in call order: by priority, weighted-random within one priority"""
+    primary = {key: value for key, value in spec.items() if key != 'alternates'}
+    targets = [primary] + [{**primary, 'priority': 1, 'weight': 1, **alternate} for alternate in spec.get('alternates', [])]
+    return sorted(targets, key=lambda target: (target.get('priority', 0), -random.random() ** (1.0 / target.get('weight', 1))))
+
+def next_available_target(targets, skipped):
+    """Pop the next target whose circuit lets a call through, noting short-circuited providers in skipped"""
+    while targets:
+        target = targets.pop(0)
+        breaker = CIRCUIT_BREAKERS.get(target['provider'])
+        if breaker is None or breaker.allow_request():
+            return target
+        skipped.append(target['provider'])
+    return None
+
+def record_target_outcome(target, error=None, ignored=False):
+    """Feed one provider call into its circuit breaker; ignored calls only free a half-open probe"""
+    breaker = CIRCUIT_BREAKERS.get(target['provider'])
+    if breaker is None:
+        return
+    if ignored or isinstance(error, BulkheadFull):
+        breaker.record_ignored()
+    elif error is not None:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+def operation_fallback(operation, skipped, error):
+    """Dummy response once every provider has failed or was short-circuited"""
+    record_failover_event(operation, 'exhausted')
+    if isinstance(error, BulkheadFull):
+        return bulkhead_fallback(operation, error)
+    if error is None:
+        app.logger.warning("Circuit %s open, short-circuiting %s to dummy response", ', '.join(skipped), operation)
+        return create_dummy_response(operation, f"{', '.join(skipped)} circuit open, using dummy response")
+    app.logger.error("API call failed for %s: %s", operation, error)
+    app.logger.info("Returning dummy fallback response for %s", operation)
+    return create_dummy_response(operation)
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def get_hedge_executor():
+    """Lazily start the thread pool that runs hedged upstream calls"""
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+        return _hedge_executor
+
+def call_operation(operation, send_to_target):
+    """Call send_to_target(target) on the operation's providers, failing over on errors
+
+    With hedging on, a call still running past the provider's p95 is raced against the next
+    provider and the first success wins. Falls back to the dummy response when all fail.
+    Every target and hedge spends from one retry budget, so failover can't multiply attempts.
+    """
+    with operation_retry_budget(operation):
+        return _call_operation(operation, send_to_target)
+
+def _call_operation(operation, send_to_target):
+    spec = OPERATIONS[operation]
+    targets = operation_targets(spec)
+    hedging = spec.get('hedge', HEDGE_REQUESTS) and len(targets) > 1
+    record_failover_event(operation, 'calls')
+    skipped = []
+    error = None
+    
+    if not hedging:
+        while True:
+            target = next_available_target(targets, skipped)
+            if target is None:
+                return operation_fallback(operation, skipped, error)
+            if error is not None:
+                record_failover_event(operation, 'failovers')
+                app.logger.warning("Failing over %s to %s after: %s", operation, target['provider'], error)
+            try:
+                result = send_to_target(target)
+            except Exception as e:
+                record_target_outcome(target, e)
+                error = e
+                continue
+            record_target_outcome(target)
+            return result
+    
+    # Losing calls keep running in the pool; once abandoned their errors don't count against the provider,
+    # but still release a half-open probe they may be holding
+    abandoned = threading.Event()
+    
+    def _attempt(target):
+        try:
+            result = send_to_target(target)
+        except Exception as e:
+            record_target_outcome(target, e, ignored=abandoned.is_set())
+            raise
+        record_target_outcome(target)
+        return result
+    
+    executor = get_hedge_executor()
+    in_flight = {}
+    first = None
+    hedged = False
+    try:
+        while True:
+            if not in_flight:
+                target = next_available_target(targets, skipped)
+                if target is None:
+                    return operation_fallback(operation, skipped, error)
+                if error is not None:
+                    record_failover_event(operation, 'failovers')
+                    app.logger.warning("Failing over %s to %s after: %s", operation, target['provider'], error)
+                first = first or target
+                in_flight[executor.submit(contextvars.copy_context().run, _attempt, target)] = target
             
-            file.seek(0)
-            file_content = file.read()
+            delay = None
+            if not hedged and targets and len(in_flight) == 1:
+                delay = get_hedge_delay(next(iter(in_flight.values()))['provider'])
+            done, _ = wait(in_flight, timeout=delay, return_when=FIRST_COMPLETED)
             
-            files = {'image': (filename, io.BytesIO(file_content), file.content_type or 'image/jpeg')}
-            headers = {
-                'Authorization': f'Bearer {UNWATERMARK_API_KEY}',
-                'User-Agent': 'AiFreeSet-Backend/1.0'
-            }
+            if not done:
+                hedged = True
+                target = next_available_target(targets, skipped)
+                if target is not None:
+                    record_failover_event(operation, 'hedges')
+                    app.logger.info("Hedging %s to %s after %.2fs", operation, target['provider'], delay)
+                    in_flight[executor.submit(contextvars.copy_context().run, _attempt, target)] = target
+                continue
             
+            for future in done:
+                target = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if hedged and target is not first:
+                    record_failover_event(operation, 'hedge_wins')
+                return result
+    finally:
+        abandoned.set()
+
+def run_image_operation(file, operation, preprocess=True):
+    """Run one registered operation on a validated upload with caching, retries and fallback; returns (result, cache_hit)"""
+    spec = IMAGE_OPERATIONS[operation]
+    filename = secure_filename(file.filename)
+    
+    def _make_request():
+        # Shrink the upload once for all providers; every attempt reads it through its own view
+        with trace_span('preprocess'):
+            image, stats = preprocess_upload(
+                (filename, file.stream, file.content_type or 'image/jpeg'),
+                spec.get('max_dimension') if preprocess else None
+            )
+        record_bytes_saved(stats)
+        upload_name, stream, content_type = image
+        lock = threading.Lock()
+        
+        def _send(target):
             return make_image_api_request(
-                'https://api.unwatermark.ai/v1/remove',
-                files,
-                headers,
-                timeout=120  # Longer timeout for watermark removal
+                target['url'],
+                {'image': (upload_name, UploadView(stream, lock), content_type)},
+                provider_headers(target['provider']),
+                timeout=target['timeout'],
+                provider=target['provider'],
+                data=target.get('params'),
+                parse_response=operation_parser(target)
+            )
+        
+        return call_operation(operation, _send)
+    
+    return cached_image_operation(file, operation, _make_request, params=spec.get('params'))
+
+def run_prompt_operation(operation, prompt):
+    """Run one registered prompt operation with failover, hedging, retries and fallback"""
+    def _send(target):
+        headers = {**provider_headers(target['provider']), 'Content-Type': 'application/json'}
+        payload = target['build_request'](prompt)
+        session = get_upstream_session(target['url'])
+        
+        def _post(attempt_timeout):
+            response = session.post(
+                target['url'],
+                headers=headers,
+                json=payload,
+                timeout=attempt_timeout
             )
+            
+            app.logger.debug("%s response: %s", target['provider'], response.status_code)
+            rate_limiter.observe(target['provider'], response)
+            check_upstream_status(response, target['label'])
+            
+            result = response.json()
+            if app.logger.isEnabledFor(logging.DEBUG):
+                app.logger.debug("%s success. Response keys: %s", target['provider'], list(result.keys()) if result else 'None')
+            return target['parse_response'](result, prompt)
+        
+        return call_with_retry(target['provider'], _post, timeout=target['timeout'], api_url=target['url'])
+    
+    return call_operation(operation, _send)
+
+def handle_image_operation(operation):
+    """Shared body of the single-image endpoints: validate, run the operation and render the result"""
+    spec = IMAGE_OPERATIONS[operation]
+    app.logger.debug("=== %s REQUEST STARTED ===", operation.upper())
+    
+    try:
+        # Opt-in streaming proxy: forward the upload without buffering it
+        if wants_streaming_upload():
+            return stream_image_operation(operation)
+        
+        # Validate file upload first (this is also where the multipart body is received)
+        with trace_span('validate'):
+            file, error = validate_image_upload(request)
+        if error:
+            return jsonify(error), 400
         
-        # Make request with automatic fallback
-        result = make_api_request_with_fallback(_make_watermark_remove_request, 'watermark-remove')
-        return jsonify(result)
+        # Long-running mode: jobs outlive the request, so they work on their own copy of the upload
+        if wants_async_job():
+            try:
+                webhook_url = get_webhook_url()
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            file = detach_upload(file)
+            return submit_job(operation, lambda: run_image_operation(file, operation)[0], webhook_url)
         
+        app.logger.info("Processing %s for: %s", operation, secure_filename(file.filename))
+        result, cache_hit = run_image_operation(file, operation)
+        return cache_status_response(result, cache_hit)
+        
+    except BulkheadFull:
+        raise
     except Exception as e:
-        app.logger.error(f"Unexpected error in watermark removal endpoint: {str(e)}")
+        app.logger.error("Unexpected error in %s endpoint: %s", operation, e)
         # Return dummy response as final fallback
-        dummy_response = create_dummy_response('watermark-remove', 'Watermark removal service temporarily unavailable')
+        dummy_response = create_dummy_response(operation, f"{spec['label']} service temporarily unavailable")
         return jsonify(dummy_response)
 
+def parse_operation_list(values, unique=True):
+    """Operation names from form values (comma-separated or JSON lists), raising ValueError if unknown"""
+    operations = []
+    for value in values:
+        value = value.strip()
+        names = json.loads(value) if value.startswith('[') else value.split(',')
+        for name in names:
+            name = str(name).strip()
+            if name and not (unique and name in operations):
+                operations.append(name)
+    
+    if not operations:
+        raise ValueError('At least one operation is required')
+    unknown = [name for name in operations if name not in IMAGE_OPERATIONS]
+    if unknown:
+        raise ValueError(f"Unsupported operations: {', '.join(unknown)}")
+    return operations
+
+def add_stage_chunk(body, chunk):
+    """Append one downloaded chunk, failing as soon as the intermediate result passes MAX_FILE_SIZE"""
+    body += chunk
+    if len(body) > MAX_FILE_SIZE:
+        raise Exception('Intermediate result exceeds 10MB limit')
+
+def parse_stage_download(content, headers):
+    """Bytes and content type of a downloaded intermediate result (requests or httpx headers)"""
+    content_type = headers.get('content-type', '').split(';')[0].strip()
+    return bytes(content), content_type if content_type.startswith('image/') else 'image/png'
+
+def decode_data_url(output_url):
+    """Bytes and content type of a data: URL result"""
+    header, _, encoded = output_url.partition(',')
+    return base64.b64decode(encoded), header[5:].split(';')[0] or 'image/png'
+
+def load_stage_output(result):
+    """Raw bytes of a stage's output, downloading it if the upstream returned a URL (no re-encoding)"""
+    if result.get('image_bytes') is not None:
+        return result['image_bytes'], result.get('content_type', 'image/png')
+    
+    output_url = result_output_url(result)
+    if not output_url:
+        raise Exception('Stage returned no image')
+    if output_url.startswith('data:'):
+        return decode_data_url(output_url)
+    
+    # Result URLs change per call: no per-origin pool, and the body is read no further than the size cap
+    with external_session(public_only=False) as session:
+        def _send(attempt_timeout):
+            with session.get(output_url, timeout=attempt_timeout, stream=True) as response:
+                check_upstream_status(response, 'Stage download')
+                body = bytearray()
+                for chunk in response.iter_content(UPLOAD_CHUNK_SIZE):
+                    add_stage_chunk(body, chunk)
+                return parse_stage_download(body, response.headers)
+        
+        return call_with_retry('pipeline', _send, timeout=PIPELINE_DOWNLOAD_TIMEOUT)
+
+def stage_upload(image_bytes, content_type, filename):
+    """Wrap a stage's output as the next stage's (already validated) upload"""
+    extension = mimetypes.guess_extension(content_type) or '.png'
+    file = FileStorage(
+        stream=io.BytesIO(image_bytes),
+        filename=f"{os.path.splitext(filename)[0]}{extension}",
+        content_type=content_type
+    )
+    file.sha256 = hashlib.sha256(image_bytes).hexdigest()
+    return file
+
+def pipeline_stopped(result):
+    """A failed or dummy stage ends the pipeline"""
+    return not result.get('success') or result.get('source') == 'dummy'
+
+def run_pipeline(file, operations):
+    """Run operations in order on one upload, feeding each output to the next; returns (result, stages)"""
+    stages = []
+    result = None
+    for operation in operations:
+        stage = {'operation': operation}
+        stages.append(stage)
+        
+        if result is not None:
+            started = time.monotonic()
+            try:
+                image_bytes, content_type = load_stage_output(result)
+            except Exception as e:
+                app.logger.error("Pipeline could not load output of %s: %s", stages[-2]['operation'], e)
+                result = create_dummy_response(operation, f"Could not load output of {stages[-2]['operation']}")
+                stage['status'] = 'failed'
+                break
+            file = stage_upload(image_bytes, content_type, file.filename)
+            stage['fetch_ms'] = round((time.monotonic() - started) * 1000, 1)
+        
+        # Only the client's upload is pre-processed; later stages must keep e.g. the upscaled size
+        started = time.monotonic()
+        result, cache_hit = run_image_operation(file, operation, preprocess=len(stages) == 1)
+        stage.update(
+            ms=round((time.monotonic() - started) * 1000, 1),
+            cache='HIT' if cache_hit else 'MISS',
+            source=result.get('source', 'api'),
+            status='failed' if pipeline_stopped(result) else 'succeeded'
+        )
+        if pipeline_stopped(result):
+            app.logger.warning("Pipeline stopped at %s", operation)
+            break
+    
+    stages.extend({'operation': operation, 'status': 'skipped'} for operation in operations[len(stages):])
+    return {**result, 'stages': stages}, stages
+
+def server_timing_header(stages):
+    """Server-Timing header value with one entry per executed stage"""
+    return ', '.join(
+        f"{stage['operation']};dur={stage['ms'] + stage.get('fetch_ms', 0)}" for stage in stages if 'ms' in stage
+    )
+
+def extract_zip_images(upload, max_items=BATCH_MAX_ITEMS, max_bytes=BATCH_MAX_REQUEST_SIZE):
+    """Unpack the images in an uploaded zip archive, each capped just above MAX_FILE_SIZE"""
+    try:
+        archive = zipfile.ZipFile(upload.stream)
+    except zipfile.BadZipFile:
+        raise ValueError(f"{upload.filename} is not a valid zip archive")
+    
+    # Check member count and declared sizes from the central directory before decompressing anything
+    members = []
+    total_size = 0
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+            continue
+        members.append((info, name))
+        if len(members) > max_items:
+            raise ValueError(f"Batch exceeds {BATCH_MAX_ITEMS} images")
+        # Oversized members are only copied up to MAX_FILE_SIZE + 1 bytes and then fail validation on their own
+        total_size += min(info.file_size, MAX_FILE_SIZE + 1)
+        if total_size > max_bytes:
+            raise ValueError(f"{upload.filename} unpacks to more than {BATCH_MAX_REQUEST_SIZE // (1024 * 1024)}MB")
+    
+    images = []
+    for info, name in members:
+        # Copy at most MAX_FILE_SIZE + 1 bytes so validation still rejects oversized members
+        copy = tempfile.SpooledTemporaryFile(max_size=512 * 1024)
+        with archive.open(info) as member:
+            remaining = MAX_FILE_SIZE + 1
+            while remaining > 0:
+                chunk = member.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                copy.write(chunk)
+                remaining -= len(chunk)
+        copy.seek(0)
+        images.append(FileStorage(stream=copy, filename=name, content_type=mimetypes.guess_type(name)[0]))
+    return images
+
+def expand_batch_uploads(uploads):
+    """Flatten uploaded images and zip archives into one list of items"""
+    items = []
+    for upload in uploads:
+        if (upload.filename or '').lower().endswith('.zip'):
+            items.extend(extract_zip_images(upload, max_items=BATCH_MAX_ITEMS - len(items)))
+        else:
+            items.append(upload)
+        if len(items) > BATCH_MAX_ITEMS:
+            raise ValueError(f"Batch exceeds {BATCH_MAX_ITEMS} images")
+    return items
+
+def process_batch_item(index, file, operations, emit):
+    """Run each operation on one image in turn (they share its stream), emitting (index, operation, result, cache_hit) as each finishes"""
+    for operation in operations:
+        try:
+            result, cache_hit = run_image_operation(file, operation)
+        except Exception as e:
+            app.logger.error("Batch item %s %s failed: %s", index, operation, e)
+            result, cache_hit = {'success': False, 'error': str(e)}, False
+        emit((index, operation, result, cache_hit))
+
+def batch_result_line(index, filename, operation, payload, cache_status=None):
+    """One NDJSON line of batch output"""
+    line = {'index': index, 'filename': filename, 'operation': operation}
+    if cache_status:
+        line['cache'] = cache_status
+    line.update(payload)
+    return json.dumps(line) + '\n'
+
+@app.route('/', methods=['GET'])
+def health_check():
+    """Health check endpoint with API status"""
+    app.logger.debug("Health check requested")
+    return jsonify({
+        'status': 'AiFreeSet backend running',
+        'api_keys_loaded': {name: bool(provider['api_key']) for name, provider in PROVIDERS.items()},
+        'operations': sorted(OPERATIONS),
+        'upstream_pools': get_pool_stats(),
+        'retries': get_retry_stats(),
+        'circuits': get_circuit_stats(),
+        'result_cache': result_cache.stats(),
+        'ai_art_cache': get_ai_art_cache_stats(),
+        'result_store': result_store.stats(),
+        'jobs': {'store': JOB_STORE, 'workers': JOB_WORKERS},
+        'batch': {'max_items': BATCH_MAX_ITEMS, 'concurrency': BATCH_CONCURRENCY},
+        'pipeline': {'max_stages': PIPELINE_MAX_STAGES},
+        'preprocess': get_preprocess_stats(),
+        'failover': get_failover_stats(),
+        'latency': get_latency_stats(),
+        'bulkheads': get_bulkhead_stats(),
+        'rate_limits': get_rate_limit_stats(),
+        'inbound_rate_limits': inbound_limiter.stats(),
+        'tracing': trace_exporter.stats(),
+        'logging': log_handler.stats(),
+        'fault_injection': fault_injector.stats()
+    })
+
+CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+def render_metrics(bulkheads=None):
+    """Prometheus exposition of the registry plus scrape-time upstream gauges and counters"""
+    lines = [metrics.render().rstrip('\n')]
+    retries = get_retry_stats()['providers']
+    for event in ('calls', 'attempts', 'retries', 'successes', 'failures', 'budget_exhausted'):
+        lines.extend(format_metric_family(
+            f'upstream_{event}_total', 'counter', f'Upstream {event.replace("_", " ")} under the retry policy, by provider',
+            [([('provider', provider)], stats[event]) for provider, stats in sorted(retries.items())]
+        ))
+    lines.extend(format_metric_family(
+        'upstream_circuit_state', 'gauge', 'Circuit breaker state (0 closed, 1 half-open, 2 open)',
+        [([('provider', name)], CIRCUIT_STATE_VALUES[stats['state']]) for name, stats in get_circuit_stats().items()]
+    ))
+    bulkheads = get_bulkhead_stats() if bulkheads is None else bulkheads
+    for field in ('in_flight', 'queued'):
+        lines.extend(format_metric_family(
+            f'upstream_bulkhead_{field}', 'gauge', f'Upstream calls {field.replace("_", " ")} in the bulkhead',
+            [([('provider', name)], stats[field]) for name, stats in sorted(bulkheads.items())]
+        ))
+    quota = rate_limiter.snapshot()
+    lines.extend(format_metric_family(
+        'upstream_quota_remaining', 'gauge', 'Requests left in the upstream rate-limit window (X-RateLimit-Remaining)',
+        [([('provider', name)], stats['upstream_remaining']) for name, stats in quota.items() if stats['upstream_remaining'] is not None]
+    ))
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/background-remove', methods=['POST'])
+def remove_background():
+    """Remove background using Pixelcut API with graceful fallback"""
+    return handle_image_operation('background-remove')
+
+@app.route('/api/upscale', methods=['POST'])
+def upscale_image():
+    """Upscale image using Pixelcut API with graceful fallback"""
+    return handle_image_operation('upscale')
+
+@app.route('/api/unblur', methods=['POST'])
+def unblur_image():
+    """Enhance/sharpen image using Pixelcut API with graceful fallback"""
+    return handle_image_operation('unblur')
+
+@app.route('/api/watermark-remove', methods=['POST'])
+def remove_watermark():
+    """Remove watermark using Unwatermark.ai API with graceful fallback"""
+    return handle_image_operation('watermark-remove')
+
 @app.route('/api/ai-art', methods=['POST'])
 def generate_ai_art():
     """Generate AI art using Qwen API with graceful fallback"""
-    app.logger.info("=== AI ART GENERATION REQUEST STARTED ===")
+    app.logger.debug("=== AI ART GENERATION REQUEST STARTED ===")
     
     try:
         # Validate JSON input
@@ -503,160 +3862,178 @@ def generate_ai_art():
             app.logger.warning("Empty prompt provided")
             return jsonify({'success': False, 'error': 'Prompt cannot be empty'}), 400
         
-        app.logger.info(f"Generating AI art with prompt: {prompt[:100]}...")
+        app.logger.info("Generating AI art with prompt: %s...", prompt[:100])
         
-        # Attempt real API call with fallback
-        def _make_qwen_art_request():
-            if not QWEN_API_KEY:
-                app.logger.error("Qwen API key not configured")
-                raise Exception("API key not configured")
-            
-            headers = {
-                'Authorization': f'Bearer {QWEN_API_KEY}',
-                'Content-Type': 'application/json',
-                'User-Agent': 'AiFreeSet-Backend/1.0'
-            }
-            
-            # Qwen API payload structure
-            payload = {
-                'model': 'wanx-v1',
-                'input': {
-                    'prompt': prompt
-                },
-                'parameters': {
-                    'style': '<auto>',
-                    'size': '1024*1024',
-                    'n': 1
-                }
-            }
-            
-            session = create_retry_session()
-            
-            # Retry logic with exponential backoff
-            max_attempts = 3
-            for attempt in range(max_attempts):
-                try:
-                    app.logger.info(f"AI art generation attempt {attempt + 1}/{max_attempts}")
-                    
-                    response = session.post(
-                        'https://dashscope.aliyuncs.com/api/v1/services/aigc/text2image/generation',
-                        headers=headers,
-                        json=payload,
-                        timeout=120
-                    )
-                    
-                    app.logger.info(f"Qwen API response: {response.status_code}")
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        app.logger.info(f"Qwen API success. Response keys: {list(result.keys()) if result else 'None'}")
-                        
-                        # Handle Qwen response format
-                        if 'output' in result and 'results' in result['output']:
-                            results = result['output']['results']
-                            if results and len(results) > 0:
-                                # Try to get image URL or base64 data
-                                image_result = results[0]
-                                output_url = image_result.get('url')
-                                
-                                if output_url:
-                                    return {
-                                        'success': True,
-                                        'source': 'qwen',
-                                        'data': {
-                                            'processed_image': output_url,
-                                            'text': f'AI-generated art for prompt: {prompt[:50]}...',
-                                            'result': 'AI art generation successful'
-                                        }
-                                    }
-                                else:
-                                    # Check for base64 image data
-                                    base64_data = image_result.get('image')
-                                    if base64_data:
-                                        # Format as data URI
-                                        image_data_url = f"data:image/png;base64,{base64_data}"
-                                        return {
-                                            'success': True,
-                                            'source': 'qwen',
-                                            'data': {
-                                                'processed_image': image_data_url,
-                                                'text': f'AI-generated art for prompt: {prompt[:50]}...',
-                                                'result': 'AI art generation successful'
-                                            }
-                                        }
-                                    else:
-                                        raise Exception('No image URL or base64 data found in Qwen response')
-                            else:
-                                raise Exception('No results found in Qwen response')
-                        else:
-                            raise Exception('Invalid response format from Qwen API')
-                    
-                    elif response.status_code == 401:
-                        app.logger.error(f"Qwen API authentication failed - Status: {response.status_code}")
-                        app.logger.error(f"Response: {response.text}")
-                        raise Exception("Qwen API authentication failed - check API key")
-                    
-                    elif response.status_code in [429, 500, 502, 503, 504]:
-                        if attempt < max_attempts - 1:
-                            wait_time = (2 ** attempt) + 1
-                            app.logger.warning(f"Qwen API error {response.status_code}, retrying in {wait_time}s")
-                            time.sleep(wait_time)
-                            continue
-                        else:
-                            raise Exception(f"Qwen API failed: HTTP {response.status_code}")
-                    else:
-                        error_text = response.text[:200] if response.text else 'No response text'
-                        app.logger.error(f"Qwen API error: HTTP {response.status_code} - {error_text}")
-                        raise Exception(f"Qwen API error: HTTP {response.status_code}")
-                        
-                except requests.exceptions.Timeout as e:
-                    if attempt < max_attempts - 1:
-                        wait_time = (2 ** attempt) + 2
-                        app.logger.warning(f"Timeout error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise Exception(f"Timeout error after {max_attempts} attempts: {str(e)}")
-                        
-                except requests.exceptions.ConnectionError as e:
-                    if attempt < max_attempts - 1:
-                        wait_time = (2 ** attempt) + 2
-                        app.logger.warning(f"Connection error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise Exception(f"Connection error after {max_attempts} attempts: {str(e)}")
-                        
-                except requests.exceptions.RequestException as e:
-                    if attempt < max_attempts - 1:
-                        wait_time = (2 ** attempt) + 2
-                        app.logger.warning(f"Request error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise Exception(f"Request error after {max_attempts} attempts: {str(e)}")
-                        
-                except Exception as e:
-                    if attempt < max_attempts - 1:
-                        wait_time = (2 ** attempt) + 2
-                        app.logger.warning(f"Unexpected error (attempt {attempt + 1}): {str(e)}, retrying in {wait_time}s")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise Exception(f"Unexpected error after {max_attempts} attempts: {str(e)}")
-            
-            raise Exception("All retry attempts exhausted")
+        cache_key = make_prompt_cache_key(prompt)
+        
+        def _generate():
+            # Same engine as the image operations: failover, hedging, shared retry budget and dummy fallback
+            result = run_prompt_operation('ai-art', prompt)
+            if result.get('success') and result.get('source') != 'dummy':
+                ai_art_cache.set(cache_key, result)
+            return result
+        
+        # Long-running mode: hand the generation to the job pool and return immediately
+        if wants_async_job():
+            try:
+                webhook_url = get_webhook_url(data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            return submit_job(
+                'ai-art',
+                lambda: ai_art_cache.get(cache_key) or ai_art_flight.do(cache_key, _generate)[0],
+                webhook_url
+            )
+        
+        cached = ai_art_cache.get(cache_key)
+        if cached is not None:
+            app.logger.info("AI art cache hit")
+            return cache_status_response(cached, True)
         
-        # Make request with automatic fallback
-        result = make_api_request_with_fallback(_make_qwen_art_request, 'ai-art')
-        return jsonify(result)
+        # Identical prompts arriving together share one upstream call
+        result, shared = ai_art_flight.do(cache_key, _generate)
+        response = cache_status_response(result, False)
+        if shared:
+            response.headers['X-Cache'] = 'COALESCED'
+        return response
         
+    except BulkheadFull:
+        raise
     except Exception as e:
-        app.logger.error(f"Unexpected error in AI art generation endpoint: {str(e)}")
+        app.logger.error("Unexpected error in AI art generation endpoint: %s", e)
         # Return dummy response as final fallback
         dummy_response = create_dummy_response('ai-art', 'AI art generation service temporarily unavailable')
         return jsonify(dummy_response)
 
+@app.route('/api/batch', methods=['POST'])
+def process_batch():
+    """Apply operations to many images in one request, streaming NDJSON results as they finish"""
+    app.logger.debug("=== BATCH REQUEST STARTED ===")
+    
+    try:
+        operations = parse_operation_list(request.form.getlist('operations') + request.form.getlist('operation'))
+        items = expand_batch_uploads(
+            request.files.getlist('images') + request.files.getlist('image') + request.files.getlist('archive')
+        )
+    except ValueError as e:
+        app.logger.warning("Invalid batch request: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if not items:
+        return jsonify({'success': False, 'error': 'No image files provided'}), 400
+    
+    # Binary output can't be embedded in NDJSON, so it falls back to inline JSON
+    mode = get_response_mode(request.args.get('response'), None)
+    if mode == 'binary':
+        mode = 'json'
+    app.logger.info("Batch of %s images x %s operations", len(items), len(operations))
+    
+    @stream_with_context
+    def _generate():
+        started = time.monotonic()
+        lines = failed = 0
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(items)), thread_name_prefix='batch')
+        # Workers hand back each (image, operation) result as it finishes, not once the image is done
+        finished = queue.Queue()
+        try:
+            files = {}
+            for index, upload in enumerate(items):
+                file, error = validate_image_upload(SimpleNamespace(files={'image': upload}))
+                if error:
+                    for operation in operations:
+                        lines += 1
+                        failed += 1
+                        yield batch_result_line(index, upload.filename, operation, error)
+                    continue
+                files[index] = file
+                executor.submit(process_batch_item, index, file, operations, finished.put)
+            
+            for _ in range(len(files) * len(operations)):
+                index, operation, result, cache_hit = finished.get()
+                payload = prepare_image_result(
+                    result, mode, lambda result_id: url_for('get_stored_result', result_id=result_id, _external=True)
+                )[1]
+                lines += 1
+                failed += 0 if result.get('success') else 1
+                yield batch_result_line(index, files[index].filename, operation, payload, 'HIT' if cache_hit else 'MISS')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        elapsed_ms = (time.monotonic() - started) * 1000
+        app.logger.info("Batch finished: %s results, %s failed in %.0fms", lines, failed, elapsed_ms)
+        yield json.dumps({'done': True, 'results': lines, 'failed': failed, 'elapsed_ms': round(elapsed_ms, 1)}) + '\n'
+    
+    return Response(_generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/pipeline', methods=['POST'])
+def process_pipeline():
+    """Run one upload through an ordered list of operations, returning only the final output"""
+    app.logger.debug("=== PIPELINE REQUEST STARTED ===")
+    
+    try:
+        try:
+            operations = parse_operation_list(
+                request.form.getlist('operations') + request.form.getlist('operation'), unique=False
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if len(operations) > PIPELINE_MAX_STAGES:
+            return jsonify({'success': False, 'error': f'Pipelines are limited to {PIPELINE_MAX_STAGES} operations'}), 400
+        
+        file, error = validate_image_upload(request)
+        if error:
+            return jsonify(error), 400
+        
+        # Jobs outlive the request, so they work on their own copy of the upload
+        if wants_async_job():
+            try:
+                webhook_url = get_webhook_url()
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            file = detach_upload(file)
+            return submit_job('pipeline', lambda: run_pipeline(file, operations)[0], webhook_url)
+        
+        app.logger.info("Running pipeline %s for: %s", ' -> '.join(operations), secure_filename(file.filename))
+        result, stages = run_pipeline(file, operations)
+        response = cache_status_response(result, all(stage.get('cache') == 'HIT' for stage in stages))
+        response.headers['Server-Timing'] = server_timing_header(stages)
+        return response
+        
+    except BulkheadFull:
+        raise
+    except Exception as e:
+        app.logger.error("Unexpected error in pipeline endpoint: %s", e)
+        # Return dummy response as final fallback
+        dummy_response = create_dummy_response('pipeline', 'Image pipeline temporarily unavailable')
+        return jsonify(dummy_response)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll the state of an asynchronous job"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, **public_job(job)})
+
+@app.route('/api/results/<result_id>', methods=['GET'])
+def get_stored_result(result_id):
+    """Serve a stored binary result created with ?response=url"""
+    stored = result_store.get(result_id) if is_result_id(result_id) else None
+    if stored is None:
+        return jsonify({'success': False, 'error': 'Result not found or expired'}), 404
+    
+    response = Response(stored['image_bytes'], mimetype=stored['content_type'])
+    response.headers['Cache-Control'] = f'private, max-age={int(RESULT_STORE_TTL_SECONDS)}'
+    return response
+
+@app.errorhandler(BulkheadFull)
+def upstream_at_capacity(e):
+    """Turn away requests for a saturated or rate-limited upstream quickly (BULKHEAD_ON_FULL=reject)"""
+    response = jsonify({'success': False, 'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response
+
 @app.errorhandler(413)
 def too_large(e):
     """Handle file too large error"""
@@ -0,0 +1,1213 @@
+"""
+ASGI serving mode for the AiFreeSet backend.
+
+Exposes the same routes and response shapes as app.py, but upstream calls
+run on a shared non-blocking httpx client, so a single process can hold
+thousands of in-flight upstream requests instead of one per worker thread.
+
+Run with: uvicorn asgi_app:asgi_app --host 0.0.0.0 --port $PORT
+"""
+
+import os
+import asyncio
+import contextlib
+import json
+import math
+import time
+import threading
+from collections import deque
+from types import SimpleNamespace
+
+import httpx
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import FileStorage
+from werkzeug.http import parse_options_header
+from werkzeug.utils import secure_filename
+
+from app import (
+    app as flask_app,
+    MAX_FILE_SIZE,
+    PROVIDERS,
+    OPERATIONS,
+    IMAGE_OPERATIONS,
+    provider_headers,
+    operation_parser,
+    UploadView,
+    HEDGE_REQUESTS,
+    operation_targets,
+    next_available_target,
+    record_target_outcome,
+    record_failover_event,
+    get_hedge_delay,
+    upstream_timeouts,
+    record_provider_latency,
+    record_connect_latency,
+    get_latency_stats,
+    BulkheadFull,
+    bulkhead_limits,
+    bulkhead_fallback,
+    RateLimited,
+    rate_limiter,
+    RATE_LIMIT_STORE,
+    get_rate_limit_stats,
+    metrics,
+    render_metrics,
+    start_trace,
+    finish_trace,
+    trace_span,
+    trace_exporter,
+    log_handler,
+    fault_injector,
+    fault_response,
+    INBOUND_RATE_STORE,
+    inbound_limiter,
+    inbound_rate_limit,
+    inbound_client_id,
+    inbound_rate_headers,
+    inbound_rejection,
+    operation_fallback,
+    get_failover_stats,
+    UPSTREAM_POOL_MAXSIZE,
+    DEFAULT_RETRY_POLICY,
+    operation_retry_budget,
+    RETRY_MIN_ATTEMPT_SECONDS,
+    RetryableUpstreamError,
+    check_upstream_status,
+    get_retry_stats,
+    get_circuit_breaker,
+    get_circuit_stats,
+    result_cache,
+    make_result_cache_key,
+    ai_art_cache,
+    make_prompt_cache_key,
+    get_ai_art_cache_stats,
+    STREAMING_UPLOADS,
+    STREAMING_RETRY_POLICY,
+    UPLOAD_CHUNK_SIZE,
+    StreamingUploadRelay,
+    UploadRejected,
+    UploadTooLarge,
+    RESULT_STORE_TTL_SECONDS,
+    result_store,
+    is_result_id,
+    get_response_mode,
+    prepare_image_result,
+    validate_image_upload,
+    create_dummy_response,
+    JOB_STORE,
+    job_store,
+    new_job,
+    public_job,
+    job_result_payload,
+    deliver_webhook,
+    detach_upload,
+    validate_webhook_url,
+    BATCH_MAX_ITEMS,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_REQUEST_SIZE,
+    parse_operation_list,
+    PIPELINE_MAX_STAGES,
+    preprocess_upload,
+    get_preprocess_stats,
+    PIPELINE_DOWNLOAD_TIMEOUT,
+    result_output_url,
+    parse_stage_download,
+    add_stage_chunk,
+    decode_data_url,
+    stage_upload,
+    pipeline_stopped,
+    server_timing_header,
+    expand_batch_uploads,
+    batch_result_line
+)
+
+logger = flask_app.logger
+
+# Async upstream client configuration
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '1000'))  # In-flight upstream calls per process
+ASYNC_MAX_KEEPALIVE = int(os.getenv('ASYNC_MAX_KEEPALIVE', str(UPSTREAM_POOL_MAXSIZE)))
+ASYNC_BULKHEAD_MAX_CONCURRENT = int(os.getenv('ASYNC_BULKHEAD_MAX_CONCURRENT', '64'))  # In-flight calls per upstream
+
+_async_client = None
+
+class _AsyncFaultBody(httpx.AsyncByteStream):
+    """Injected response body: 'chunk' bytes every 'interval' seconds, cut short after 'delivered' bytes"""
+
+    def __init__(self, request, body, delivered, chunk=None, interval=0.0, read_timeout=None):
+        self.request = request
+        self.body = body
+        self.delivered = delivered
+        self.chunk = chunk or delivered or 1
+        self.interval = interval
+        self.read_timeout = read_timeout
+
+    async def __aiter__(self):
+        for position in range(0, self.delivered, self.chunk):
+            if self.interval:
+                if self.read_timeout is not None and self.interval > self.read_timeout:
+                    await asyncio.sleep(self.read_timeout)
+                    raise httpx.ReadTimeout('Injected slow body exceeds the read timeout', request=self.request)
+                await asyncio.sleep(self.interval)
+            yield self.body[position:min(position + self.chunk, self.delivered)]
+        if self.delivered < len(self.body):
+            raise httpx.RemoteProtocolError(
+                'peer closed connection without sending complete message body (injected)', request=self.request
+            )
+
+class FaultInjectionTransport(httpx.AsyncBaseTransport):
+    """Applies fault_injector plans to async upstream calls, failing the way httpcore would"""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        fault = fault_injector.next_fault(str(request.url)) if fault_injector.plans else None
+        if fault is None:
+            return await self.transport.handle_async_request(request)
+
+        timeouts = request.extensions.get('timeout', {})
+        read_timeout = timeouts.get('read')
+        kind = fault['fault']
+        await asyncio.sleep(fault.get('delay', 0))
+
+        if kind == 'latency':
+            if read_timeout is not None and fault.get('seconds', 0) > read_timeout:
+                await asyncio.sleep(read_timeout)
+                raise httpx.ReadTimeout(f"Injected {fault['seconds']}s latency exceeds the read timeout", request=request)
+            await asyncio.sleep(fault.get('seconds', 0))
+            return await self.transport.handle_async_request(request)
+        if kind == 'drop':
+            raise httpx.ReadError('Connection reset by peer (injected)', request=request)
+        if kind == 'connect_timeout':
+            await asyncio.sleep(timeouts.get('connect') or 0)
+            raise httpx.ConnectTimeout('Injected connect timeout', request=request)
+
+        status, headers, body, delivered = fault_response(fault)
+        slow = kind == 'slowloris'
+        stream = _AsyncFaultBody(
+            request, body, delivered,
+            chunk=fault.get('chunk', 1) if slow else None,
+            interval=fault.get('interval', 1.0) if slow else 0.0,
+            read_timeout=read_timeout
+        )
+        return httpx.Response(status, headers=headers, stream=stream, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def get_async_client():
+    """Return the process-wide non-blocking upstream client, creating it on first use"""
+    global _async_client
+    if _async_client is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_KEEPALIVE
+            )
+        )
+        _async_client = httpx.AsyncClient(
+            transport=FaultInjectionTransport(transport),
+            headers={'User-Agent': 'AiFreeSet-Backend/1.0'}
+        )
+    return _async_client
+
+# Transport errors worth another attempt, mirroring UPSTREAM_RETRY_EXCEPTIONS in app.py
+ASYNC_RETRY_EXCEPTIONS = (RetryableUpstreamError, httpx.TimeoutException, httpx.NetworkError)
+
+async def async_post_with_retry(provider, api_url, parse_response, timeout, label='API', **request_kwargs):
+    """Non-blocking counterpart of call_with_retry(), sharing its budget and counters"""
+    return await async_request_with_retry('POST', provider, api_url, parse_response, timeout, label, adaptive=True, **request_kwargs)
+
+def connect_trace(api_url):
+    """httpcore trace hook feeding TCP connect (plus TLS handshake) time into the host's connect histogram (async, as AsyncClient requires)"""
+    url = httpx.URL(api_url)
+    done_event = 'connection.start_tls.complete' if url.scheme == 'https' else 'connection.connect_tcp.complete'
+    started = {}
+
+    async def _trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            started['at'] = time.monotonic()
+        elif event_name == done_event and 'at' in started:
+            record_connect_latency(url.host, time.monotonic() - started.pop('at'))
+
+    return _trace
+
+async def rate_limiter_call(method, *args):
+    """Call a rate limiter method, off the event loop when its state lives in SQLite"""
+    if RATE_LIMIT_STORE == 'sqlite':
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+async def async_request_with_retry(method, provider, api_url, parse_response, timeout, label='API', adaptive=False, stream=False, **request_kwargs):
+    """Send method to api_url under the shared retry budget and parse the response
+
+    With adaptive, timeout is only the ceiling: connect and read timeouts follow the upstream's observed latency.
+    With stream, the body is left unread and parse_response is awaited to consume it.
+    """
+    client = get_async_client()
+    connect_timeout, read_timeout = upstream_timeouts(provider, api_url, timeout) if adaptive else (None, timeout)
+    if adaptive:
+        request_kwargs['extensions'] = {'trace': connect_trace(api_url)}
+
+    # Upstreams with a bulkhead hold one of its slots for the whole logical request
+    with trace_span('upstream', provider=provider):
+        async with get_async_bulkhead(provider):
+            budget = DEFAULT_RETRY_POLICY.start(provider)
+
+            while True:
+                try:
+                    wait = await rate_limiter_call(rate_limiter.reserve, provider, max(0.0, budget.remaining() - RETRY_MIN_ATTEMPT_SECONDS))
+                except RateLimited:
+                    budget.failed()
+                    raise
+                if wait > 0:
+                    logger.info("%s rate limit: waiting %.2fs for a request slot", provider, wait)
+                    with trace_span('rate_limit_wait', seconds=round(wait, 3)):
+                        await asyncio.sleep(wait)
+
+                attempt_timeout = budget.begin_attempt(read_timeout)
+                started = time.monotonic()
+                try:
+                    with trace_span('attempt', number=budget.attempts, timeout=round(attempt_timeout, 2)):
+                        logger.debug("%s request attempt %s/%s (timeout %.1fs)", provider, budget.attempts, budget.policy.max_attempts, attempt_timeout)
+                        response = await client.send(client.build_request(
+                            method,
+                            api_url,
+                            timeout=httpx.Timeout(attempt_timeout, connect=min(connect_timeout, attempt_timeout)) if adaptive else attempt_timeout,
+                            **request_kwargs
+                        ), stream=stream)
+                        try:
+                            logger.debug("%s response status: %s", label, response.status_code)
+                            await rate_limiter_call(rate_limiter.observe, provider, response)
+                            if stream and response.status_code != 200:
+                                await response.aread()  # check_upstream_status() quotes the error body
+                            check_upstream_status(response, label)
+                            result = await parse_response(response) if stream else parse_response(response)
+                        finally:
+                            await response.aclose()
+                except ASYNC_RETRY_EXCEPTIONS as e:
+                    if isinstance(e, httpx.TimeoutException):
+                        metrics.inc('upstream_timeouts_total', (provider,))
+                    if isinstance(e, httpx.ReadTimeout):
+                        # A timed-out attempt still tells us the upstream took at least this long
+                        record_provider_latency(provider, time.monotonic() - started)
+                    delay = budget.next_delay(e)
+                    logger.warning("%s attempt %s failed: %s, retrying in %.2fs", provider, budget.attempts, e, delay)
+                    with trace_span('backoff', seconds=round(delay, 3)):
+                        await asyncio.sleep(delay)
+                    continue
+                except Exception:
+                    budget.failed()
+                    raise
+
+                record_provider_latency(provider, time.monotonic() - started)
+                budget.succeeded()
+                return result
+
+class AsyncBulkhead:
+    """asyncio counterpart of Bulkhead: same limits, same BulkheadFull when the queue is full or times out"""
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters = deque()
+
+    async def __aenter__(self):
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            return self
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise BulkheadFull(self.name, f"{self.name} is at capacity ({self.in_flight} in flight, {len(self._waiters)} queued)")
+
+        # Created per wait, so the bulkhead isn't tied to one event loop
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise BulkheadFull(self.name, f"{self.name} is at capacity (no slot within {self.queue_timeout:.1f}s)")
+        except asyncio.CancelledError:
+            # A slot handed over just as the caller went away must be passed on
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._release()
+
+    def _release(self):
+        # Hand the slot straight to the next live waiter; in_flight stays the same
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def snapshot(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out
+        }
+
+_async_bulkheads = {}
+
+def get_async_bulkhead(provider):
+    """The provider's bulkhead as an async context manager (a no-op for non-provider calls)"""
+    if provider not in PROVIDERS:
+        return contextlib.nullcontext()
+    bulkhead = _async_bulkheads.get(provider)
+    if bulkhead is None:
+        bulkhead = _async_bulkheads[provider] = AsyncBulkhead(provider, **bulkhead_limits(provider, ASYNC_BULKHEAD_MAX_CONCURRENT))
+    return bulkhead
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight: concurrent duplicates await one task"""
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {'executions': 0, 'coalesced': 0}
+
+    async def do(self, key, fn):
+        """Await fn() once per key at a time; returns (result, shared)"""
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(future), True
+
+        self._stats['executions'] += 1
+        future = asyncio.ensure_future(fn())
+        self._calls[key] = future
+        try:
+            return await asyncio.shield(future), False
+        finally:
+            if future.done():
+                self._calls.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+ai_art_async_flight = AsyncSingleFlight()
+
+async def async_call_operation(operation, send_to_target):
+    """asyncio counterpart of call_operation(): failover across providers, hedging past the p95, one shared retry budget"""
+    with operation_retry_budget(operation):
+        return await _async_call_operation(operation, send_to_target)
+
+async def _async_call_operation(operation, send_to_target):
+    spec = OPERATIONS[operation]
+    targets = operation_targets(spec)
+    hedging = spec.get('hedge', HEDGE_REQUESTS) and len(targets) > 1
+    record_failover_event(operation, 'calls')
+    skipped = []
+    error = None
+
+    async def _attempt(target):
+        try:
+            result = await send_to_target(target)
+        except asyncio.CancelledError:
+            record_target_outcome(target, ignored=True)
+            raise
+        except Exception as e:
+            record_target_outcome(target, e)
+            raise
+        record_target_outcome(target)
+        return result
+
+    in_flight = {}
+    first = None
+    hedged = False
+    try:
+        while True:
+            if not in_flight:
+                target = next_available_target(targets, skipped)
+                if target is None:
+                    return operation_fallback(operation, skipped, error)
+                if error is not None:
+                    record_failover_event(operation, 'failovers')
+                    logger.warning("Failing over %s to %s after: %s", operation, target['provider'], error)
+                first = first or target
+                in_flight[asyncio.ensure_future(_attempt(target))] = target
+
+            delay = None
+            if hedging and not hedged and targets and len(in_flight) == 1:
+                delay = get_hedge_delay(next(iter(in_flight.values()))['provider'])
+            done, _ = await asyncio.wait(in_flight, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                hedged = True
+                target = next_available_target(targets, skipped)
+                if target is not None:
+                    record_failover_event(operation, 'hedges')
+                    logger.info("Hedging %s to %s after %.2fs", operation, target['provider'], delay)
+                    in_flight[asyncio.ensure_future(_attempt(target))] = target
+                continue
+
+            for task in done:
+                target = in_flight.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if hedged and target is not first:
+                    record_failover_event(operation, 'hedge_wins')
+                return result
+    finally:
+        # Losing calls are cancelled; they count as neither success nor failure but free a half-open probe
+        for task in in_flight:
+            task.cancel()
+
+def size_limited_request(request, limit, error):
+    """Wrap request so reading more than limit body bytes raises UploadTooLarge(error)"""
+    # A chunked upload has no Content-Length, so count the body as it arrives and stop at the limit
+    received = 0
+
+    async def _receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get('body', b''))
+        if received > limit:
+            raise UploadTooLarge(error)
+        return message
+
+    return Request(request.scope, _receive)
+
+async def read_image_upload(request):
+    """Parse the multipart upload and run the shared validate_image_upload() checks; returns (file, form, error)"""
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE:
+        return None, None, ({'success': False, 'error': 'File size exceeds 10MB limit'}, 413)
+
+    try:
+        form = await size_limited_request(request, MAX_FILE_SIZE, 'File size exceeds 10MB limit').form()
+    except UploadTooLarge as e:
+        return None, None, ({'success': False, 'error': str(e)}, 413)
+    upload = form.get('image')
+    files = {}
+    if upload is not None and hasattr(upload, 'file'):
+        files['image'] = FileStorage(
+            stream=upload.file,
+            filename=upload.filename,
+            content_type=upload.content_type
+        )
+
+    # Validation reads the spooled upload, keep it off the event loop
+    file, error = await run_in_threadpool(validate_image_upload, SimpleNamespace(files=files))
+    if error:
+        return None, form, (error, 400)
+    return file, form, None
+
+async def async_preprocess_upload(image, max_dimension, request=None):
+    """Run preprocess_upload() off the event loop, tallying bytes saved on the request"""
+    image, stats = await run_in_threadpool(preprocess_upload, image, max_dimension)
+    if stats and request is not None:
+        request.state.upload_bytes_saved = getattr(request.state, 'upload_bytes_saved', 0) + stats['bytes_saved']
+    return image
+
+async def render_result(request, result, cache_status):
+    """Send a result in the requested response mode (json, binary or url)"""
+    mode = get_response_mode(request.query_params.get('response'), request.headers.get('accept'))
+    headers = {'X-Cache': cache_status, 'X-Result-Source': result.get('source', 'api')}
+    if hasattr(request.state, 'upload_bytes_saved'):
+        headers['X-Upload-Bytes-Saved'] = str(request.state.upload_bytes_saved)
+
+    # Base64 encoding and result-store writes handle whole images, keep them off the event loop
+    with trace_span('encode', mode=mode):
+        prepared = await run_in_threadpool(
+            prepare_image_result, result, mode, lambda result_id: str(request.url_for('get_stored_result', result_id=result_id))
+        )
+        if prepared[0] == 'binary':
+            return Response(prepared[1], media_type=prepared[2], headers=headers)
+        if prepared[0] == 'redirect':
+            return RedirectResponse(prepared[1], status_code=302, headers=headers)
+        return JSONResponse(prepared[1], headers=headers)
+
+async def get_stored_result(request):
+    """Serve a stored binary result created with ?response=url"""
+    result_id = request.path_params['result_id']
+    stored = await run_in_threadpool(result_store.get, result_id) if is_result_id(result_id) else None
+    if stored is None:
+        return JSONResponse({'success': False, 'error': 'Result not found or expired'}, status_code=404)
+    return Response(
+        stored['image_bytes'],
+        media_type=stored['content_type'],
+        headers={'Cache-Control': f'private, max-age={int(RESULT_STORE_TTL_SECONDS)}'}
+    )
+
+def wants_async_job(request):
+    """Job mode is requested with ?async=1 or a Prefer: respond-async header"""
+    flag = request.query_params.get('async', '').lower()
+    return flag in ('1', 'true', 'yes') or 'respond-async' in request.headers.get('prefer', '')
+
+# Keep references to running job tasks so they aren't garbage collected mid-flight
+_job_tasks = set()
+
+async def run_async_job(job_id, operation_function, base_url):
+    """Await a job on the event loop and record its outcome"""
+    await run_in_threadpool(job_store.update, job_id, status='running')
+    try:
+        result = await operation_function()
+        job = await run_in_threadpool(
+            job_store.update, job_id, status='succeeded', result=await run_in_threadpool(job_result_payload, result, base_url)
+        )
+    except Exception as e:
+        logger.error("Job %s failed: %s", job_id, e)
+        job = await run_in_threadpool(job_store.update, job_id, status='failed', error=str(e))
+    await run_in_threadpool(deliver_webhook, job)
+
+async def submit_async_job(request, operation, operation_function, webhook_url=None):
+    """Schedule operation_function() as a background task and return the 202 response"""
+    job = await run_in_threadpool(job_store.create, new_job(operation, webhook_url))
+    base_url = str(request.base_url).rstrip('/')
+    task = asyncio.ensure_future(run_async_job(job['job_id'], operation_function, base_url))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    logger.info("Queued %s job %s", operation, job['job_id'])
+
+    return JSONResponse(
+        {
+            'success': True,
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'status_url': f"{base_url}/api/jobs/{job['job_id']}"
+        },
+        status_code=202,
+        headers={'Location': f"/api/jobs/{job['job_id']}"}
+    )
+
+async def get_job(request):
+    """Poll the state of an asynchronous job"""
+    job = await run_in_threadpool(job_store.get, request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'success': False, 'error': 'Job not found'}, status_code=404)
+    return JSONResponse({'success': True, **public_job(job)})
+
+def wants_streaming_upload(request):
+    """Streaming proxy mode is opt-in per request (?stream=1) or via STREAMING_UPLOADS"""
+    if request.headers.get('content-type', '').split(';')[0].strip() != 'multipart/form-data':
+        return False
+    flag = request.query_params.get('stream')
+    if flag is None:
+        return STREAMING_UPLOADS
+    return flag.lower() in ('1', 'true', 'yes')
+
+async def async_stream_image_operation(request, endpoint_type):
+    """Forward the client's upload to the upstream chunk by chunk, validating inline"""
+    spec = IMAGE_OPERATIONS[endpoint_type]
+    provider, api_url, timeout, fields = spec['provider'], spec['url'], spec['timeout'], spec.get('params')
+    logger.info("Streaming %s upload to %s", endpoint_type, provider)
+
+    breaker = get_circuit_breaker(endpoint_type)
+    if breaker and not breaker.allow_request():
+        logger.warning("Circuit %s open, short-circuiting %s to dummy response", breaker.name, endpoint_type)
+        return JSONResponse(create_dummy_response(endpoint_type, f"{breaker.name} circuit open, using dummy response"))
+
+    # Exits that never got an upstream answer (bad or oversized upload, client gone, full bulkhead, cancellation)
+    # free a half-open probe without counting against the provider
+    outcome_recorded = False
+    try:
+        _, params = parse_options_header(request.headers.get('content-type', ''))
+        if not params.get('boundary'):
+            return JSONResponse({'success': False, 'error': 'No image file provided'}, status_code=400)
+        relay = StreamingUploadRelay(params['boundary'], fields)
+
+        async def _body():
+            received = 0
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > MAX_FILE_SIZE + UPLOAD_CHUNK_SIZE:
+                    raise UploadTooLarge('File size exceeds 10MB limit')
+                for data in relay.feed(chunk):
+                    yield data
+            for data in relay.finish():
+                yield data
+
+        # A streamed body can't be replayed, so this is a single attempt
+        connect_timeout, read_timeout = upstream_timeouts(provider, api_url, timeout)
+        try:
+            async with get_async_bulkhead(provider):
+                budget = STREAMING_RETRY_POLICY.start(provider)
+                try:
+                    wait = await rate_limiter_call(rate_limiter.reserve, provider)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    budget.begin_attempt(read_timeout)
+                    started = time.monotonic()
+                    response = await get_async_client().post(
+                        api_url,
+                        content=_body(),
+                        headers={**provider_headers(provider), 'Content-Type': relay.content_type},
+                        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                        extensions={'trace': connect_trace(api_url)}
+                    )
+                    logger.debug("%s response status: %s", spec['label'], response.status_code)
+                    await rate_limiter_call(rate_limiter.observe, provider, response)
+                    check_upstream_status(response, spec['label'])
+                    result = operation_parser(spec)(response)
+                except Exception:
+                    budget.failed()
+                    raise
+        except UploadTooLarge as e:
+            logger.warning("Streaming %s upload exceeds the size limit", endpoint_type)
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=413)
+        except UploadRejected as e:
+            logger.warning("Streaming upload rejected: %s", e)
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+        except ClientDisconnect:
+            logger.warning("Client disconnected during %s streaming upload", endpoint_type)
+            return JSONResponse({'success': False, 'error': 'Upload incomplete'}, status_code=400)
+        except BulkheadFull as e:
+            return JSONResponse(bulkhead_fallback(endpoint_type, e))
+        except Exception as e:
+            if breaker:
+                breaker.record_failure()
+                outcome_recorded = True
+            logger.error("API call failed for %s: %s", endpoint_type, e)
+            logger.info("Returning dummy fallback response for %s", endpoint_type)
+            return JSONResponse(create_dummy_response(endpoint_type))
+
+        record_provider_latency(provider, time.monotonic() - started)
+        budget.succeeded()
+        if breaker:
+            breaker.record_success()
+            outcome_recorded = True
+    finally:
+        if breaker and not outcome_recorded:
+            breaker.record_ignored()
+
+    logger.info("Streamed %s bytes for %s", relay.size, relay.filename)
+    await run_in_threadpool(result_cache.set, make_result_cache_key(relay.digest.hexdigest(), endpoint_type, fields), result)
+    return await render_result(request, result, 'MISS')
+
+def image_endpoint(endpoint_type):
+    """Build an async image endpoint for a registered operation, mirroring handle_image_operation()"""
+    label = IMAGE_OPERATIONS[endpoint_type]['label']
+
+    async def endpoint(request):
+        logger.debug("=== %s REQUEST STARTED (asgi) ===", endpoint_type.upper())
+
+        try:
+            if wants_streaming_upload(request):
+                return await async_stream_image_operation(request, endpoint_type)
+
+            with trace_span('validate'):
+                file, form, error = await read_image_upload(request)
+            if error:
+                body, status = error
+                return JSONResponse(body, status_code=status)
+
+            # Long-running mode: jobs outlive the request, so they work on their own copy of the upload
+            if wants_async_job(request):
+                try:
+                    webhook_url = await run_in_threadpool(
+                        validate_webhook_url, request.query_params.get('webhook_url') or form.get('webhook_url')
+                    )
+                except ValueError as e:
+                    return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+                file = await run_in_threadpool(detach_upload, file)
+
+                async def _job():
+                    return (await async_run_image_operation(file, endpoint_type))[0]
+                return await submit_async_job(request, endpoint_type, _job, webhook_url)
+
+            logger.info("Processing %s for: %s", endpoint_type, secure_filename(file.filename))
+            result, cache_hit = await async_run_image_operation(file, endpoint_type, request=request)
+            return await render_result(request, result, 'HIT' if cache_hit else 'MISS')
+
+        except BulkheadFull:
+            raise
+        except Exception as e:
+            logger.error("Unexpected error in %s endpoint: %s", endpoint_type, e)
+            return JSONResponse(create_dummy_response(endpoint_type, f"{label} service temporarily unavailable"))
+
+    return endpoint
+
+async def async_run_image_operation(file, operation, preprocess=True, request=None):
+    """Non-blocking counterpart of run_image_operation(); returns (result, cache_hit)"""
+    spec = IMAGE_OPERATIONS[operation]
+    cache_key = make_result_cache_key(file.sha256, operation, spec.get('params'))
+    # The cache may have a disk tier, so reads and writes go through the thread pool
+    cached = await run_in_threadpool(result_cache.get, cache_key)
+    if cached is not None:
+        logger.info("Result cache hit for %s", operation)
+        return cached, True
+
+    # Shrink the upload once for all providers; every attempt reads it through its own view
+    with trace_span('preprocess'):
+        upload_name, stream, content_type = await async_preprocess_upload(
+            (secure_filename(file.filename), file.stream, file.content_type or 'image/jpeg'),
+            spec.get('max_dimension') if preprocess else None,
+            request
+        )
+    lock = threading.Lock()
+
+    async def _send(target):
+        return await async_post_with_retry(
+            target['provider'],
+            target['url'],
+            operation_parser(target),
+            target['timeout'],
+            label=target['label'],
+            files={'image': (upload_name, UploadView(stream, lock), content_type)},
+            data=target.get('params'),
+            headers=provider_headers(target['provider'])
+        )
+
+    result = await async_call_operation(operation, _send)
+    if result.get('success') and result.get('source') != 'dummy':
+        await run_in_threadpool(result_cache.set, cache_key, result)
+    return result, False
+
+async def async_run_prompt_operation(operation, prompt):
+    """Non-blocking counterpart of run_prompt_operation()"""
+    async def _send(target):
+        return await async_post_with_retry(
+            target['provider'],
+            target['url'],
+            lambda response: target['parse_response'](response.json(), prompt),
+            target['timeout'],
+            label=target['label'],
+            json=target['build_request'](prompt),
+            headers=provider_headers(target['provider'])
+        )
+
+    return await async_call_operation(operation, _send)
+
+async def async_load_stage_output(result):
+    """Non-blocking counterpart of load_stage_output()"""
+    if result.get('image_bytes') is not None:
+        return result['image_bytes'], result.get('content_type', 'image/png')
+
+    output_url = result_output_url(result)
+    if not output_url:
+        raise Exception('Stage returned no image')
+    if output_url.startswith('data:'):
+        return decode_data_url(output_url)
+
+    # Streamed so an oversized result is dropped at the cap instead of read whole
+    async def _parse(response):
+        body = bytearray()
+        async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+            add_stage_chunk(body, chunk)
+        return parse_stage_download(body, response.headers)
+    return await async_request_with_retry(
+        'GET', 'pipeline', output_url, _parse, PIPELINE_DOWNLOAD_TIMEOUT, label='Stage download', stream=True
+    )
+
+async def async_run_pipeline(file, operations, request=None):
+    """Non-blocking counterpart of run_pipeline(); returns (result, stages)"""
+    stages = []
+    result = None
+    for operation in operations:
+        stage = {'operation': operation}
+        stages.append(stage)
+
+        if result is not None:
+            started = time.monotonic()
+            try:
+                image_bytes, content_type = await async_load_stage_output(result)
+            except Exception as e:
+                logger.error("Pipeline could not load output of %s: %s", stages[-2]['operation'], e)
+                result = create_dummy_response(operation, f"Could not load output of {stages[-2]['operation']}")
+                stage['status'] = 'failed'
+                break
+            file = stage_upload(image_bytes, content_type, file.filename)
+            stage['fetch_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+        # Only the client's upload is pre-processed; later stages must keep e.g. the upscaled size
+        started = time.monotonic()
+        result, cache_hit = await async_run_image_operation(file, operation, preprocess=len(stages) == 1, request=request)
+        stage.update(
+            ms=round((time.monotonic() - started) * 1000, 1),
+            cache='HIT' if cache_hit else 'MISS',
+            source=result.get('source', 'api'),
+            status='failed' if pipeline_stopped(result) else 'succeeded'
+        )
+        if pipeline_stopped(result):
+            logger.warning("Pipeline stopped at %s", operation)
+            break
+
+    stages.extend({'operation': operation, 'status': 'skipped'} for operation in operations[len(stages):])
+    return {**result, 'stages': stages}, stages
+
+async def process_pipeline(request):
+    """Run one upload through an ordered list of operations, returning only the final output"""
+    logger.debug("=== PIPELINE REQUEST STARTED (asgi) ===")
+
+    try:
+        file, form, error = await read_image_upload(request)
+        if error:
+            body, status = error
+            return JSONResponse(body, status_code=status)
+
+        try:
+            operations = parse_operation_list(form.getlist('operations') + form.getlist('operation'), unique=False)
+        except ValueError as e:
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+        if len(operations) > PIPELINE_MAX_STAGES:
+            return JSONResponse(
+                {'success': False, 'error': f'Pipelines are limited to {PIPELINE_MAX_STAGES} operations'}, status_code=400
+            )
+
+        # Long-running mode: run the pipeline as a background task and return immediately
+        if wants_async_job(request):
+            try:
+                webhook_url = await run_in_threadpool(validate_webhook_url, request.query_params.get('webhook_url') or form.get('webhook_url'))
+            except ValueError as e:
+                return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+            file = await run_in_threadpool(detach_upload, file)
+
+            async def _job():
+                return (await async_run_pipeline(file, operations))[0]
+            return await submit_async_job(request, 'pipeline', _job, webhook_url)
+
+        logger.info("Running pipeline %s for: %s", ' -> '.join(operations), secure_filename(file.filename))
+        result, stages = await async_run_pipeline(file, operations, request)
+        response = await render_result(request, result, 'HIT' if all(stage.get('cache') == 'HIT' for stage in stages) else 'MISS')
+        response.headers['Server-Timing'] = server_timing_header(stages)
+        return response
+
+    except BulkheadFull:
+        raise
+    except Exception as e:
+        logger.error("Unexpected error in pipeline endpoint: %s", e)
+        return JSONResponse(create_dummy_response('pipeline', 'Image pipeline temporarily unavailable'))
+
+async def process_batch(request):
+    """Apply operations to many images in one request, streaming NDJSON results as they finish"""
+    logger.debug("=== BATCH REQUEST STARTED (asgi) ===")
+
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > BATCH_MAX_REQUEST_SIZE:
+        return JSONResponse({'success': False, 'error': 'Batch exceeds the upload size limit'}, status_code=413)
+
+    try:
+        form = await size_limited_request(
+            request, BATCH_MAX_REQUEST_SIZE, 'Batch exceeds the upload size limit'
+        ).form(max_files=BATCH_MAX_ITEMS + 1)
+    except UploadTooLarge as e:
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=413)
+    uploads = [
+        FileStorage(stream=upload.file, filename=upload.filename, content_type=upload.content_type)
+        for field in ('images', 'image', 'archive')
+        for upload in form.getlist(field)
+        if hasattr(upload, 'file')
+    ]
+    try:
+        operations = parse_operation_list(form.getlist('operations') + form.getlist('operation'))
+        items = await run_in_threadpool(expand_batch_uploads, uploads)
+    except ValueError as e:
+        logger.warning("Invalid batch request: %s", e)
+        return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+
+    if not items:
+        return JSONResponse({'success': False, 'error': 'No image files provided'}, status_code=400)
+
+    # Binary output can't be embedded in NDJSON, so it falls back to inline JSON
+    mode = get_response_mode(request.query_params.get('response'), None)
+    if mode == 'binary':
+        mode = 'json'
+    logger.info("Batch of %s images x %s operations", len(items), len(operations))
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+    # Each (image, operation) result is queued as it finishes, not once the image is done
+    finished = asyncio.Queue()
+
+    async def _process(index, file):
+        # Operations on one image run in turn because they share its stream
+        async with limit:
+            for operation in operations:
+                try:
+                    result, cache_hit = await async_run_image_operation(file, operation)
+                except Exception as e:
+                    logger.error("Batch item %s %s failed: %s", index, operation, e)
+                    result, cache_hit = {'success': False, 'error': str(e)}, False
+                finished.put_nowait((index, operation, result, cache_hit))
+
+    async def _generate():
+        started = time.monotonic()
+        lines = failed = 0
+        tasks = []
+        files = {}
+        try:
+            for index, upload in enumerate(items):
+                file, error = await run_in_threadpool(validate_image_upload, SimpleNamespace(files={'image': upload}))
+                if error:
+                    for operation in operations:
+                        lines += 1
+                        failed += 1
+                        yield batch_result_line(index, upload.filename, operation, error)
+                    continue
+                files[index] = file
+                tasks.append(asyncio.ensure_future(_process(index, file)))
+
+            for _ in range(len(files) * len(operations)):
+                index, operation, result, cache_hit = await finished.get()
+                payload = (await run_in_threadpool(
+                    prepare_image_result, result, mode, lambda result_id: str(request.url_for('get_stored_result', result_id=result_id))
+                ))[1]
+                lines += 1
+                failed += 0 if result.get('success') else 1
+                yield batch_result_line(index, files[index].filename, operation, payload, 'HIT' if cache_hit else 'MISS')
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        logger.info("Batch finished: %s results, %s failed in %.0fms", lines, failed, elapsed_ms)
+        yield json.dumps({'done': True, 'results': lines, 'failed': failed, 'elapsed_ms': round(elapsed_ms, 1)}) + '\n'
+
+    return StreamingResponse(_generate(), media_type='application/x-ndjson')
+
+async def health_check(request):
+    """Health check endpoint with API status"""
+    logger.debug("Health check requested (asgi)")
+    return JSONResponse({
+        'status': 'AiFreeSet backend running',
+        'mode': 'asgi',
+        'api_keys_loaded': {name: bool(provider['api_key']) for name, provider in PROVIDERS.items()},
+        'operations': sorted(OPERATIONS),
+        'upstream_client': {
+            'max_connections': ASYNC_MAX_CONNECTIONS,
+            'max_keepalive_connections': ASYNC_MAX_KEEPALIVE
+        },
+        'retries': get_retry_stats(),
+        'circuits': get_circuit_stats(),
+        'result_cache': result_cache.stats(),
+        'ai_art_cache': get_ai_art_cache_stats(),
+        'ai_art_async_flight': ai_art_async_flight.stats(),
+        'jobs': {'store': JOB_STORE, 'running': len(_job_tasks)},
+        'batch': {'max_items': BATCH_MAX_ITEMS, 'concurrency': BATCH_CONCURRENCY},
+        'pipeline': {'max_stages': PIPELINE_MAX_STAGES},
+        'preprocess': get_preprocess_stats(),
+        'failover': get_failover_stats(),
+        'latency': get_latency_stats(),
+        'bulkheads': {name: bulkhead.snapshot() for name, bulkhead in _async_bulkheads.items()},
+        'rate_limits': get_rate_limit_stats(),
+        'inbound_rate_limits': inbound_limiter.stats(),
+        'tracing': trace_exporter.stats(),
+        'logging': log_handler.stats(),
+        'fault_injection': fault_injector.stats()
+    })
+
+async def prometheus_metrics(request):
+    """Prometheus scrape endpoint"""
+    bulkheads = {name: bulkhead.snapshot() for name, bulkhead in _async_bulkheads.items()}
+    return Response(render_metrics(bulkheads), media_type='text/plain; version=0.0.4')
+
+async def generate_ai_art(request):
+    """Generate AI art using Qwen API with graceful fallback"""
+    logger.debug("=== AI ART GENERATION REQUEST STARTED (asgi) ===")
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'prompt' not in data:
+            logger.warning("No prompt provided in request")
+            return JSONResponse({'success': False, 'error': 'Prompt is required'}, status_code=400)
+
+        prompt = data['prompt'].strip()
+        if not prompt:
+            logger.warning("Empty prompt provided")
+            return JSONResponse({'success': False, 'error': 'Prompt cannot be empty'}, status_code=400)
+
+        logger.info("Generating AI art with prompt: %s...", prompt[:100])
+
+        cache_key = make_prompt_cache_key(prompt)
+
+        async def _generate():
+            result = await async_run_prompt_operation('ai-art', prompt)
+            if result.get('success') and result.get('source') != 'dummy':
+                ai_art_cache.set(cache_key, result)
+            return result
+
+        # Long-running mode: run the generation as a background task and return immediately
+        if wants_async_job(request):
+            try:
+                webhook_url = await run_in_threadpool(validate_webhook_url, request.query_params.get('webhook_url') or data.get('webhook_url'))
+            except ValueError as e:
+                return JSONResponse({'success': False, 'error': str(e)}, status_code=400)
+
+            async def _job():
+                return ai_art_cache.get(cache_key) or (await ai_art_async_flight.do(cache_key, _generate))[0]
+            return await submit_async_job(request, 'ai-art', _job, webhook_url)
+
+        cached = ai_art_cache.get(cache_key)
+        if cached is not None:
+            logger.info("AI art cache hit")
+            return await render_result(request, cached, 'HIT')
+
+        # Identical prompts arriving together share one upstream call
+        result, shared = await ai_art_async_flight.do(cache_key, _generate)
+        return await render_result(request, result, 'COALESCED' if shared else 'MISS')
+
+    except BulkheadFull:
+        raise
+    except Exception as e:
+        logger.error("Unexpected error in AI art generation endpoint: %s", e)
+        return JSONResponse(create_dummy_response('ai-art', 'AI art generation service temporarily unavailable'))
+
+async def upstream_at_capacity(request, exc):
+    """Turn away requests for a saturated or rate-limited upstream quickly (BULKHEAD_ON_FULL=reject)"""
+    return JSONResponse(
+        {'success': False, 'error': str(exc)},
+        status_code=503,
+        headers={'Retry-After': str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+class RequestMetricsMiddleware:
+    """Count requests and time responses per route (the route template, not the raw path)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            metrics.inc('http_requests_total', (route, scope['method'], str(status[0])))
+            metrics.observe('http_request_duration_seconds', (route, scope['method']), time.perf_counter() - started)
+
+class TracingMiddleware:
+    """Root span per request; the request id is echoed in X-Request-ID and sent to upstreams"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        root = start_trace(
+            f"{scope['method']} {scope['path']}", Headers(scope=scope).get('x-request-id'), scope['path'],
+            method=scope['method']
+        )
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                root.attributes['status_code'] = message['status']
+                MutableHeaders(scope=message)['X-Request-ID'] = root.trace.request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            route = scope.get('route')
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            finish_trace(root)
+
+class InboundRateLimitMiddleware:
+    """Answer 429 to clients over their limit before any of the request body is received"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = inbound_rate_limit(scope['method'], scope['path']) if scope['type'] == 'http' else 0
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        remote_addr = scope['client'][0] if scope.get('client') else None
+        hit_args = (inbound_client_id(headers, remote_addr), scope['path'], limit)
+        if INBOUND_RATE_STORE == 'sqlite':
+            allowed, remaining, retry_after = await run_in_threadpool(inbound_limiter.hit, *hit_args)
+        else:
+            allowed, remaining, retry_after = inbound_limiter.hit(*hit_args)
+
+        if not allowed:
+            logger.warning("Rate limit exceeded on %s by %s", scope['path'], remote_addr)
+            response = JSONResponse(inbound_rejection(limit), status_code=429, headers=inbound_rate_headers(limit, 0, retry_after))
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).update(inbound_rate_headers(limit, remaining))
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+async def not_found(request, exc):
+    """Handle 404 errors"""
+    return JSONResponse({'success': False, 'error': 'Endpoint not found'}, status_code=404)
+
+async def internal_error(request, exc):
+    """Handle internal server errors"""
+    return JSONResponse({'success': False, 'error': 'Internal server error'}, status_code=500)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Release pooled upstream connections on shutdown"""
+    global _async_client
+    yield
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+routes = [
+    Route('/', health_check, methods=['GET']),
+    Route('/metrics', prometheus_metrics, methods=['GET']),
+    *[Route(f'/api/{name}', image_endpoint(name), methods=['POST']) for name in IMAGE_OPERATIONS],
+    Route('/api/ai-art', generate_ai_art, methods=['POST']),
+    Route('/api/batch', process_batch, methods=['POST']),
+    Route('/api/pipeline', process_pipeline, methods=['POST']),
+    Route('/api/jobs/{job_id}', get_job, methods=['GET']),
+    Route('/api/results/{result_id}', get_stored_result, methods=['GET'], name='get_stored_result')
+]
+
+asgi_app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestMetricsMiddleware),
+        Middleware(TracingMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['https://aifreeset.netlify.app'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(InboundRateLimitMiddleware)
+    ],
+    exception_handlers={404: not_found, 500: internal_error, BulkheadFull: upstream_at_capacity},
+    lifespan=lifespan
+)
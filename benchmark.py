@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Load-test the backend against local stand-ins for Pixelcut, Unwatermark and DashScope.
+
+Starts mock upstreams with configurable latency, error rate, 429s and JSON or binary
+responses, runs the app (gunicorn for Flask, uvicorn for ASGI) pointed at them, drives it
+at a fixed concurrency and reports throughput, latency percentiles, memory per worker and
+retry amplification (upstream calls per client request). Every run is appended to the
+results file and compared with the previous run of the same configuration.
+
+    python benchmark.py --scenario baseline --server flask --workers 2 --concurrency 16
+    python benchmark.py --scenario throttled --server asgi --operation watermark-remove
+    python benchmark.py --profiles '{"qwen": {"latency": 2.0}}' --operation ai-art
+    python benchmark.py --workers 1 --faults '{"pixelcut": {"fault": "slowloris", "interval": 0.5, "rate": 0.2}}'
+
+--faults sets the app's FAULT_INJECTION plans (see FAULT_KINDS in app.py) for failures the mocks
+cannot produce on their own: timeouts, connection resets, partial bodies, slow bodies and malformed
+JSON. Worker occupancy and fallback latency show how each failure mode ties up the app.
+"""
+
+import sys
+import os
+import io
+import json
+import math
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+RESULTS_FILE = 'benchmark_results.jsonl'
+REGRESSION_THRESHOLD = 0.2  # Relative change in throughput, p95 or amplification reported as a regression
+
+# Upstream behaviour per scenario; every provider gets the scenario profile unless --profiles overrides it.
+#   latency / jitter: seconds before answering (uniform within latency +- jitter)
+#   error_rate: share of calls answered 500; throttle_rate: share answered 429 with Retry-After
+#   response: 'json' (output URL) or 'binary' (image bytes; DashScope answers base64 in JSON)
+SCENARIOS = {
+    'baseline': {'latency': 0.05, 'jitter': 0.02},
+    'binary': {'latency': 0.05, 'jitter': 0.02, 'response': 'binary'},
+    'slow': {'latency': 0.5, 'jitter': 0.2},
+    'errors': {'latency': 0.05, 'jitter': 0.02, 'error_rate': 0.1},
+    'throttled': {'latency': 0.05, 'jitter': 0.02, 'throttle_rate': 0.1}
+}
+DEFAULT_PROFILE = {
+    'latency': 0.05, 'jitter': 0.0, 'error_rate': 0.0, 'throttle_rate': 0.0, 'retry_after': 1, 'response': 'json'
+}
+PROVIDER_PATHS = {'pixelcut': '/pixelcut', 'unwatermark': '/unwatermark', 'qwen': '/dashscope'}
+IMAGE_OPERATIONS = ('background-remove', 'upscale', 'unblur', 'watermark-remove')
+
+# Smallest body the app's header probe accepts: a JPEG SOF0 segment declaring 512x512
+UPLOAD_HEADER = b'\xff\xd8\xff\xc0\x00\x11\x08\x02\x00\x02\x00'
+RESULT_PNG = b'\x89PNG\r\n\x1a\n' + os.urandom(4096)
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            size = 0
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    return size
+                size += len(self.rfile.read(chunk_size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length', '0'))
+        return len(self.rfile.read(length))
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        upstreams = self.server.upstreams
+        self._read_body()
+        provider = next((name for name, prefix in PROVIDER_PATHS.items() if self.path.startswith(prefix + '/')), None)
+        if provider is None:
+            self._send(404, {'error': 'unknown path'})
+            return
+
+        profile, outcome = upstreams.decide(provider)
+        time.sleep(max(0.0, profile['latency'] + upstreams.uniform(-profile['jitter'], profile['jitter'])))
+        if outcome == 'error':
+            self._send(500, {'error': 'mock upstream error'})
+        elif outcome == 'throttled':
+            self._send(429, {'error': 'rate limited'}, headers={'Retry-After': str(profile['retry_after'])})
+        elif provider == 'qwen':
+            image = {'image': 'iVBORw0KGgo='} if profile['response'] == 'binary' else {'url': upstreams.result_url()}
+            self._send(200, {'output': {'task_status': 'SUCCEEDED', 'results': [image]}})
+        elif profile['response'] == 'binary':
+            self._send(200, RESULT_PNG, 'image/png')
+        else:
+            self._send(200, {'output_url': upstreams.result_url()})
+
+    def log_message(self, format, *args):
+        pass
+
+class MockUpstreams:
+    """One local HTTP server standing in for every provider, each under its own path prefix"""
+
+    def __init__(self, profiles=None, seed=None):
+        self.profiles = {provider: {**DEFAULT_PROFILE, **(profiles or {}).get(provider, {})} for provider in PROVIDER_PATHS}
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+        self._server.daemon_threads = True
+        self._server.upstreams = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def provider_url(self, provider):
+        return self.base_url + PROVIDER_PATHS[provider]
+
+    def app_env(self):
+        """Environment pointing the app at these mocks"""
+        return {
+            'PIXELCUT_API_BASE': self.provider_url('pixelcut'),
+            'UNWATERMARK_API_BASE': self.provider_url('unwatermark'),
+            'QWEN_API_BASE': self.provider_url('qwen'),
+            'PIXELCUT_API_KEY': 'bench-key',
+            'UNWATERMARK_API_KEY': 'bench-key',
+            'QWEN_API_KEY': 'bench-key'
+        }
+
+    def uniform(self, low, high):
+        with self._lock:
+            return self._random.uniform(low, high)
+
+    def decide(self, provider):
+        """Pick the outcome of one call and count it"""
+        profile = self.profiles[provider]
+        with self._lock:
+            roll = self._random.random()
+            if roll < profile['error_rate']:
+                outcome = 'error'
+            elif roll < profile['error_rate'] + profile['throttle_rate']:
+                outcome = 'throttled'
+            else:
+                outcome = 'ok'
+            self.counts[(provider, outcome)] += 1
+        return profile, outcome
+
+    def result_url(self):
+        return f'{self.base_url}/results/{uuid.uuid4().hex}.png'
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.counts.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {f'{provider}:{outcome}': count for (provider, outcome), count in sorted(self.counts.items())}
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def app_command(server, port, workers, threads):
+    if server == 'flask':
+        return [
+            sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning'
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'asgi_app:asgi_app', '--host', '127.0.0.1', '--port', str(port),
+        '--workers', str(workers), '--log-level', 'warning'
+    ]
+
+def start_app(server, workers, threads, env, startup_timeout=60):
+    """Start the app in a subprocess and wait until it answers; returns (process, base URL)"""
+    port = free_port()
+    # A file rather than a pipe, so a chatty app can never block on a full pipe buffer
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        app_command(server, port, workers, threads), env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=errors
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            errors.seek(0)
+            raise Exception(f"{server} app exited during startup: {errors.read().decode('utf-8', 'replace')[-2000:]}")
+        try:
+            if requests.get(base_url + '/', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise Exception(f"{server} app did not answer within {startup_timeout}s")
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def worker_pids(pid):
+    """Worker processes of a server (its children), or the server itself when it has none"""
+    children = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The parent pid is the 2nd field after the parenthesised command name
+                if int(stat.read().rsplit(')', 1)[1].split()[1]) != pid:
+                    continue
+            with open(f'/proc/{entry}/cmdline', 'rb') as cmdline:
+                # multiprocessing's resource tracker is a child of uvicorn's supervisor, not a worker
+                if b'resource_tracker' not in cmdline.read():
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children or [pid]
+
+def rss_mb(pid):
+    """Resident memory of a process in MB, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class MemorySampler:
+    """Track the peak RSS of each worker while the load runs"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        for pid in worker_pids(self.pid):
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.peaks[pid] = max(rss, self.peaks.get(pid, 0))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return sorted(self.peaks.values())
+
+def send_request(session, base_url, operation, timeout):
+    """One client request with a unique payload (so result caches never answer); returns (seconds, status, source)"""
+    started = time.perf_counter()
+    try:
+        if operation == 'ai-art':
+            response = session.post(f'{base_url}/api/ai-art', json={'prompt': f'benchmark {uuid.uuid4().hex}'}, timeout=timeout)
+        else:
+            upload = io.BytesIO(UPLOAD_HEADER + os.urandom(2048))
+            response = session.post(
+                f'{base_url}/api/{operation}', files={'image': ('bench.jpg', upload, 'image/jpeg')}, timeout=timeout
+            )
+        source = None
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            source = response.json().get('source')
+        return time.perf_counter() - started, response.status_code, source
+    except requests.RequestException:
+        return time.perf_counter() - started, None, None
+
+def run_load(base_url, operation, total, concurrency, timeout=180):
+    """Send total requests from concurrency client threads; returns (samples, wall seconds)"""
+    samples = []
+    remaining = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            sample = send_request(session, base_url, operation, timeout)
+            with lock:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+def summarize(samples, wall_seconds, upstream_calls, worker_rss, slots=None, injected_faults=0):
+    """Results of one run; slots is the number of requests the app can serve at once (None if unbounded)"""
+    latencies = [seconds for seconds, _, _ in samples]
+    fallback_latencies = [seconds for seconds, _, source in samples if source == 'dummy']
+    # Little's law: busy request-seconds per second is the average number of requests in flight
+    in_flight = sum(latencies) / wall_seconds if wall_seconds else 0.0
+    statuses = Counter(str(status) for _, status, _ in samples)
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(max(latencies, default=None)),
+        'statuses': dict(sorted(statuses.items())),
+        'failed': sum(1 for _, status, _ in samples if status is None or status >= 500),
+        'fallbacks': len(fallback_latencies),
+        'fallback_p50_ms': ms(percentile(fallback_latencies, 0.50)),
+        'fallback_p95_ms': ms(percentile(fallback_latencies, 0.95)),
+        'upstream_calls': upstream_calls,
+        'injected_faults': injected_faults,
+        'retry_amplification': round((upstream_calls + injected_faults) / len(samples), 3) if samples else None,
+        'avg_in_flight': round(in_flight, 2),
+        'worker_occupancy': round(in_flight / slots, 3) if slots else None,
+        'worker_rss_mb': [round(rss, 1) for rss in worker_rss]
+    }
+
+def run_key(record):
+    """Runs are comparable when everything but the measurements matches"""
+    return json.dumps(record['config'], sort_keys=True)
+
+def load_previous(results_file, key):
+    previous = None
+    try:
+        with open(results_file) as results:
+            for line in results:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    if run_key(record) == key:
+                        previous = record
+    except FileNotFoundError:
+        pass
+    return previous
+
+def compare_runs(previous, current, threshold=REGRESSION_THRESHOLD):
+    """Human-readable regressions of current against previous (empty when none)"""
+    regressions = []
+    old, new = previous['results'], current['results']
+    if old['throughput_rps'] and new['throughput_rps'] < old['throughput_rps'] * (1 - threshold):
+        regressions.append(f"throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s")
+    for field in ('p50_ms', 'p95_ms', 'p99_ms', 'retry_amplification'):
+        if old.get(field) and new.get(field) is not None and new[field] > old[field] * (1 + threshold):
+            regressions.append(f"{field} {old[field]} -> {new[field]}")
+    if old.get('worker_rss_mb') and new.get('worker_rss_mb'):
+        if max(new['worker_rss_mb']) > max(old['worker_rss_mb']) * (1 + threshold):
+            regressions.append(f"worker RSS {max(old['worker_rss_mb'])} -> {max(new['worker_rss_mb'])} MB")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def scenario_profiles(scenario, overrides=None):
+    profile = SCENARIOS[scenario]
+    return {provider: {**profile, **(overrides or {}).get(provider, {})} for provider in PROVIDER_PATHS}
+
+def run_benchmark(scenario='baseline', server='flask', operation='background-remove', requests_total=200,
+                  concurrency=16, workers=2, threads=8, warmup=10, profiles=None, seed=None, app_env=None, faults=None):
+    """Run one configuration end to end and return its result record"""
+    profiles = scenario_profiles(scenario, profiles)
+    upstreams = MockUpstreams(profiles, seed=seed).start()
+    env = {**os.environ, 'INBOUND_RATE_LIMIT': '0', 'LOG_LEVEL': 'WARNING', **upstreams.app_env(), **(app_env or {})}
+    if faults:
+        env['FAULT_INJECTION'] = json.dumps(faults)
+    try:
+        process, base_url = start_app(server, workers, threads, env)
+        try:
+            if warmup:
+                run_load(base_url, operation, warmup, min(concurrency, warmup))
+            upstreams.reset()
+            injected_before = injected_fault_count(base_url) if faults else 0
+            sampler = MemorySampler(process.pid).start()
+            samples, wall_seconds = run_load(base_url, operation, requests_total, concurrency)
+            worker_rss = sampler.stop()
+            injected = injected_fault_count(base_url) - injected_before if faults else 0
+        finally:
+            stop_app(process)
+        slots = workers * threads if server == 'flask' else None
+        results = summarize(samples, wall_seconds, upstreams.total_calls(), worker_rss, slots, injected)
+        results['upstream_outcomes'] = upstreams.snapshot()
+    finally:
+        upstreams.stop()
+
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'config': {
+            'scenario': scenario, 'server': server, 'operation': operation, 'requests': requests_total,
+            'concurrency': concurrency, 'workers': workers, 'threads': threads if server == 'flask' else None,
+            'profiles': profiles, 'app_env': app_env or {}, 'faults': faults or {}
+        },
+        'results': results
+    }
+
+def injected_fault_count(base_url):
+    """Faults injected since startup, as reported by the worker answering the health check
+
+    With several workers this is one worker's share; use --workers 1 for exact fault runs.
+    """
+    stats = requests.get(base_url + '/', timeout=10).json().get('fault_injection', {})
+    return sum(sum(kinds.values()) for kinds in stats.values())
+
+def record_run(record, results_file=RESULTS_FILE, threshold=REGRESSION_THRESHOLD):
+    """Append the run to results_file; returns regressions against the previous comparable run"""
+    previous = load_previous(results_file, run_key(record))
+    with open(results_file, 'a') as results:
+        results.write(json.dumps(record) + '\n')
+    return (previous, compare_runs(previous, record, threshold)) if previous else (None, [])
+
+def print_report(record, previous, regressions):
+    config, results = record['config'], record['results']
+    print(f"📊 {config['scenario']} · {config['server']} x{config['workers']} · {config['operation']} "
+          f"· {config['requests']} requests at concurrency {config['concurrency']}")
+    print(f"   Throughput:          {results['throughput_rps']} req/s")
+    print(f"   Latency p50/p95/p99: {results['p50_ms']} / {results['p95_ms']} / {results['p99_ms']} ms")
+    print(f"   Statuses:            {results['statuses']} ({results['fallbacks']} fallbacks)")
+    print(f"   Upstream calls:      {results['upstream_calls']} "
+          f"(retry amplification {results['retry_amplification']}x) {results['upstream_outcomes']}")
+    if results['injected_faults']:
+        print(f"   Injected faults:     {results['injected_faults']}")
+    if results['fallbacks']:
+        print(f"   Fallback p50/p95:    {results['fallback_p50_ms']} / {results['fallback_p95_ms']} ms")
+    occupancy = f" ({results['worker_occupancy']:.0%} of worker threads)" if results['worker_occupancy'] is not None else ''
+    print(f"   Avg in flight:       {results['avg_in_flight']}{occupancy}")
+    print(f"   Worker RSS:          {results['worker_rss_mb']} MB")
+    if previous is None:
+        print("   No previous run with this configuration")
+    elif regressions:
+        print(f"⚠️  Regressions since {previous['commit'] or previous['time']}:")
+        for regression in regressions:
+            print(f"   - {regression}")
+    else:
+        print(f"✅ No regressions since {previous['commit'] or previous['time']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='baseline')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--operation', choices=IMAGE_OPERATIONS + ('ai-art',), default='background-remove')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker (flask only)')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests sent first')
+    parser.add_argument('--profiles', type=json.loads, default=None,
+                        help='Per provider profile overrides as JSON, e.g. {"pixelcut": {"error_rate": 0.2}}')
+    parser.add_argument('--env', type=json.loads, default=None, help='Extra app environment as JSON')
+    parser.add_argument('--faults', type=json.loads, default=None,
+                        help='FAULT_INJECTION plans as JSON, e.g. {"pixelcut": {"fault": "drop", "rate": 0.3}}')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible upstream outcomes')
+    parser.add_argument('--results', default=RESULTS_FILE)
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    record = run_benchmark(
+        args.scenario, args.server, args.operation, args.requests, args.concurrency, args.workers,
+        args.threads, args.warmup, args.profiles, args.seed, args.env, args.faults
+    )
+    previous, regressions = record_run(record, args.results, args.threshold)
+    print_report(record, previous, regressions)
+    sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+if __name__ == "__main__":
+    main()
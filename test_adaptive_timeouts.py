@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test script for adaptive upstream timeouts:
+1. Latency histograms report percentiles and forget calls outside their window
+2. Connect/read timeouts follow observed percentiles within their floors and ceilings
+3. A hung upstream is abandoned at the adaptive timeout instead of the static one
+"""
+
+import sys
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def test_histogram_percentiles_and_window():
+    """Test bucketed percentiles and that old samples age out"""
+    from app import LatencyHistogram
+
+    histogram = LatencyHistogram(window_seconds=0.1)
+    assert histogram.percentile(0.99) is None
+    for _ in range(98):
+        histogram.observe(0.2)
+    histogram.observe(5.0)
+    histogram.observe(5.0)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 100
+    assert 0.2 <= snapshot['p50'] < 0.25 and 0.2 <= snapshot['p95'] < 0.25
+    assert 5.0 <= snapshot['p99'] < 6.25, snapshot
+
+    time.sleep(0.25)
+    assert histogram.count() == 0, "Samples older than two windows are forgotten"
+    print(f"✅ Histogram percentiles: {snapshot}")
+
+def test_timeouts_follow_percentiles():
+    """Test static ceilings until enough samples, then percentile-derived clamped timeouts"""
+    import app
+
+    ceiling = app.OPERATIONS['watermark-remove']['timeout']
+    url = 'https://adaptive.example/v1/remove'
+    assert app.upstream_timeouts('adaptive-test', url, ceiling) == (app.CONNECT_TIMEOUT_CEILING, ceiling)
+
+    for _ in range(app.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+        app.record_provider_latency('adaptive-test', 20.0)
+        app.record_connect_latency('adaptive.example', 0.05)
+    connect, read = app.upstream_timeouts('adaptive-test', url, ceiling)
+    assert connect == app.CONNECT_TIMEOUT_FLOOR, "Fast connects are clamped to the floor"
+    assert 40 <= read < 52, f"Read timeout is p99 x {app.ADAPTIVE_TIMEOUT_MULTIPLIER}: {read}"
+
+    for _ in range(10):
+        app.record_provider_latency('adaptive-test', 500.0)
+    assert app.upstream_timeouts('adaptive-test', url, ceiling)[1] == ceiling, "Never above the static ceiling"
+    print(f"✅ Adaptive timeouts: connect {connect}s, read {read:.1f}s (ceiling {ceiling}s)")
+
+def test_hung_upstream_abandoned_quickly():
+    """Test that a call far slower than the upstream's history times out at the adaptive read timeout"""
+    import app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/slow'
+    original_floor = app.READ_TIMEOUT_FLOOR
+    app.READ_TIMEOUT_FLOOR = 0.2
+    policy = app.RetryPolicy(max_attempts=1)
+
+    def _send(attempt_timeout):
+        return app.get_upstream_session(url).get(url, timeout=attempt_timeout).json()
+
+    try:
+        _SlowHandler.delay = 0.0
+        for _ in range(app.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+            assert app.call_with_retry('hung-test', _send, 30, policy=policy, api_url=url) == {'ok': True}
+        assert app.get_latency_stats()['connect']['127.0.0.1']['count'] >= 1, "Pooled connects are timed"
+
+        _SlowHandler.delay = 2.5
+        started = time.monotonic()
+        try:
+            app.call_with_retry('hung-test', _send, 30, policy=policy, api_url=url)
+            raise AssertionError("Expected the hung call to time out")
+        except Exception as e:
+            assert 'failed after 1 attempts' in str(e), e
+        elapsed = time.monotonic() - started
+        assert elapsed < 1.8, f"Abandoned after {elapsed:.2f}s instead of the 30s ceiling"
+        print(f"✅ Hung upstream abandoned after {elapsed:.2f}s (static timeout 30s)")
+    finally:
+        app.READ_TIMEOUT_FLOOR = original_floor
+        server.shutdown()
+
+if __name__ == "__main__":
+    print("🧪 Testing adaptive upstream timeouts...")
+    print("=" * 50)
+
+    tests = [
+        test_histogram_percentiles_and_window,
+        test_timeouts_follow_percentiles,
+        test_hung_upstream_abandoned_quickly
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
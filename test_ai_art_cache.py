@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for /api/ai-art prompt caching and request coalescing:
+1. Prompt normalization for cache keys
+2. Concurrent identical prompts share one upstream call
+3. Completed generations are served from the TTL cache
+"""
+
+import sys
+import os
+import time
+import uuid
+import threading
+sys.path.insert(0, os.path.dirname(__file__))
+
+def test_prompt_normalization():
+    """Test that whitespace and case differences map to the same key"""
+    from app import normalize_prompt, make_prompt_cache_key
+
+    assert normalize_prompt('  A  Beautiful\tSunset ') == 'a beautiful sunset'
+    assert make_prompt_cache_key('A beautiful sunset') == make_prompt_cache_key('a  BEAUTIFUL sunset')
+    assert make_prompt_cache_key('A beautiful sunset') != make_prompt_cache_key('A beautiful sunrise')
+    print("✅ Prompts are normalized for cache keys")
+
+def test_single_flight_coalesces():
+    """Test that SingleFlight runs one execution for concurrent duplicates"""
+    from app import SingleFlight
+
+    flight = SingleFlight()
+    executions = []
+    results = []
+
+    def slow_call():
+        executions.append(1)
+        time.sleep(0.2)
+        return {'value': 42}
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow_call))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(executions) == 1, f"Expected one execution, got {len(executions)}"
+    assert all(result == {'value': 42} for result, _ in results)
+    assert sum(1 for _, shared in results if shared) == 4
+    assert flight.stats() == {'executions': 1, 'coalesced': 4, 'in_flight': 0}
+    print("✅ SingleFlight coalesces concurrent calls")
+
+def test_endpoint_coalesces_and_caches():
+    """Test that identical concurrent prompts hit the upstream once, then the cache"""
+    import app
+
+    upstream_calls = []
+    def fake_call_with_retry(provider, send_request, timeout, policy=None, api_url=None):
+        upstream_calls.append(provider)
+        time.sleep(0.3)
+        return {'success': True, 'source': 'qwen', 'data': {'processed_image': 'https://cdn.example/art.png'}}
+
+    original = app.call_with_retry
+    app.call_with_retry = fake_call_with_retry
+    prompt = f"A lighthouse at dusk {uuid.uuid4()}"
+    statuses = []
+
+    def post():
+        client = app.app.test_client()
+        response = client.post('/api/ai-art', json={'prompt': prompt})
+        statuses.append(response.headers['X-Cache'])
+
+    try:
+        threads = [threading.Thread(target=post) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(upstream_calls) == 1, f"Expected one upstream call, got {len(upstream_calls)}"
+        assert sorted(statuses) == ['COALESCED'] * 3 + ['MISS'], statuses
+
+        response = app.app.test_client().post('/api/ai-art', json={'prompt': '  ' + prompt.upper()})
+        assert response.headers['X-Cache'] == 'HIT'
+        assert len(upstream_calls) == 1
+        print(f"✅ AI art requests coalesced and cached: {app.get_ai_art_cache_stats()}")
+    finally:
+        app.call_with_retry = original
+
+if __name__ == "__main__":
+    print("🧪 Testing AI art cache and coalescing...")
+    print("=" * 50)
+
+    tests = [
+        test_prompt_normalization,
+        test_single_flight_coalesces,
+        test_endpoint_coalesces_and_caches
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
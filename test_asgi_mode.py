@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Test script for the ASGI serving mode:
+1. Same routes and response shapes as the Flask app
+2. Upstream calls go through the shared non-blocking httpx client
+3. Chunked uploads without a Content-Length are cut off at the size limit
+4. Oversized streamed uploads are answered 413 without counting against the breaker
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+import httpx
+
+def mock_upstream(request):
+    """Stand-in for Pixelcut, Unwatermark and DashScope"""
+    if 'dashscope' in request.url.host:
+        return httpx.Response(200, json={'output': {'results': [{'url': 'https://cdn.example/art.png'}]}})
+    return httpx.Response(200, json={'output_url': f'https://cdn.example{request.url.path}.png'})
+
+def create_test_client():
+    """Create a Starlette test client with the upstream client mocked out"""
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    return TestClient(asgi_app.asgi_app)
+
+def test_asgi_routes():
+    """Test that the ASGI app exposes the same routes as app.py"""
+    from asgi_app import asgi_app
+    from app import app as flask_app
+
+    asgi_routes = {route.path for route in asgi_app.routes}
+    flask_routes = {
+        rule.rule.replace('<', '{').replace('>', '}')
+        for rule in flask_app.url_map.iter_rules()
+        if rule.rule.startswith('/api/') or rule.rule == '/'
+    }
+    missing = flask_routes - asgi_routes
+
+    assert not missing, f"Routes missing from ASGI mode: {missing}"
+    print("✅ ASGI mode exposes all Flask routes")
+
+def test_image_endpoints():
+    """Test that image endpoints return the Flask response shapes"""
+    client = create_test_client()
+    upload = {'image': ('photo.png', b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x02\x00\x00\x00\x02\x00' + b'\x00' * 64, 'image/png')}
+
+    response = client.post('/api/background-remove', files=upload)
+    assert response.status_code == 200
+    assert response.json() == {'success': True, 'processed_image': 'https://cdn.example/v1/background/remove.png', 'source': 'api'}
+
+    response = client.post('/api/upscale', files=upload)
+    assert response.json()['source'] == 'pixelcut'
+
+    response = client.post('/api/unblur')
+    assert response.status_code == 400
+    assert response.json() == {'success': False, 'error': 'No image file provided'}
+    print("✅ ASGI image endpoints match Flask response shapes")
+
+def test_ai_art_endpoint():
+    """Test that the AI art endpoint validates prompts and parses Qwen results"""
+    client = create_test_client()
+
+    response = client.post('/api/ai-art', json={'prompt': '   '})
+    assert response.status_code == 400
+
+    response = client.post('/api/ai-art', json={'prompt': 'A beautiful sunset over mountains'})
+    result = response.json()
+    assert result['success'] == True
+    assert result['source'] == 'qwen'
+    assert result['data']['processed_image'] == 'https://cdn.example/art.png'
+    print("✅ ASGI AI art endpoint works")
+
+def test_chunked_upload_limit():
+    """Test that a chunked upload is answered 413 once it passes the limit, without reading the rest"""
+    import asyncio
+    import json
+    import asgi_app
+    from app import MAX_FILE_SIZE
+
+    boundary = 'chunked-boundary'
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="photo.png"\r\n'
+        'Content-Type: image/png\r\n\r\n'
+    ).encode() + b'\x89PNG\r\n\x1a\n'
+    chunk = b'\x00' * (64 * 1024)
+    received = []
+
+    async def receive():
+        # No Content-Length and far more than the limit: 64 MB if read to the end
+        received.append(1)
+        if len(received) == 1:
+            return {'type': 'http.request', 'body': head, 'more_body': True}
+        return {'type': 'http.request', 'body': chunk, 'more_body': len(received) < 1025}
+
+    async def call():
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/api/upscale', 'raw_path': b'/api/upscale', 'query_string': b'', 'root_path': '',
+            'headers': [(b'content-type', f'multipart/form-data; boundary={boundary}'.encode()), (b'transfer-encoding', b'chunked')],
+            'client': ('10.2.2.2', 5000), 'server': ('testserver', 80)
+        }
+        await asgi_app.asgi_app(scope, receive, send)
+        return messages[0]['status'], json.loads(b''.join(message.get('body', b'') for message in messages[1:]))
+
+    status, body = asyncio.run(call())
+    assert status == 413 and 'exceeds' in body['error'], (status, body)
+    assert len(received) * len(chunk) <= MAX_FILE_SIZE + 2 * len(chunk), f"Read {len(received)} chunks"
+    print(f"✅ Chunked upload cut off with 413 after {len(received)} chunks")
+
+def test_streamed_upload_limit():
+    """Test that an oversized ?stream=1 upload gets a 413 and leaves the breaker window untouched"""
+    import app
+    import asgi_app
+
+    original_breaker = app.CIRCUIT_BREAKERS['pixelcut']
+    breaker = app.CircuitBreaker('pixelcut', failure_rate=0.5, min_calls=1, window_seconds=60, open_seconds=60)
+    app.CIRCUIT_BREAKERS['pixelcut'] = breaker
+    try:
+        client = create_test_client()
+        oversized = b'\x89PNG\r\n\x1a\n' + b'\x00' * app.MAX_FILE_SIZE
+        response = client.post('/api/upscale?stream=1', files={'image': ('photo.png', oversized, 'image/png')})
+        assert response.status_code == 413, (response.status_code, response.text)
+        assert 'exceeds' in response.json()['error']
+        snapshot = breaker.snapshot()
+        assert snapshot['state'] == 'closed' and snapshot['window_failures'] == 0, snapshot
+        print("✅ Oversized streamed upload answered 413 without a breaker failure")
+    finally:
+        app.CIRCUIT_BREAKERS['pixelcut'] = original_breaker
+
+if __name__ == "__main__":
+    print("🧪 Testing ASGI serving mode...")
+    print("=" * 50)
+
+    tests = [
+        test_asgi_routes,
+        test_image_endpoints,
+        test_ai_art_endpoint,
+        test_chunked_upload_limit,
+        test_streamed_upload_limit
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
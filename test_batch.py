@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Test script for the batch endpoint:
+1. Images and zip archives are expanded and validated per item
+2. Items fan out with bounded concurrency and stream back as NDJSON
+3. Each operation's line is sent as soon as it finishes, not once the whole image is done
+4. Archives with too many or too large members are rejected before anything is decompressed
+5. The ASGI mode serves the same batch format and caps chunked bodies at BATCH_MAX_REQUEST_SIZE
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import zipfile
+import threading
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+def make_zip(members, compression=zipfile.ZIP_STORED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+def read_ndjson(body):
+    return [json.loads(line) for line in body.decode('utf-8').splitlines() if line]
+
+def test_batch_streams_ndjson():
+    """Test fan-out, per-item results and the concurrency limit"""
+    import app
+
+    lock = threading.Lock()
+    in_flight = {'now': 0, 'peak': 0}
+    calls = []
+
+    def fake_request(api_url, files, headers, **kwargs):
+        with lock:
+            in_flight['now'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+        time.sleep(0.05)
+        with lock:
+            in_flight['now'] -= 1
+            calls.append((api_url, files['image'][0], kwargs.get('data')))
+        return {'success': True, 'processed_image': f"https://cdn.example/{files['image'][0]}", 'source': 'api'}
+
+    original_request, original_key = app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key']
+    original_concurrency = app.BATCH_CONCURRENCY
+    app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'], app.BATCH_CONCURRENCY = fake_request, 'test-key', 2
+    client = app.app.test_client()
+    try:
+        archive = make_zip({'zipped1.jpg': make_image(), 'folder/zipped2.jpg': make_image(), 'notes.txt': b'hello'})
+        response = client.post(
+            '/api/batch',
+            data={
+                'operations': 'unblur,upscale',
+                'images': [(io.BytesIO(make_image()), f'photo{i}.jpg', 'image/jpeg') for i in range(3)],
+                'archive': (archive, 'more.zip', 'application/zip')
+            },
+            content_type='multipart/form-data'
+        )
+        assert response.mimetype == 'application/x-ndjson'
+        lines = read_ndjson(response.data)
+        summary = lines.pop()
+        assert summary['done'] and summary['results'] == 12 and summary['failed'] == 2, summary
+
+        failures = [line for line in lines if not line['success']]
+        assert {line['filename'] for line in failures} == {'notes.txt'}
+        assert len(calls) == 10, "Five valid images x two operations"
+        assert any(data == {'scale': '2'} for _, _, data in calls), "Upscale keeps its scale parameter"
+        assert in_flight['peak'] <= 2, f"Concurrency limit exceeded: {in_flight}"
+        print(f"✅ Batch streamed {summary['results']} results, peak concurrency {in_flight['peak']}")
+
+        response = client.post(
+            '/api/batch',
+            data={'operations': 'unblur,teleport', 'images': (io.BytesIO(make_image()), 'a.jpg')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 400 and 'teleport' in response.get_json()['error']
+        print("✅ Unknown operations are rejected up front")
+    finally:
+        app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = original_request, original_key
+        app.BATCH_CONCURRENCY = original_concurrency
+
+def test_batch_lines_stream_per_operation():
+    """Test that a finished operation's line is sent while the image's next operation still runs"""
+    import app
+
+    released = threading.Event()
+
+    def fake_request(api_url, files, headers, **kwargs):
+        files['image'][1].read()
+        if api_url == app.PIXELCUT_UPSCALE_URL:
+            released.wait(3)
+        return {'success': True, 'processed_image': f'https://cdn.example/{len(api_url)}.png', 'source': 'api'}
+
+    original_request, original_key = app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key']
+    app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = fake_request, 'test-key'
+    try:
+        started = time.monotonic()
+        response = app.app.test_client().post(
+            '/api/batch',
+            data={'operations': 'unblur,upscale', 'images': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data',
+            buffered=False
+        )
+        body = iter(response.response)
+        first = json.loads(next(body))
+        elapsed = time.monotonic() - started
+        released.set()
+        assert first['operation'] == 'unblur' and first['success'], first
+        assert elapsed < 1.5, f"First line waited for the slow operation: {elapsed:.2f}s"
+        rest = read_ndjson(b''.join(body))
+        assert [line.get('operation') for line in rest] == ['upscale', None] and rest[-1]['results'] == 2, rest
+        print(f"✅ First operation streamed after {elapsed:.2f}s while the second was still running")
+    finally:
+        released.set()
+        app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = original_request, original_key
+
+def test_zip_limits_checked_before_extraction():
+    """Test that many-member and high-ratio archives are refused without decompressing a single member"""
+    import app
+
+    opened = []
+    original_open = zipfile.ZipFile.open
+
+    def counting_open(self, name, *args, **kwargs):
+        opened.append(name)
+        return original_open(self, name, *args, **kwargs)
+
+    # Each bomb member sits under MAX_FILE_SIZE but together they unpack past BATCH_MAX_REQUEST_SIZE
+    member_size = app.MAX_FILE_SIZE - 1024
+    count = app.BATCH_MAX_REQUEST_SIZE // member_size + 1
+    many = make_zip({f'photo{i}.jpg': make_image(16) for i in range(app.BATCH_MAX_ITEMS * 20)})
+    bomb = make_zip({f'zeros{i}.jpg': bytes(member_size) for i in range(count)}, zipfile.ZIP_DEFLATED)
+
+    zipfile.ZipFile.open = counting_open
+    client = app.app.test_client()
+    try:
+        response = client.post(
+            '/api/batch',
+            data={'operations': 'unblur', 'archive': (many, 'many.zip', 'application/zip')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 400 and 'exceeds' in response.get_json()['error'], response.get_json()
+
+        response = client.post(
+            '/api/batch',
+            data={'operations': 'unblur', 'archive': (bomb, 'bomb.zip', 'application/zip')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 400 and 'unpacks to more than' in response.get_json()['error'], response.get_json()
+        assert opened == [], f"Decompressed {len(opened)} members before rejecting"
+        print(f"✅ Refused {app.BATCH_MAX_ITEMS * 20}-member and {count}-member high-ratio archives without extracting")
+    finally:
+        zipfile.ZipFile.open = original_open
+
+def test_asgi_batch():
+    """Test the ASGI batch endpoint against a mocked upstream"""
+    import httpx
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    def mock_upstream(request):
+        return httpx.Response(200, json={'output_url': f'https://cdn.example{request.url.path}.png'})
+
+    original_key = app.PROVIDERS['pixelcut']['api_key']
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    try:
+        client = TestClient(asgi_app.asgi_app)
+        response = client.post(
+            '/api/batch',
+            data={'operations': '["background-remove"]'},
+            files=[('images', (f'photo{i}.jpg', make_image(), 'image/jpeg')) for i in range(3)]
+        )
+        lines = read_ndjson(response.content)
+        summary = lines.pop()
+        assert summary['results'] == 3 and summary['failed'] == 0, summary
+        assert sorted(line['index'] for line in lines) == [0, 1, 2]
+        assert all(line['processed_image'] == 'https://cdn.example/v1/background/remove.png' for line in lines)
+        print("✅ ASGI batch endpoint streams NDJSON")
+    finally:
+        app.PROVIDERS['pixelcut']['api_key'] = original_key
+        asgi_app._async_client = None
+
+def test_asgi_batch_chunked_limit():
+    """Test that a chunked ASGI batch body is answered 413 once it passes BATCH_MAX_REQUEST_SIZE, before parsing"""
+    import asyncio
+    import asgi_app
+
+    boundary = 'batch-boundary'
+    head = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="images"; filename="photo.jpg"\r\n'
+        'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + make_image()
+    chunk = b'\x00' * (64 * 1024)
+    limit = 1024 * 1024
+    received = []
+
+    async def receive():
+        # No Content-Length and 64 MB if read to the end
+        received.append(1)
+        if len(received) == 1:
+            return {'type': 'http.request', 'body': head, 'more_body': True}
+        return {'type': 'http.request', 'body': chunk, 'more_body': len(received) < 1025}
+
+    async def call():
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/api/batch', 'raw_path': b'/api/batch', 'query_string': b'', 'root_path': '',
+            'headers': [(b'content-type', f'multipart/form-data; boundary={boundary}'.encode()), (b'transfer-encoding', b'chunked')],
+            'client': ('10.3.3.3', 5000), 'server': ('testserver', 80)
+        }
+        await asgi_app.asgi_app(scope, receive, send)
+        return messages[0]['status'], json.loads(b''.join(message.get('body', b'') for message in messages[1:]))
+
+    original_limit = asgi_app.BATCH_MAX_REQUEST_SIZE
+    asgi_app.BATCH_MAX_REQUEST_SIZE = limit
+    try:
+        status, body = asyncio.run(call())
+    finally:
+        asgi_app.BATCH_MAX_REQUEST_SIZE = original_limit
+    assert status == 413 and 'size limit' in body['error'], (status, body)
+    assert len(received) * len(chunk) <= limit + 2 * len(chunk), f"Read {len(received)} chunks"
+    print(f"✅ Chunked batch body cut off with 413 after {len(received)} chunks")
+
+if __name__ == "__main__":
+    print("🧪 Testing batch endpoint...")
+    print("=" * 50)
+
+    tests = [
+        test_batch_streams_ndjson,
+        test_batch_lines_stream_per_operation,
+        test_zip_limits_checked_before_extraction,
+        test_asgi_batch,
+        test_asgi_batch_chunked_limit
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test script for the benchmark suite:
+1. Mock upstreams answer with the configured errors, 429s and response kinds
+2. Runs are stored and regressions against the previous comparable run are reported
+3. A short end-to-end run drives the ASGI app against the mocks
+"""
+
+import sys
+import os
+import json
+import tempfile
+sys.path.insert(0, os.path.dirname(__file__))
+
+import requests
+
+def test_mock_upstream_profiles():
+    """Test error, throttle and binary profiles per provider"""
+    from benchmark import MockUpstreams
+
+    upstreams = MockUpstreams({
+        'pixelcut': {'latency': 0, 'error_rate': 1.0},
+        'unwatermark': {'latency': 0, 'throttle_rate': 1.0, 'retry_after': 3},
+        'qwen': {'latency': 0, 'response': 'binary'}
+    }).start()
+    try:
+        assert requests.post(upstreams.provider_url('pixelcut') + '/v1/upscale', data=b'x').status_code == 500
+        throttled = requests.post(upstreams.provider_url('unwatermark') + '/v1/remove', data=b'x')
+        assert throttled.status_code == 429 and throttled.headers['Retry-After'] == '3'
+        qwen = requests.post(upstreams.provider_url('qwen') + '/api/v1/services/aigc/text2image/generation', json={})
+        assert 'image' in qwen.json()['output']['results'][0], qwen.json()
+
+        upstreams.profiles['pixelcut'].update(error_rate=0.0, response='binary')
+        binary = requests.post(upstreams.provider_url('pixelcut') + '/v1/upscale', data=b'x')
+        assert binary.headers['Content-Type'] == 'image/png' and binary.content.startswith(b'\x89PNG')
+        assert upstreams.snapshot() == {'pixelcut:error': 1, 'pixelcut:ok': 1, 'qwen:ok': 1, 'unwatermark:throttled': 1}
+        print(f"✅ Mock upstream outcomes: {upstreams.snapshot()}")
+    finally:
+        upstreams.stop()
+
+def test_regressions_between_runs():
+    """Test that only comparable runs are compared and slowdowns are reported"""
+    from benchmark import record_run, percentile
+
+    assert percentile([5, 1, 4, 2, 3], 0.5) == 3 and percentile([], 0.99) is None
+    record = lambda rps, p95, scenario='baseline': {
+        'time': 'now', 'commit': 'abc1234', 'config': {'scenario': scenario},
+        'results': {'throughput_rps': rps, 'p50_ms': 10, 'p95_ms': p95, 'p99_ms': 50,
+                    'retry_amplification': 1.0, 'worker_rss_mb': [60]}
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        results_file = os.path.join(directory, 'results.jsonl')
+        assert record_run(record(100, 20), results_file) == (None, [])
+        assert record_run(record(10, 200, 'slow'), results_file) == (None, []), "Different configurations are not compared"
+        previous, regressions = record_run(record(95, 22), results_file)
+        assert previous['results']['throughput_rps'] == 100 and regressions == []
+        _, regressions = record_run(record(50, 40), results_file)
+        assert regressions == ['throughput 95 -> 50 req/s', 'p95_ms 22 -> 40'], regressions
+        with open(results_file) as results:
+            assert len(results.readlines()) == 4
+    print(f"✅ Regressions reported: {regressions}")
+
+def test_end_to_end_run():
+    """Test a short run of the ASGI app against healthy mocks"""
+    from benchmark import run_benchmark
+
+    record = run_benchmark(
+        'baseline', server='asgi', requests_total=20, concurrency=4, workers=1, warmup=2,
+        profiles={'pixelcut': {'latency': 0.01, 'jitter': 0}}, seed=1
+    )
+    results = record['results']
+    assert results['requests'] == 20 and results['statuses'] == {'200': 20}, results
+    assert results['fallbacks'] == 0 and results['retry_amplification'] == 1.0, results
+    assert results['p50_ms'] <= results['p95_ms'] <= results['p99_ms']
+    if os.path.isdir('/proc'):
+        assert len(results['worker_rss_mb']) == 1 and results['worker_rss_mb'][0] > 0
+    json.dumps(record)
+    print(f"✅ End-to-end run: {results['throughput_rps']} req/s, p95 {results['p95_ms']}ms")
+
+if __name__ == "__main__":
+    print("🧪 Testing benchmark suite...")
+    print("=" * 50)
+
+    tests = [
+        test_mock_upstream_profiles,
+        test_regressions_between_runs,
+        test_end_to_end_run
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
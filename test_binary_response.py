@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test script for binary passthrough response modes:
+1. Binary upstream results stay raw until a response mode is chosen
+2. ?response=binary / Accept: image/* stream the bytes back
+3. ?response=url stores the bytes and returns a short URL
+4. Only well-formed result ids reach the result store
+"""
+
+import sys
+import os
+import io
+import tempfile
+sys.path.insert(0, os.path.dirname(__file__))
+
+IMAGE_BYTES = b'\x89PNG\r\n\x1a\n' + os.urandom(4096)
+
+class FakeImageResponse:
+    status_code = 200
+    headers = {'content-type': 'image/png'}
+    content = IMAGE_BYTES
+
+    def json(self):
+        raise AssertionError("Binary responses must not be JSON-decoded")
+
+def test_parse_keeps_bytes_raw():
+    """Test that binary upstream responses are not base64-encoded when parsed"""
+    from app import parse_image_api_response
+
+    result = parse_image_api_response(FakeImageResponse())
+    assert result['image_bytes'] is IMAGE_BYTES
+    assert result['content_type'] == 'image/png'
+    assert 'image_data' not in result
+    print("✅ Binary upstream results stay raw")
+
+def test_response_mode_selection():
+    """Test ?response= and Accept header handling"""
+    from app import get_response_mode
+
+    assert get_response_mode(None, 'application/json') == 'json'
+    assert get_response_mode(None, 'image/webp,image/*;q=0.8') == 'binary'
+    assert get_response_mode('url', 'image/png') == 'url'
+    assert get_response_mode('bogus', None) == 'json'
+    print("✅ Response mode selection works")
+
+def test_endpoint_response_modes():
+    """Test JSON, binary and stored-URL responses from an image endpoint"""
+    import app
+
+    original = app.make_image_api_request
+    app.make_image_api_request = lambda *args, **kwargs: app.parse_image_api_response(FakeImageResponse())
+    client = app.app.test_client()
+
+    def upload(query='', headers=None):
+        image = b'\xff\xd8\xff\xc0\x00\x11\x08\x02\x00\x02\x00' + os.urandom(512)
+        return client.post(
+            f'/api/unblur{query}',
+            data={'image': (io.BytesIO(image), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data',
+            headers=headers or {}
+        )
+
+    try:
+        response = upload()
+        assert response.get_json()['image_data'].startswith('data:image/png;base64,')
+
+        response = upload('?response=binary')
+        assert response.mimetype == 'image/png' and response.data == IMAGE_BYTES
+
+        response = upload(headers={'Accept': 'image/png'})
+        assert response.data == IMAGE_BYTES
+
+        response = upload('?response=url')
+        result = response.get_json()
+        assert 'image_data' not in result
+        stored = client.get(result['processed_image'].replace('http://localhost', ''))
+        assert stored.status_code == 200 and stored.data == IMAGE_BYTES
+        assert client.get('/api/results/doesnotexist').status_code == 404
+        print("✅ Endpoints serve json, binary and stored-url responses")
+    finally:
+        app.make_image_api_request = original
+
+def test_binary_results_survive_disk_tier():
+    """Test that bytes round-trip through the on-disk cache tier"""
+    from app import ResultCache
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        ResultCache(disk_dir=cache_dir).set('k', {'image_bytes': IMAGE_BYTES, 'content_type': 'image/png'})
+        value = ResultCache(disk_dir=cache_dir).get('k')
+    assert value == {'image_bytes': IMAGE_BYTES, 'content_type': 'image/png'}
+    print("✅ Binary results survive the on-disk tier")
+
+def test_result_id_validation():
+    """Test that malformed result ids are answered 404 without touching the result store"""
+    import app
+
+    class SpyStore:
+        def __init__(self):
+            self.keys = []
+        def get(self, key):
+            self.keys.append(key)
+            return {'image_bytes': IMAGE_BYTES, 'content_type': 'image/png'}
+
+    original = app.result_store
+    app.result_store = spy = SpyStore()
+    try:
+        client = app.app.test_client()
+        for result_id in ('..', 'a' * 31, 'a' * 33, 'A' * 32, 'g' * 32, '0' * 31 + '.'):
+            assert client.get(f'/api/results/{result_id}').status_code == 404, result_id
+        assert spy.keys == []
+        assert client.get(f'/api/results/{"0a" * 16}').status_code == 200
+        assert spy.keys == ['0a' * 16]
+        assert original.disk_max_entries == app.RESULT_STORE_DISK_MAX_ENTRIES
+        assert original.disk_max_bytes == app.RESULT_STORE_DISK_MAX_BYTES
+        print("✅ Malformed result ids never reach the result store")
+    finally:
+        app.result_store = original
+
+if __name__ == "__main__":
+    print("🧪 Testing binary response modes...")
+    print("=" * 50)
+
+    tests = [
+        test_parse_keeps_bytes_raw,
+        test_response_mode_selection,
+        test_endpoint_response_modes,
+        test_binary_results_survive_disk_tier,
+        test_result_id_validation
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Test script for per-upstream bulkheads:
+1. A bulkhead caps concurrency, rejects at once when its queue is full and times out queued callers
+2. A saturated upstream does not hold up calls to other upstreams
+3. Turned-away calls get the dummy response, or a 503 with Retry-After in reject mode
+"""
+
+import sys
+import os
+import io
+import time
+import asyncio
+import threading
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+def test_bulkhead_limits():
+    """Test the concurrency cap, fast rejection and queue timeout"""
+    from app import Bulkhead, BulkheadFull
+
+    bulkhead = Bulkhead('limits-test', max_concurrent=2, max_queue=1, queue_timeout=0.2)
+    bulkhead.acquire()
+    bulkhead.acquire()
+    assert bulkhead.snapshot()['in_flight'] == 2
+
+    outcome = {}
+
+    def queued_caller():
+        try:
+            bulkhead.acquire()
+            outcome['acquired'] = True
+        except BulkheadFull:
+            outcome['acquired'] = False
+
+    waiter = threading.Thread(target=queued_caller)
+    waiter.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    try:
+        bulkhead.acquire()
+        raise AssertionError("Expected a full queue to reject")
+    except BulkheadFull as e:
+        assert e.provider == 'limits-test'
+    assert time.monotonic() - started < 0.05, "A full queue rejects without waiting"
+    waiter.join()
+    assert outcome['acquired'] is False and bulkhead.snapshot()['timed_out'] == 1
+
+    bulkhead.release()
+    bulkhead.acquire()
+    snapshot = bulkhead.snapshot()
+    assert snapshot['in_flight'] == 2 and snapshot['rejected'] == 1 and snapshot['queued'] == 0
+    print(f"✅ Bulkhead limits enforced: {snapshot}")
+
+def test_saturated_upstream_is_isolated():
+    """Test that a stuck qwen bulkhead neither blocks pixelcut nor opens qwen's circuit"""
+    import app
+
+    original_key, original_request = app.PROVIDERS['pixelcut']['api_key'], app.make_image_api_request
+    original_bulkhead = app.BULKHEADS['qwen']
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    app.make_image_api_request = lambda *args, **kwargs: {
+        'success': True, 'processed_image': 'https://cdn.example/out.png', 'source': 'api'
+    }
+    app.BULKHEADS['qwen'] = app.Bulkhead('qwen', max_concurrent=1, max_queue=0, queue_timeout=0.1)
+    app.BULKHEADS['qwen'].acquire()
+    try:
+        before = app.CIRCUIT_BREAKERS['qwen'].snapshot()['window_failures']
+        result = app.make_api_request_with_fallback(lambda: app.call_with_retry('qwen', lambda t: None, 30), 'ai-art')
+        assert result['source'] == 'dummy' and 'at capacity' in result['error'], result
+        assert app.CIRCUIT_BREAKERS['qwen'].snapshot()['window_failures'] == before
+
+        started = time.monotonic()
+        response = app.app.test_client().post(
+            '/api/unblur',
+            data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert response.get_json()['source'] == 'api', response.get_json()
+        assert time.monotonic() - started < 1
+        print("✅ Saturated qwen falls back while pixelcut keeps serving")
+    finally:
+        app.BULKHEADS['qwen'] = original_bulkhead
+        app.PROVIDERS['pixelcut']['api_key'], app.make_image_api_request = original_key, original_request
+
+def test_reject_mode():
+    """Test the 503 with Retry-After from both apps when BULKHEAD_ON_FULL is 'reject'"""
+    import httpx
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    original_key, original_mode = app.PROVIDERS['pixelcut']['api_key'], app.BULKHEAD_ON_FULL
+    original_bulkhead = app.BULKHEADS['pixelcut']
+    app.PROVIDERS['pixelcut']['api_key'], app.BULKHEAD_ON_FULL = 'test-key', 'reject'
+    app.BULKHEADS['pixelcut'] = app.Bulkhead('pixelcut', max_concurrent=0, max_queue=0)
+    asgi_app._async_bulkheads['pixelcut'] = asgi_app.AsyncBulkhead('pixelcut', max_concurrent=0, max_queue=0, queue_timeout=0.1)
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, json={'output_url': 'https://cdn.example/out.png'})
+    ))
+    try:
+        response = app.app.test_client().post(
+            '/api/unblur',
+            data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 503 and response.headers['Retry-After'] == '2', response.data
+        assert 'at capacity' in response.get_json()['error']
+
+        response = TestClient(asgi_app.asgi_app).post(
+            '/api/unblur', files={'image': ('photo.jpg', make_image(), 'image/jpeg')}
+        )
+        assert response.status_code == 503 and response.headers['retry-after'] == '2', response.text
+
+        app.BULKHEAD_ON_FULL = 'dummy'
+        response = TestClient(asgi_app.asgi_app).post(
+            '/api/unblur', files={'image': ('photo.jpg', make_image(), 'image/jpeg')}
+        )
+        assert response.json()['source'] == 'dummy', response.json()
+        assert asgi_app._async_bulkheads['pixelcut'].snapshot()['rejected'] == 2
+        print("✅ Reject mode answers 503 with Retry-After; dummy mode falls back")
+    finally:
+        app.PROVIDERS['pixelcut']['api_key'], app.BULKHEAD_ON_FULL = original_key, original_mode
+        app.BULKHEADS['pixelcut'] = original_bulkhead
+        asgi_app._async_bulkheads.pop('pixelcut', None)
+        asgi_app._async_client = None
+
+def test_async_bulkhead_handoff():
+    """Test that the async bulkhead queues callers and hands freed slots over in order"""
+    from asgi_app import AsyncBulkhead
+    from app import BulkheadFull
+
+    async def scenario():
+        bulkhead = AsyncBulkhead('async-test', max_concurrent=1, max_queue=2, queue_timeout=0.5)
+        order = []
+
+        async def call(name, hold):
+            async with bulkhead:
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        tasks = [asyncio.create_task(call(name, 0.05)) for name in ('a', 'b', 'c')]
+        await asyncio.sleep(0.01)
+        try:
+            await call('d', 0)
+            raise AssertionError("Expected a full queue to reject")
+        except BulkheadFull:
+            pass
+        await asyncio.gather(*tasks)
+        return order, bulkhead.snapshot()
+
+    order, snapshot = asyncio.run(scenario())
+    assert order == ['a', 'b', 'c'], order
+    assert snapshot['in_flight'] == 0 and snapshot['queued'] == 0 and snapshot['rejected'] == 1, snapshot
+    print(f"✅ Async bulkhead served {order} in order and rejected the overflow")
+
+if __name__ == "__main__":
+    print("🧪 Testing per-upstream bulkheads...")
+    print("=" * 50)
+
+    tests = [
+        test_bulkhead_limits,
+        test_saturated_upstream_is_isolated,
+        test_reject_mode,
+        test_async_bulkhead_handoff
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
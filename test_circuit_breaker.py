@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-upstream circuit breakers:
+1. Circuit opens once the failure rate crosses the threshold
+2. Open circuits short-circuit straight to dummy responses
+3. Half-open recovery probe closes the circuit again
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+def test_breaker_state_machine():
+    """Test closed -> open -> half-open -> closed transitions"""
+    from app import CircuitBreaker
+
+    breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=4, window_seconds=60, open_seconds=0.2)
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED, "Should stay closed below min_calls"
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN, "3/4 failures should open the circuit"
+    assert not breaker.allow_request()
+
+    time.sleep(0.25)
+    assert breaker.allow_request(), "Cool-down elapsed, one probe should be allowed"
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request(), "Only one probe at a time while half-open"
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    print("✅ Circuit breaker state machine works")
+
+def test_failed_probe_reopens():
+    """Test that a failed recovery probe re-opens the circuit"""
+    from app import CircuitBreaker
+
+    breaker = CircuitBreaker('test-probe', failure_rate=0.5, min_calls=1, window_seconds=60, open_seconds=0.1)
+    breaker.record_failure()
+    time.sleep(0.15)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    print("✅ Failed probe re-opens the circuit")
+
+def test_open_circuit_returns_dummy_fast():
+    """Test that make_api_request_with_fallback() skips the upstream while open"""
+    import app
+    from app import CircuitBreaker, make_api_request_with_fallback
+
+    original = app.CIRCUIT_BREAKERS['qwen']
+    app.CIRCUIT_BREAKERS['qwen'] = CircuitBreaker('qwen', failure_rate=0.5, min_calls=2, window_seconds=60, open_seconds=60)
+    calls = []
+
+    def _failing_request():
+        calls.append(1)
+        raise Exception("Qwen API error: HTTP 503")
+
+    try:
+        for _ in range(2):
+            make_api_request_with_fallback(_failing_request, 'ai-art')
+        assert app.CIRCUIT_BREAKERS['qwen'].state == CircuitBreaker.OPEN
+
+        started = time.perf_counter()
+        response = make_api_request_with_fallback(_failing_request, 'ai-art')
+        elapsed = time.perf_counter() - started
+
+        assert len(calls) == 2, "Open circuit must not call the upstream"
+        assert response['source'] == 'dummy'
+        assert 'circuit open' in response['error']
+        assert elapsed < 0.01, f"Short-circuit took {elapsed * 1000:.2f}ms"
+        print(f"✅ Open circuit served dummy in {elapsed * 1e6:.0f}µs")
+    finally:
+        app.CIRCUIT_BREAKERS['qwen'] = original
+
+if __name__ == "__main__":
+    print("🧪 Testing circuit breakers...")
+    print("=" * 50)
+
+    tests = [
+        test_breaker_state_machine,
+        test_failed_probe_reopens,
+        test_open_circuit_returns_dummy_fast
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
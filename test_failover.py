@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Test script for multi-provider failover and hedged requests:
+1. Providers are ordered by priority, then weight
+2. A failing provider fails over to the next one
+3. A call slower than the provider's p95 is hedged and the faster provider wins
+4. All providers of one operation share a single retry budget
+5. AI art goes through the same failover engine as the image operations
+"""
+
+import sys
+import os
+import io
+import time
+import asyncio
+sys.path.insert(0, os.path.dirname(__file__))
+
+BACKUP_URL = 'https://backup.example/v1/enhance'
+
+from test_helpers import make_image
+
+def add_backup_provider(app, hedge=False):
+    """Register a 'backup' provider as an alternate for unblur; returns an undo function"""
+    app.PROVIDERS['backup'] = {'api_key': 'backup-key', 'auth_header': 'X-Api-Key', 'auth_prefix': ''}
+    app.CIRCUIT_BREAKERS['backup'] = app.CircuitBreaker('backup')
+    # Failures recorded here must not trip the shared pixelcut circuit for other tests
+    original_breaker = app.CIRCUIT_BREAKERS['pixelcut']
+    app.CIRCUIT_BREAKERS['pixelcut'] = app.CircuitBreaker('pixelcut')
+    original_key, original_spec = app.PROVIDERS['pixelcut']['api_key'], app.OPERATIONS['unblur']
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    spec = {**original_spec, 'hedge': hedge, 'alternates': [{'provider': 'backup', 'url': BACKUP_URL, 'timeout': 30}]}
+    app.OPERATIONS['unblur'] = app.IMAGE_OPERATIONS['unblur'] = spec
+
+    def undo():
+        app.OPERATIONS['unblur'] = app.IMAGE_OPERATIONS['unblur'] = original_spec
+        app.PROVIDERS['pixelcut']['api_key'] = original_key
+        app.CIRCUIT_BREAKERS['pixelcut'] = original_breaker
+        del app.PROVIDERS['backup'], app.CIRCUIT_BREAKERS['backup']
+        app._latency_histograms.clear()
+    return undo
+
+def post_unblur(app):
+    return app.app.test_client().post(
+        '/api/unblur',
+        data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+        content_type='multipart/form-data'
+    ).get_json()
+
+def test_target_order():
+    """Test priority ordering and weighted selection within a priority"""
+    from app import operation_targets
+
+    spec = {'provider': 'a', 'url': 'https://a', 'alternates': [
+        {'provider': 'b', 'priority': 2},
+        {'provider': 'c', 'weight': 9},
+        {'provider': 'd', 'weight': 1}
+    ]}
+    orders = [[target['provider'] for target in operation_targets(spec)] for _ in range(500)]
+    assert all(order[0] == 'a' and order[3] == 'b' for order in orders)
+    c_first = sum(order[1] == 'c' for order in orders)
+    assert 400 < c_first < 495, f"Weight 9 vs 1 should win about 90%: {c_first}/500"
+    assert all('alternates' not in target for target in operation_targets(spec))
+    print(f"✅ Priority respected, weighted pick chose c first {c_first}/500 times")
+
+def test_failover_on_error():
+    """Test that an upstream error moves on to the alternate provider"""
+    import app
+
+    calls = []
+
+    def fake_request(api_url, files, headers, **kwargs):
+        calls.append((kwargs['provider'], headers, files['image'][1].read()))
+        if kwargs['provider'] == 'pixelcut':
+            raise Exception('pixelcut down')
+        return {'success': True, 'processed_image': 'https://backup.example/out.png', 'source': 'api'}
+
+    undo = add_backup_provider(app)
+    original_request = app.make_image_api_request
+    app.make_image_api_request = fake_request
+    try:
+        before = app.get_failover_stats()['operations'].get('unblur', {}).get('failovers', 0)
+        result = post_unblur(app)
+        assert result['processed_image'] == 'https://backup.example/out.png', result
+        assert [provider for provider, _, _ in calls] == ['pixelcut', 'backup']
+        assert calls[1][1]['X-Api-Key'] == 'backup-key'
+        assert calls[0][2] == calls[1][2], "Both providers receive the full upload"
+        assert app.get_failover_stats()['operations']['unblur']['failovers'] == before + 1
+
+        app.make_image_api_request = lambda *args, **kwargs: (_ for _ in ()).throw(Exception('everything down'))
+        assert post_unblur(app)['source'] == 'dummy', "Dummy response only once every provider failed"
+        print("✅ Failed provider fails over to the alternate")
+    finally:
+        app.make_image_api_request = original_request
+        undo()
+
+def test_hedged_request():
+    """Test that a primary slower than its p95 is raced against the alternate"""
+    import app
+
+    def fake_request(api_url, files, headers, **kwargs):
+        files['image'][1].read()
+        if kwargs['provider'] == 'pixelcut':
+            time.sleep(1.0)
+            return {'success': True, 'processed_image': 'https://pixelcut.example/out.png', 'source': 'api'}
+        return {'success': True, 'processed_image': 'https://backup.example/out.png', 'source': 'api'}
+
+    undo = add_backup_provider(app, hedge=True)
+    original_request, original_min_delay = app.make_image_api_request, app.HEDGE_MIN_DELAY_SECONDS
+    app.make_image_api_request, app.HEDGE_MIN_DELAY_SECONDS = fake_request, 0.05
+    try:
+        for _ in range(app.HEDGE_MIN_SAMPLES):
+            app.record_provider_latency('pixelcut', 0.1)
+        assert 0.1 <= app.get_hedge_delay('pixelcut') < 0.15, "p95 falls in the 0.1s histogram bucket"
+
+        started = time.monotonic()
+        result = post_unblur(app)
+        elapsed = time.monotonic() - started
+        assert result['processed_image'] == 'https://backup.example/out.png', result
+        assert elapsed < 0.8, f"Hedge should answer before the slow primary: {elapsed:.2f}s"
+        stats = app.get_failover_stats()['operations']['unblur']
+        assert stats['hedges'] >= 1 and stats['hedge_wins'] >= 1
+        print(f"✅ Hedged request answered in {elapsed:.2f}s instead of 1s")
+    finally:
+        app.make_image_api_request, app.HEDGE_MIN_DELAY_SECONDS = original_request, original_min_delay
+        undo()
+
+def test_asgi_hedged_request():
+    """Test hedging and failover in the ASGI app against a mocked upstream"""
+    import httpx
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    async def mock_upstream(request):
+        if request.url.host == 'api.pixelcut.ai':
+            await asyncio.sleep(1.0)
+            return httpx.Response(200, json={'output_url': 'https://pixelcut.example/out.png'})
+        assert request.headers['x-api-key'] == 'backup-key'
+        return httpx.Response(200, json={'output_url': 'https://backup.example/out.png'})
+
+    undo = add_backup_provider(app, hedge=True)
+    original_min_delay = app.HEDGE_MIN_DELAY_SECONDS
+    app.HEDGE_MIN_DELAY_SECONDS = 0.05
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    try:
+        for _ in range(app.HEDGE_MIN_SAMPLES):
+            app.record_provider_latency('pixelcut', 0.1)
+        started = time.monotonic()
+        response = TestClient(asgi_app.asgi_app).post(
+            '/api/unblur', files={'image': ('photo.jpg', make_image(), 'image/jpeg')}
+        )
+        elapsed = time.monotonic() - started
+        assert response.json()['processed_image'] == 'https://backup.example/out.png', response.json()
+        assert elapsed < 0.8, f"Hedge should answer before the slow primary: {elapsed:.2f}s"
+        print(f"✅ ASGI hedged request answered in {elapsed:.2f}s")
+    finally:
+        app.HEDGE_MIN_DELAY_SECONDS = original_min_delay
+        asgi_app._async_client = None
+        undo()
+
+def half_open_pixelcut(app):
+    """Swap in a pixelcut breaker that has just gone half-open"""
+    breaker = app.CircuitBreaker('pixelcut', failure_rate=0.5, min_calls=1, window_seconds=60, open_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.1)
+    app.CIRCUIT_BREAKERS['pixelcut'] = breaker
+    return breaker
+
+def test_losing_hedge_releases_probe():
+    """Test that a hedge loser holding the half-open probe frees it, in both apps"""
+    import httpx
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    def fake_request(api_url, files, headers, **kwargs):
+        files['image'][1].read()
+        if kwargs['provider'] == 'pixelcut':
+            time.sleep(0.5)
+            raise Exception('pixelcut failed after losing the race')
+        return {'success': True, 'processed_image': 'https://backup.example/out.png', 'source': 'api'}
+
+    async def mock_upstream(request):
+        if request.url.host == 'api.pixelcut.ai':
+            await asyncio.sleep(1.0)
+        return httpx.Response(200, json={'output_url': 'https://backup.example/out.png'})
+
+    undo = add_backup_provider(app, hedge=True)
+    original_request, original_min_delay = app.make_image_api_request, app.HEDGE_MIN_DELAY_SECONDS
+    app.make_image_api_request, app.HEDGE_MIN_DELAY_SECONDS = fake_request, 0.05
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    try:
+        for _ in range(app.HEDGE_MIN_SAMPLES):
+            app.record_provider_latency('pixelcut', 0.1)
+
+        breaker = half_open_pixelcut(app)
+        assert post_unblur(app)['processed_image'] == 'https://backup.example/out.png'
+        time.sleep(0.6)
+        assert breaker.allow_request(), "Abandoned loser freed the probe"
+
+        breaker = half_open_pixelcut(app)
+        response = TestClient(asgi_app.asgi_app).post(
+            '/api/unblur', files={'image': ('photo.jpg', make_image(), 'image/jpeg')}
+        )
+        assert response.json()['processed_image'] == 'https://backup.example/out.png', response.json()
+        assert breaker.allow_request(), "Cancelled loser freed the probe"
+        print("✅ Losing hedges release the half-open probe")
+    finally:
+        app.make_image_api_request, app.HEDGE_MIN_DELAY_SECONDS = original_request, original_min_delay
+        asgi_app._async_client = None
+        undo()
+
+def test_failover_shares_retry_budget():
+    """Test that failing over doesn't restart the retry budget when every provider fails"""
+    import app
+    import requests
+
+    attempts = []
+
+    class FailingSession:
+        def post(self, url, data=None, headers=None, timeout=None):
+            attempts.append(url)
+            raise requests.exceptions.ConnectionError('connection refused')
+
+    undo = add_backup_provider(app)
+    policy = app.DEFAULT_RETRY_POLICY
+    original_session, original_policy = app.get_upstream_session, (policy.max_attempts, policy.base_delay)
+    app.get_upstream_session = lambda url: FailingSession()
+    policy.max_attempts, policy.base_delay = 3, 0.01
+    try:
+        result = post_unblur(app)
+        assert result['source'] == 'dummy', result
+        # Pixelcut spends the three attempts; the backup still gets the one attempt failover needs
+        assert len(attempts) == 4, f"{len(attempts)} upstream attempts: {attempts}"
+        assert attempts[-1] == BACKUP_URL
+        print(f"✅ Two failing providers made {len(attempts)} attempts under one budget of {policy.max_attempts}")
+    finally:
+        policy.max_attempts, policy.base_delay = original_policy
+        app.get_upstream_session = original_session
+        undo()
+
+def test_ai_art_failover():
+    """Test that /api/ai-art fails over to an alternate provider in both apps"""
+    import httpx
+    import requests
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    art_url = 'https://backup.example/v1/art'
+    art = {'output': {'results': [{'url': 'https://backup.example/art.png'}]}}
+
+    class FakeResponse:
+        status_code = 200
+        headers = {'content-type': 'application/json'}
+        def json(self):
+            return art
+
+    class FakeSession:
+        def post(self, url, headers=None, json=None, timeout=None):
+            calls.append((url, json['input']['prompt']))
+            if url == art_url:
+                return FakeResponse()
+            raise requests.exceptions.ConnectionError('qwen down')
+
+    def mock_upstream(request):
+        calls.append((str(request.url), None))
+        if str(request.url) == art_url:
+            return httpx.Response(200, json=art)
+        return httpx.Response(500, text='qwen down')
+
+    calls = []
+    app.PROVIDERS['backup'] = {'api_key': 'backup-key', 'auth_header': 'X-Api-Key', 'auth_prefix': ''}
+    app.CIRCUIT_BREAKERS['backup'] = app.CircuitBreaker('backup')
+    original_breaker, original_spec = app.CIRCUIT_BREAKERS['qwen'], app.OPERATIONS['ai-art']
+    app.CIRCUIT_BREAKERS['qwen'] = app.CircuitBreaker('qwen')
+    app.OPERATIONS['ai-art'] = {**original_spec, 'hedge': False, 'alternates': [{'provider': 'backup', 'url': art_url}]}
+    original_session, original_policy = app.get_upstream_session, app.DEFAULT_RETRY_POLICY.base_delay
+    app.get_upstream_session = lambda url: FakeSession()
+    app.DEFAULT_RETRY_POLICY.base_delay = 0.01
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    try:
+        result = app.app.test_client().post('/api/ai-art', json={'prompt': 'a failover lighthouse'}).get_json()
+        assert result['success'] and result['data']['processed_image'] == 'https://backup.example/art.png', result
+        assert calls[0][0] == app.QWEN_TEXT2IMAGE_URL and calls[-1] == (art_url, 'a failover lighthouse')
+        assert app.CIRCUIT_BREAKERS['qwen'].snapshot()['window_failures'] == 1
+
+        calls.clear()
+        result = TestClient(asgi_app.asgi_app).post('/api/ai-art', json={'prompt': 'an asgi failover lighthouse'}).json()
+        assert result['success'] and result['data']['processed_image'] == 'https://backup.example/art.png', result
+        assert calls[0][0] == app.QWEN_TEXT2IMAGE_URL and calls[-1][0] == art_url
+        print("✅ AI art failed over to the alternate provider in both apps")
+    finally:
+        app.OPERATIONS['ai-art'], app.CIRCUIT_BREAKERS['qwen'] = original_spec, original_breaker
+        app.get_upstream_session, app.DEFAULT_RETRY_POLICY.base_delay = original_session, original_policy
+        asgi_app._async_client = None
+        del app.PROVIDERS['backup'], app.CIRCUIT_BREAKERS['backup']
+
+if __name__ == "__main__":
+    print("🧪 Testing provider failover and hedging...")
+    print("=" * 50)
+
+    tests = [
+        test_target_order,
+        test_failover_on_error,
+        test_hedged_request,
+        test_asgi_hedged_request,
+        test_losing_hedge_releases_probe,
+        test_failover_shares_retry_budget,
+        test_ai_art_failover
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Test script for upstream fault injection:
+1. Fault plans are deterministic: steps in call order, then a seeded mix
+2. Sync calls see resets, status codes, partial bodies, slow bodies and malformed JSON
+3. The async client applies the same plans through its transport
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    calls = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        _UpstreamHandler.calls += 1
+        body = b'{"output_url": "https://cdn.example/out.png"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def local_unblur(app, timeout=0.5):
+    """Point unblur at a local upstream with a short read timeout; returns an undo function"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_spec, original_key = app.OPERATIONS['unblur'], app.PROVIDERS['pixelcut']['api_key']
+    original_breaker, original_limit = app.CIRCUIT_BREAKERS['pixelcut'], app.INBOUND_RATE_LIMIT
+    policy = app.DEFAULT_RETRY_POLICY
+    original_delays = policy.base_delay, policy.max_delay
+    spec = {**original_spec, 'url': f'http://127.0.0.1:{server.server_port}/v1/enhance', 'timeout': timeout}
+    app.OPERATIONS['unblur'] = app.IMAGE_OPERATIONS['unblur'] = spec
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    app.CIRCUIT_BREAKERS['pixelcut'] = app.CircuitBreaker('pixelcut')
+    app.INBOUND_RATE_LIMIT = 0
+    policy.base_delay, policy.max_delay = 0.01, 0.01
+    _UpstreamHandler.calls = 0
+
+    def undo():
+        app.OPERATIONS['unblur'] = app.IMAGE_OPERATIONS['unblur'] = original_spec
+        app.PROVIDERS['pixelcut']['api_key'] = original_key
+        app.CIRCUIT_BREAKERS['pixelcut'], app.INBOUND_RATE_LIMIT = original_breaker, original_limit
+        policy.base_delay, policy.max_delay = original_delays
+        server.shutdown()
+    return undo
+
+def post_unblur(client):
+    started = time.monotonic()
+    result = client.post(
+        '/api/unblur',
+        data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+        content_type='multipart/form-data'
+    ).get_json()
+    return result, time.monotonic() - started
+
+def test_plans_are_deterministic():
+    """Test step order, repeat, seeded mixes and provider lookup"""
+    from app import FaultPlan, upstream_provider, OPERATIONS
+
+    plan = FaultPlan([{'fault': 'drop'}, None, {'fault': 'status', 'status': 503}])
+    assert [fault and fault['fault'] for fault in (plan.next_fault() for _ in range(5))] == ['drop', None, 'status', None, None]
+    repeating = FaultPlan([{'fault': 'drop'}, None], repeat=True)
+    assert [bool(repeating.next_fault()) for _ in range(4)] == [True, False, True, False]
+
+    mix = [{'fault': 'drop', 'rate': 0.3}, {'fault': 'malformed_json', 'rate': 0.2}]
+    plans = [FaultPlan(mix=mix, seed=7) for _ in range(2)]
+    runs = [[(plan.next_fault() or {}).get('fault') for _ in range(200)] for plan in plans]
+    assert runs[0] == runs[1], "Same seed, same faults"
+    assert 40 < runs[0].count('drop') < 80 and 20 < runs[0].count('malformed_json') < 60, runs[0]
+
+    assert upstream_provider(OPERATIONS['watermark-remove']['url'] + '?x=1') == 'unwatermark'
+    assert upstream_provider('https://elsewhere.example/') is None
+    try:
+        FaultPlan([{'fault': 'meteor'}])
+        raise AssertionError("Unknown faults are rejected")
+    except ValueError:
+        pass
+    print(f"✅ Seeded mix: {runs[0].count('drop')} drops, {runs[0].count('malformed_json')} malformed of 200")
+
+def test_sync_failure_modes():
+    """Test each fault against the Flask app: recovered by retries or ending in the fallback"""
+    import app
+
+    undo = local_unblur(app)
+    client = app.app.test_client()
+    try:
+        with app.inject_faults('pixelcut', {'fault': 'drop'}, {'fault': 'status', 'status': 503}, None) as plan:
+            result, _ = post_unblur(client)
+        assert result['source'] == 'api' and _UpstreamHandler.calls == 1, result
+        assert plan.injected == {'drop': 1, 'status': 1}
+
+        # Attempts get at least RETRY_MIN_ATTEMPT_SECONDS, so the 0.5s ceiling reads as 1s
+        with app.inject_faults('pixelcut', {'fault': 'latency', 'seconds': 5}, None):
+            result, elapsed = post_unblur(client)
+        assert result['source'] == 'api' and 1 <= elapsed < 2.5, f"Timed out once, then recovered: {elapsed:.2f}s"
+
+        modes = {}
+        for fault in ({'fault': 'partial', 'bytes': 10}, {'fault': 'malformed_json'}, {'fault': 'connect_timeout'}):
+            app.CIRCUIT_BREAKERS['pixelcut'] = app.CircuitBreaker('pixelcut')  # Measure the mode, not a short circuit
+            with app.inject_faults('pixelcut', fault, repeat=True):
+                result, elapsed = post_unblur(client)
+            assert result['source'] == 'dummy', (fault, result)
+            modes[fault['fault']] = round(elapsed * 1000)
+
+        # A body trickling in faster than the read timeout is never timed out: it holds the worker for its full length
+        app.CIRCUIT_BREAKERS['pixelcut'] = app.CircuitBreaker('pixelcut')
+        with app.inject_faults('pixelcut', {'fault': 'slowloris', 'chunk': 4, 'interval': 0.15}):
+            result, elapsed = post_unblur(client)
+        assert result['source'] == 'api' and elapsed > 1.5, f"Slow body outlived the 1s read timeout: {elapsed:.2f}s"
+        assert 'pixelcut' not in app.fault_injector.plans, "Plans are removed after the block"
+        print(f"✅ Fallback latency per mode (ms): {modes}; slowloris held the worker {elapsed:.2f}s")
+    finally:
+        undo()
+
+def test_async_failure_modes():
+    """Test that the ASGI app's client applies the same plans"""
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    undo = local_unblur(app)
+    asgi_app._async_client = None
+    try:
+        with TestClient(asgi_app.asgi_app) as client:
+            post = lambda: client.post('/api/unblur', files={'image': ('photo.jpg', make_image(), 'image/jpeg')}).json()
+            with app.inject_faults('pixelcut', {'fault': 'drop'}, {'fault': 'latency', 'seconds': 5}, None) as plan:
+                result = post()
+            assert result['source'] == 'api' and _UpstreamHandler.calls == 1, result
+            assert plan.injected == {'drop': 1, 'latency': 1}
+
+            with app.inject_faults('pixelcut', {'fault': 'partial', 'bytes': 10}, repeat=True):
+                assert post()['source'] == 'dummy'
+            with app.inject_faults('pixelcut', {'fault': 'slowloris', 'chunk': 8, 'interval': 5}, None):
+                started = time.monotonic()
+                assert post()['source'] == 'api'
+                assert time.monotonic() - started < 2.5, "A body slower than the read timeout times out and is retried"
+            health = client.get('/').json()
+            assert json.dumps(health['fault_injection']) == '{}', health['fault_injection']
+        print("✅ Async client injects resets, read timeouts, partial and slow bodies")
+    finally:
+        asgi_app._async_client = None
+        undo()
+
+if __name__ == "__main__":
+    print("🧪 Testing upstream fault injection...")
+    print("=" * 50)
+
+    tests = [
+        test_plans_are_deterministic,
+        test_sync_failure_modes,
+        test_async_failure_modes
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
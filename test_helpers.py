@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the test scripts
+"""
+
+import os
+
+def make_image(size=256):
+    """JPEG magic bytes followed by size random bytes, enough to pass upload validation"""
+    return b'\xff\xd8\xff\xc0\x00\x11\x08\x02\x00\x02\x00' + os.urandom(size)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for header-only image validation:
+1. Format and dimensions are read from JPEG, PNG, WEBP and HEIC headers
+2. Extension mismatches and oversized dimensions are rejected before any upstream call
+3. The streaming relay applies the same checks to its held-back head
+"""
+
+import sys
+import os
+import io
+import struct
+sys.path.insert(0, os.path.dirname(__file__))
+
+from PIL import Image
+
+def encode(mode, size, image_format, **options):
+    output = io.BytesIO()
+    Image.new(mode, size).save(output, image_format, **options)
+    return output.getvalue()
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def make_heic(width, height):
+    """Minimal ftyp + meta/iprp/ipco/ispe structure (with a smaller thumbnail ispe)"""
+    ispe = lambda w, h: box(b'ispe', b'\x00\x00\x00\x00' + struct.pack('>II', w, h))
+    ipco = box(b'ipco', ispe(320, 240) + ispe(width, height))
+    meta = box(b'meta', b'\x00\x00\x00\x00' + box(b'hdlr', b'\x00' * 24) + box(b'iprp', ipco))
+    return box(b'ftyp', b'heic\x00\x00\x00\x00mif1heic') + meta + box(b'mdat', os.urandom(64))
+
+def validate(data, filename):
+    from types import SimpleNamespace
+    from werkzeug.datastructures import FileStorage
+    from app import validate_image_upload
+
+    upload = FileStorage(stream=io.BytesIO(data), filename=filename)
+    return validate_image_upload(SimpleNamespace(files={'image': upload}))
+
+def test_probe_formats():
+    """Test dimension probing for every supported format"""
+    from app import probe_image
+
+    exif = Image.Exif()
+    exif[0x010e] = 'x' * 30000  # Large APP1 segment before the frame header
+    samples = {
+        'jpeg': encode('RGB', (640, 480), 'JPEG', exif=exif),
+        'progressive': encode('RGB', (640, 480), 'JPEG', progressive=True),
+        'png': encode('RGBA', (640, 480), 'PNG'),
+        'webp': encode('RGB', (640, 480), 'WEBP'),
+        'webp-lossless': encode('RGB', (640, 480), 'WEBP', lossless=True),
+        'webp-alpha': encode('RGBA', (640, 480), 'WEBP'),
+        'heic': make_heic(640, 480)
+    }
+    for name, data in samples.items():
+        image_format, dimensions = probe_image(io.BytesIO(data))
+        assert image_format == name.split('-')[0].replace('progressive', 'jpeg'), (name, image_format)
+        assert dimensions == (640, 480), (name, dimensions)
+    print(f"✅ Header probing reads dimensions for {len(samples)} variants")
+
+def test_validation_rejects_bad_headers():
+    """Test mismatches, oversized dimensions and corrupt headers"""
+    png = encode('RGB', (64, 64), 'PNG')
+    file, error = validate(png, 'photo.png')
+    assert error is None and (file.image_format, file.width, file.height) == ('png', 64, 64)
+
+    _, error = validate(png, 'photo.jpg')
+    assert 'does not match' in error['error'], error
+
+    _, error = validate(b'MZ' + os.urandom(512), 'photo.png')
+    assert error['error'] == 'File content is not a supported image'
+
+    huge = png[:16] + struct.pack('>II', 50000, 50000) + png[24:]
+    _, error = validate(huge, 'huge.png')
+    assert 'exceed' in error['error'], error
+
+    _, error = validate(b'\xff\xd8\xff\xe0' + os.urandom(512), 'photo.jpg')
+    assert error['error'] == 'Could not read image dimensions'
+    print("✅ Validation rejects mismatched, oversized and corrupt headers")
+
+def test_streaming_relay_checks_head():
+    """Test that the streaming relay rejects mismatched and oversized heads"""
+    from app import StreamingUploadRelay, UploadRejected
+
+    def relay_error(filename, data):
+        relay = StreamingUploadRelay('XyZ', {})
+        body = (
+            f'--XyZ\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode('utf-8') + data + b'\r\n--XyZ--\r\n'
+        try:
+            relay.feed(body)
+            relay.finish()
+        except UploadRejected as e:
+            return str(e)
+        return None
+
+    png = encode('RGB', (64, 64), 'PNG')
+    assert relay_error('photo.png', png) is None
+    assert 'does not match' in relay_error('photo.webp', png)
+    assert 'exceed' in relay_error('photo.png', png[:16] + struct.pack('>II', 50000, 50000) + png[24:])
+    print("✅ Streaming relay applies header checks")
+
+if __name__ == "__main__":
+    print("🧪 Testing header-only image validation...")
+    print("=" * 50)
+
+    tests = [
+        test_probe_formats,
+        test_validation_rejects_bad_headers,
+        test_streaming_relay_checks_head
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
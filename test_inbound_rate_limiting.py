@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Test script for inbound per-client rate limiting:
+1. The sliding-window estimate carries over part of the previous window
+2. Clients are told apart by issued API key, then by IP (honouring trusted proxies)
+3. Both apps answer 429 with Retry-After before the upload is read
+"""
+
+import sys
+import os
+import io
+import asyncio
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+def test_sliding_window():
+    """Test the weighted estimate, retry hints and the bounded in-memory store"""
+    from app import MemoryWindowStore, SQLiteWindowStore
+    import tempfile
+
+    store = MemoryWindowStore(max_clients=2)
+    window_start = 1000 * 60.0
+    outcomes = [store.hit('client', 10, 60, window_start + 1)[0] for _ in range(10)]
+    assert all(outcomes) and store.hit('client', 10, 60, window_start + 2)[0] is False
+
+    # Halfway into the next window, half of the previous window's 10 still counts
+    halfway = window_start + 90
+    results = [store.hit('client', 10, 60, halfway) for _ in range(6)]
+    assert [allowed for allowed, _, _ in results] == [True] * 5 + [False], results
+    assert results[4][1] == 0 and 0 < results[5][2] <= 60, results
+
+    store.hit('other', 10, 60, halfway)
+    store.hit('third', 10, 60, halfway)
+    assert len(store) == 2, "Least recently seen clients are evicted"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = [SQLiteWindowStore(os.path.join(tmp, 'inbound.sqlite3')) for _ in range(2)]
+        outcomes = [shared[i % 2].hit('client', 3, 60, window_start + 1)[0] for i in range(4)]
+        assert outcomes == [True, True, True, False], "Workers share one window through SQLite"
+    print(f"✅ Sliding window allowed 5 of 6 halfway through, retry hint {results[5][2]:.1f}s")
+
+def test_client_identity():
+    """Test issued-key, IP and X-Forwarded-For identification"""
+    import app
+
+    original_proxies, original_keys = app.INBOUND_TRUSTED_PROXIES, app.INBOUND_API_KEYS
+    app.INBOUND_API_KEYS = {'abc'}
+    try:
+        assert app.inbound_client_id({'Authorization': 'Bearer abc'}, '10.0.0.1') == app.inbound_client_id({'X-API-Key': 'abc'}, '10.0.0.2')
+        assert app.inbound_client_id({'Authorization': 'Bearer abc'}, '10.0.0.1').startswith('token:')
+        assert app.inbound_client_id({'X-API-Key': 'made-up'}, '10.0.0.1') == 'ip:10.0.0.1', "Unknown keys don't get their own budget"
+        assert app.inbound_client_id({'X-Forwarded-For': '1.2.3.4'}, '10.0.0.1') == 'ip:10.0.0.1', "Untrusted X-Forwarded-For is ignored"
+
+        app.INBOUND_TRUSTED_PROXIES = 1
+        assert app.inbound_client_id({'X-Forwarded-For': 'spoofed, 1.2.3.4'}, '10.0.0.1') == 'ip:1.2.3.4'
+        print("✅ Clients identified by issued key, else by the address the trusted proxy saw")
+    finally:
+        app.INBOUND_TRUSTED_PROXIES, app.INBOUND_API_KEYS = original_proxies, original_keys
+
+def test_flask_rejects_before_reading_body():
+    """Test 429 + Retry-After from the Flask app without validating the upload"""
+    import app
+
+    validated = []
+    original_validate, original_limiter = app.validate_image_upload, app.inbound_limiter
+
+    def counting_validate(req):
+        validated.append(True)
+        return None, {'success': False, 'error': 'stop here'}
+
+    app.validate_image_upload = counting_validate
+    app.inbound_limiter = app.InboundRateLimiter(app.MemoryWindowStore())
+    original_keys, app.INBOUND_API_KEYS = app.INBOUND_API_KEYS, {'other-client'}
+    app.INBOUND_ROUTE_LIMITS['/api/upscale'] = 2
+    client = app.app.test_client()
+
+    def post(**headers):
+        return client.post(
+            '/api/upscale',
+            data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data',
+            headers=headers
+        )
+
+    try:
+        responses = [post() for _ in range(3)]
+        assert [response.status_code for response in responses] == [400, 400, 429]
+        assert responses[0].headers['X-RateLimit-Remaining'] == '1'
+        assert int(responses[2].headers['Retry-After']) >= 1 and 'Rate limit exceeded' in responses[2].get_json()['error']
+        assert len(validated) == 2, "The rejected upload was never validated"
+
+        assert post(Authorization='Bearer made-up').status_code == 429, "An unknown token shares the IP's budget"
+        assert post(Authorization='Bearer other-client').status_code == 400, "An issued key has its own budget"
+        assert app.inbound_limiter.stats()['rejected'] == {'/api/upscale': 2}
+        assert client.get('/').status_code == 200, "Unlimited routes are untouched"
+        print("✅ Flask answers 429 before validating the upload")
+    finally:
+        app.validate_image_upload, app.inbound_limiter = original_validate, original_limiter
+        app.INBOUND_API_KEYS = original_keys
+        del app.INBOUND_ROUTE_LIMITS['/api/upscale']
+
+def test_asgi_rejects_before_receiving_body():
+    """Test that the ASGI middleware answers 429 without calling receive()"""
+    import app
+    import asgi_app
+
+    original_limiter = app.inbound_limiter
+    asgi_app.inbound_limiter = app.InboundRateLimiter(app.MemoryWindowStore())
+    app.INBOUND_ROUTE_LIMITS['/api/ai-art'] = 1
+    forwarded = []
+
+    async def downstream(scope, receive, send):
+        forwarded.append(scope['path'])
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+    async def receive():
+        raise AssertionError("The body must not be read for a rejected request")
+
+    async def call():
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/ai-art', 'headers': [], 'client': ('10.1.1.1', 5000)}
+        await asgi_app.InboundRateLimitMiddleware(downstream)(scope, receive, send)
+        return messages[0]['status'], dict(messages[0]['headers'])
+
+    try:
+        status, headers = asyncio.run(call())
+        assert status == 200 and headers[b'x-ratelimit-remaining'] == b'0', headers
+        status, headers = asyncio.run(call())
+        assert status == 429 and int(headers[b'retry-after']) >= 1, headers
+        assert forwarded == ['/api/ai-art']
+        print("✅ ASGI middleware answers 429 without receiving the body")
+    finally:
+        asgi_app.inbound_limiter = original_limiter
+        del app.INBOUND_ROUTE_LIMITS['/api/ai-art']
+
+if __name__ == "__main__":
+    print("🧪 Testing inbound rate limiting...")
+    print("=" * 50)
+
+    tests = [
+        test_sliding_window,
+        test_client_identity,
+        test_flask_rejects_before_reading_body,
+        test_asgi_rejects_before_receiving_body
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
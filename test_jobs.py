@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Test script for the asynchronous job API:
+1. Memory and SQLite job stores share one interface
+2. ?async=1 returns 202 and the job can be polled to completion
+3. Finished jobs are POSTed to an optional webhook
+4. Webhooks to loopback, private or link-local addresses are refused
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+IMAGE_BYTES = b'\x89PNG\r\n\x1a\n' + os.urandom(2048)
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.received.append(json.loads(body))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def wait_for_job(client, job_id, timeout=5):
+    """Poll GET /api/jobs/<id> until the job leaves queued/running"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish in {timeout}s")
+
+def test_job_stores():
+    """Test create/get/update on the memory and SQLite stores"""
+    from app import MemoryJobStore, SQLiteJobStore, new_job
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for store in (MemoryJobStore(), SQLiteJobStore(os.path.join(tmp, 'jobs.sqlite3'))):
+            job = store.create(new_job('upscale'))
+            assert store.get(job['job_id'])['status'] == 'queued'
+            updated = store.update(job['job_id'], status='succeeded', result={'success': True})
+            assert updated['result'] == {'success': True}
+            assert store.get(job['job_id'])['status'] == 'succeeded'
+            assert store.get('missing') is None
+
+        # A second handle on the same file sees jobs written by the first (another worker)
+        path = os.path.join(tmp, 'jobs.sqlite3')
+        job = SQLiteJobStore(path).create(new_job('unblur'))
+        assert SQLiteJobStore(path).get(job['job_id'])['operation'] == 'unblur'
+    print("✅ Memory and SQLite job stores behave the same")
+
+def test_async_job_with_webhook():
+    """Test 202 + polling for an image job, including binary results and the webhook"""
+    import app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _WebhookHandler.received = []
+
+    class FakeImageResponse:
+        status_code = 200
+        headers = {'content-type': 'image/png'}
+        content = IMAGE_BYTES
+
+    uploaded = []
+
+    def fake_request(api_url, files, headers, **kwargs):
+        # The job runs after the request ended, so the upload must still be readable
+        uploaded.append(files['image'][1].read())
+        return app.parse_image_api_response(FakeImageResponse())
+
+    original_request, original_key = app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key']
+    app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = fake_request, 'test-key'
+    app.JOB_WEBHOOK_ALLOW_PRIVATE = True  # The webhook receiver listens on loopback
+    client = app.app.test_client()
+    image = b'\xff\xd8\xff\xc0\x00\x11\x08\x02\x00\x02\x00' + os.urandom(1024)
+    try:
+        response = client.post(
+            f'/api/unblur?async=1&webhook_url=http://127.0.0.1:{server.server_port}/hook',
+            data={'image': (io.BytesIO(image), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 202
+        accepted = response.get_json()
+        assert accepted['status'] == 'queued' and accepted['status_url'].endswith(accepted['job_id'])
+
+        job = wait_for_job(client, accepted['job_id'])
+        assert job['status'] == 'succeeded', job
+        assert uploaded == [image]
+        stored = client.get(job['result']['processed_image'].replace('http://localhost', ''))
+        assert stored.data == IMAGE_BYTES
+
+        deadline = time.time() + 5
+        while not _WebhookHandler.received and time.time() < deadline:
+            time.sleep(0.02)
+        assert _WebhookHandler.received[0]['job_id'] == accepted['job_id']
+        assert 'webhook_url' not in _WebhookHandler.received[0]
+        assert not any(str(server.server_port) in origin for origin in app._upstream_sessions), "Webhooks are not pooled"
+
+        bad = client.post(
+            '/api/unblur?async=1&webhook_url=ftp://example.com',
+            data={'image': (io.BytesIO(image), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert bad.status_code == 400
+        assert client.get('/api/jobs/doesnotexist').status_code == 404
+        print(f"✅ Async job completed and webhook delivered: {job['job_id']}")
+    finally:
+        app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = original_request, original_key
+        app.JOB_WEBHOOK_ALLOW_PRIVATE = False
+        server.shutdown()
+
+def test_webhook_refuses_private_hosts():
+    """Test that non-public webhook hosts are rejected on submit and again at connect time"""
+    import app
+
+    for address in ('127.0.0.1', '10.1.2.3', '169.254.169.254', '0.0.0.0', '224.0.0.1', '::1', '::ffff:127.0.0.1', 'fe80::1%eth0'):
+        assert not app.is_public_address(address), address
+    assert app.is_public_address('8.8.8.8') and app.is_public_address('2606:4700:4700::1111')
+
+    for url in ('http://127.0.0.1/hook', 'http://localhost:8080/hook', 'http://[::1]/hook', 'http://169.254.169.254/latest'):
+        try:
+            app.validate_webhook_url(url)
+            raise AssertionError(f"{url} should be refused")
+        except ValueError:
+            pass
+
+    response = app.app.test_client().post(
+        '/api/ai-art?async=1&webhook_url=http://169.254.169.254/latest', json={'prompt': 'a cat'}
+    )
+    assert response.status_code == 400 and 'webhook_url not allowed' in response.get_json()['error']
+
+    # A job stored with a private URL (or a host that rebinds after submit) is still never reached
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _WebhookHandler.received = []
+    try:
+        job = app.new_job('upscale', f'http://127.0.0.1:{server.server_port}/hook')
+        started = time.monotonic()
+        app.deliver_webhook(job)
+        assert _WebhookHandler.received == [] and time.monotonic() - started < 1, "Refused without retrying"
+        print("✅ Webhooks to non-public addresses are refused")
+    finally:
+        server.shutdown()
+
+def test_failed_job_is_recorded():
+    """Test that an exception inside a job marks it failed instead of crashing the worker"""
+    import app
+
+    with app.app.test_request_context('/api/ai-art', base_url='http://localhost'):
+        def boom():
+            raise RuntimeError('upstream exploded')
+        response = app.submit_job('ai-art', boom)
+
+    job = wait_for_job(app.app.test_client(), response.get_json()['job_id'])
+    assert job['status'] == 'failed' and 'upstream exploded' in job['error']
+    print("✅ Failed jobs are recorded with their error")
+
+if __name__ == "__main__":
+    print("🧪 Testing asynchronous job API...")
+    print("=" * 50)
+
+    tests = [
+        test_job_stores,
+        test_async_job_with_webhook,
+        test_webhook_refuses_private_hosts,
+        test_failed_job_is_recorded
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
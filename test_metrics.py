@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for the Prometheus metrics endpoint:
+1. Per-thread shards add up to exact totals and survive their threads
+2. /metrics reports per-route requests, upstream timeouts and dummy fallbacks
+3. The ASGI app labels requests by route template
+"""
+
+import sys
+import os
+import io
+import threading
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+def metric_value(text, sample):
+    """Value of the exposition line starting with sample (None if absent)"""
+    for line in text.splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+def test_per_thread_aggregation():
+    """Test exact totals across threads and folding of finished threads' shards"""
+    from app import MetricsRegistry
+
+    registry = MetricsRegistry(enabled=True)
+    registry.counter('jobs_total', 'Jobs', ('kind',))
+    registry.histogram('job_seconds', 'Job time', (), buckets=(0.1, 1))
+
+    def work():
+        for _ in range(1000):
+            registry.inc('jobs_total', ('resize',))
+            registry.observe('job_seconds', (), 0.5)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    registry.observe('job_seconds', (), 0.05)
+
+    text = registry.render()
+    assert metric_value(text, 'jobs_total{kind="resize"}') == 8000, text
+    assert metric_value(text, 'job_seconds_bucket{le="0.1"}') == 1
+    assert metric_value(text, 'job_seconds_bucket{le="1"}') == 8001
+    assert metric_value(text, 'job_seconds_bucket{le="+Inf"}') == metric_value(text, 'job_seconds_count') == 8001
+    assert len(registry._shards) == 1, "Finished threads' shards are folded into the retired total"
+    assert '# TYPE job_seconds histogram' in text
+    print("✅ 8 threads x 1000 increments add up to 8000")
+
+def test_flask_metrics_endpoint():
+    """Test route counters, upstream timeouts and the dummy fallback counter"""
+    import requests
+    import app
+
+    client = app.app.test_client()
+    before = client.get('/metrics').get_data(as_text=True)
+    fallback_sample = 'fallback_responses_total{endpoint="watermark-remove"}'
+    route_sample = 'http_requests_total{route="/api/watermark-remove",method="POST",status="200"}'
+
+    original_key = app.PROVIDERS['unwatermark']['api_key']
+    app.PROVIDERS['unwatermark']['api_key'] = None
+    try:
+        response = client.post(
+            '/api/watermark-remove',
+            data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert response.get_json()['source'] == 'dummy'
+    finally:
+        app.PROVIDERS['unwatermark']['api_key'] = original_key
+
+    def timed_out(attempt_timeout):
+        raise requests.exceptions.ConnectTimeout('connect timed out')
+
+    try:
+        app.call_with_retry('metrics-test', timed_out, 5, policy=app.RetryPolicy(max_attempts=1))
+    except Exception:
+        pass
+
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert metric_value(text, route_sample) == (metric_value(before, route_sample) or 0) + 1
+    assert metric_value(text, fallback_sample) == (metric_value(before, fallback_sample) or 0) + 1
+    assert metric_value(text, 'upstream_timeouts_total{provider="metrics-test"}') == 1
+    assert metric_value(text, 'upstream_failures_total{provider="metrics-test"}') == 1
+    assert metric_value(text, 'upstream_circuit_state{provider="unwatermark"}') is not None
+    print("✅ /metrics reports routes, upstream timeouts and fallbacks")
+
+def test_asgi_route_labels():
+    """Test that ASGI requests are labelled by route and 404s don't add label values"""
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    client = TestClient(asgi_app.asgi_app)
+    client.get('/')
+    client.get('/no/such/path')
+    text = client.get('/metrics').text
+    assert metric_value(text, 'http_requests_total{route="/",method="GET",status="200"}') >= 1
+    assert metric_value(text, 'http_requests_total{route="unmatched",method="GET",status="404"}') >= 1
+    assert '/no/such/path' not in text
+    print("✅ ASGI requests labelled by route template")
+
+if __name__ == "__main__":
+    print("🧪 Testing Prometheus metrics...")
+    print("=" * 50)
+
+    tests = [
+        test_per_thread_aggregation,
+        test_flask_metrics_endpoint,
+        test_asgi_route_labels
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test script for the declarative operation registry:
+1. Every registered operation is served by both the Flask and ASGI apps
+2. Adding an operation is a registry entry, not a new endpoint function
+3. All image operations share one parser and one error path
+"""
+
+import sys
+import os
+import io
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+def test_registry_drives_routes():
+    """Test that routes and upstream mapping come from the registry"""
+    import app
+    import asgi_app
+
+    flask_rules = {rule.rule for rule in app.app.url_map.iter_rules()}
+    asgi_paths = {route.path for route in asgi_app.routes}
+    for name, spec in app.OPERATIONS.items():
+        assert spec['provider'] in app.PROVIDERS, name
+        assert app.ENDPOINT_UPSTREAMS[name] == spec['provider']
+        assert f'/api/{name}' in flask_rules and f'/api/{name}' in asgi_paths, name
+    assert set(app.IMAGE_OPERATIONS) == set(app.OPERATIONS) - {'ai-art'}
+    print(f"✅ {len(app.OPERATIONS)} registered operations are routed in both apps")
+
+def test_new_operation_needs_only_a_spec():
+    """Test that a registry entry alone makes an operation usable in batch requests"""
+    import app
+
+    calls = []
+
+    def fake_request(api_url, files, headers, **kwargs):
+        calls.append((api_url, headers['Authorization'], kwargs.get('data'), kwargs.get('timeout')))
+        return {'success': True, 'processed_image': 'https://cdn.example/out.png', 'source': 'api'}
+
+    original_request, original_key = app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key']
+    app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = fake_request, 'test-key'
+    app.OPERATIONS['colorize'] = app.IMAGE_OPERATIONS['colorize'] = {
+        'label': 'Colorize', 'input': 'image', 'provider': 'pixelcut',
+        'url': 'https://api.pixelcut.ai/v1/colorize', 'timeout': 30, 'params': {'strength': 'high'}
+    }
+    try:
+        response = app.app.test_client().post(
+            '/api/batch',
+            data={'operations': 'colorize', 'images': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert b'"success": true' in response.data, response.data
+        assert calls == [('https://api.pixelcut.ai/v1/colorize', 'Bearer test-key', {'strength': 'high'}, 30)]
+        print("✅ A new registry entry is callable without new endpoint code")
+    finally:
+        app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = original_request, original_key
+        del app.OPERATIONS['colorize'], app.IMAGE_OPERATIONS['colorize']
+
+def test_shared_parser_and_error_path():
+    """Test binary upscale results and the missing-key fallback"""
+    import app
+
+    class FakeImageResponse:
+        headers = {'content-type': 'image/png'}
+        content = b'\x89PNG\r\n\x1a\n'
+
+    result = app.operation_parser(app.OPERATIONS['upscale'])(FakeImageResponse())
+    assert result['image_bytes'] == FakeImageResponse.content and result['source'] == 'pixelcut'
+
+    original_key = app.PROVIDERS['unwatermark']['api_key']
+    app.PROVIDERS['unwatermark']['api_key'] = None
+    try:
+        response = app.app.test_client().post(
+            '/api/watermark-remove',
+            data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert response.get_json()['source'] == 'dummy'
+        assert app.app.test_client().get('/').get_json()['api_keys_loaded']['unwatermark'] is False
+        print("✅ Upscale accepts binary results and a missing key falls back to the dummy response")
+    finally:
+        app.PROVIDERS['unwatermark']['api_key'] = original_key
+
+if __name__ == "__main__":
+    print("🧪 Testing operation registry...")
+    print("=" * 50)
+
+    tests = [
+        test_registry_drives_routes,
+        test_new_operation_needs_only_a_spec,
+        test_shared_parser_and_error_path
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
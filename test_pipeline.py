@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Test script for the pipeline endpoint:
+1. Each stage's output (bytes or URL) feeds the next stage unchanged
+2. Only the final output is returned, with per-stage timings
+3. A failing stage stops the pipeline and skips the rest
+4. Oversized intermediate results are dropped at the size cap, not read whole
+"""
+
+import sys
+import os
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+STAGE_TWO = b'\x89PNG\r\n\x1a\n' + os.urandom(2048)
+
+def make_png():
+    # Fresh bytes per test so the result cache doesn't short-circuit stages
+    return b'\x89PNG\r\n\x1a\n' + os.urandom(1024)
+
+class _ResultHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(STAGE_TWO)))
+        self.end_headers()
+        self.wfile.write(STAGE_TWO)
+
+    def log_message(self, format, *args):
+        pass
+
+class _EndlessHandler(BaseHTTPRequestHandler):
+    """Chunked image body that never ends; counts what was sent before the client hung up"""
+    protocol_version = 'HTTP/1.1'
+    sent = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunk = os.urandom(64 * 1024)
+        try:
+            while _EndlessHandler.sent < 256 * 1024 * 1024:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                _EndlessHandler.sent += len(chunk)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def post_pipeline(client, operations, query=''):
+    return client.post(
+        f'/api/pipeline{query}',
+        data={'operations': operations, 'image': (io.BytesIO(b'\xff\xd8\xff\xc0\x00\x11\x08\x02\x00\x02\x00' + os.urandom(512)), 'photo.jpg', 'image/jpeg')},
+        content_type='multipart/form-data'
+    )
+
+def test_pipeline_chains_outputs():
+    """Test bytes and URL hand-off between stages and the timing report"""
+    import app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ResultHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    received = []
+    stage_one = make_png()
+
+    def fake_request(api_url, files, headers, **kwargs):
+        received.append((api_url, files['image'][0], files['image'][1].read()))
+        if api_url == app.PIXELCUT_BACKGROUND_REMOVE_URL:
+            return {'success': True, 'image_bytes': stage_one, 'content_type': 'image/png', 'source': 'api'}
+        if api_url == app.PIXELCUT_UPSCALE_URL:
+            return {'success': True, 'processed_image': f'http://127.0.0.1:{server.server_port}/out.png', 'source': 'pixelcut'}
+        return {'success': True, 'processed_image': 'https://cdn.example/final.png', 'source': 'api'}
+
+    original_request, original_key = app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key']
+    app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = fake_request, 'test-key'
+    try:
+        response = post_pipeline(app.app.test_client(), 'background-remove,upscale,unblur')
+        result = response.get_json()
+        assert result['processed_image'] == 'https://cdn.example/final.png'
+        assert [stage['status'] for stage in result['stages']] == ['succeeded'] * 3
+        assert 'fetch_ms' in result['stages'][2]
+        assert received[1][1:] == ('photo.png', stage_one), "Stage 2 gets stage 1 bytes as-is"
+        assert received[2][2] == STAGE_TWO, "Stage 3 gets the downloaded stage 2 output"
+        assert response.headers['Server-Timing'].count('dur=') == 3
+        print(f"✅ Pipeline chained 3 stages: {response.headers['Server-Timing']}")
+
+        assert post_pipeline(app.app.test_client(), 'upscale,teleport').status_code == 400
+        assert post_pipeline(app.app.test_client(), ','.join(['upscale'] * (app.PIPELINE_MAX_STAGES + 1))).status_code == 400
+        print("✅ Invalid pipelines are rejected")
+    finally:
+        app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = original_request, original_key
+        server.shutdown()
+
+def test_pipeline_stops_on_failure():
+    """Test that a dummy stage result ends the pipeline"""
+    import app
+    stage_one = make_png()
+
+    def fake_request(api_url, files, headers, **kwargs):
+        if api_url == app.PIXELCUT_UPSCALE_URL:
+            raise Exception('upstream down')
+        return {'success': True, 'image_bytes': stage_one, 'content_type': 'image/png', 'source': 'api'}
+
+    original_request, original_key = app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key']
+    app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = fake_request, 'test-key'
+    try:
+        result = post_pipeline(app.app.test_client(), 'unblur,upscale,background-remove').get_json()
+        assert result['source'] == 'dummy'
+        assert [stage['status'] for stage in result['stages']] == ['succeeded', 'failed', 'skipped']
+        print("✅ Failed stage stops the pipeline")
+    finally:
+        app.make_image_api_request, app.PROVIDERS['pixelcut']['api_key'] = original_request, original_key
+
+def test_asgi_pipeline():
+    """Test the ASGI pipeline against a mocked upstream"""
+    import httpx
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+    stage_one, stage_two = make_png(), make_png()
+
+    def mock_upstream(request):
+        if request.method == 'GET':
+            return httpx.Response(200, content=stage_two, headers={'content-type': 'image/png'})
+        if request.url.path.endswith('/remove'):
+            return httpx.Response(200, content=stage_one, headers={'content-type': 'image/png'})
+        return httpx.Response(200, json={'result_url': 'https://cdn.example/out.png'})
+
+    original_key = app.PROVIDERS['pixelcut']['api_key']
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    try:
+        response = TestClient(asgi_app.asgi_app).post(
+            '/api/pipeline?response=binary',
+            data={'operations': 'background-remove,upscale,unblur'},
+            files={'image': ('photo.jpg', b'\xff\xd8\xff\xc0\x00\x11\x08\x02\x00\x02\x00' + os.urandom(256), 'image/jpeg')},
+            follow_redirects=False
+        )
+        assert response.status_code == 302 and response.headers['location'] == 'https://cdn.example/out.png'
+        assert response.headers['server-timing'].count('dur=') == 3
+        print("✅ ASGI pipeline chains stages")
+    finally:
+        app.PROVIDERS['pixelcut']['api_key'] = original_key
+        asgi_app._async_client = None
+
+def test_oversized_stage_download():
+    """Test that both apps stop downloading an intermediate result once it passes the cap"""
+    import asyncio
+    import httpx
+    import app
+    import asgi_app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _EndlessHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _EndlessHandler.sent = 0
+    streamed = []
+
+    async def endless():
+        while True:
+            streamed.append(1)
+            yield os.urandom(64 * 1024)
+
+    original_limit = app.MAX_FILE_SIZE
+    app.MAX_FILE_SIZE = 256 * 1024
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, content=endless(), headers={'content-type': 'image/png'})
+    ))
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/huge.png'
+        try:
+            app.load_stage_output({'success': True, 'processed_image': url})
+            raise AssertionError("Oversized result should fail")
+        except Exception as e:
+            assert 'exceeds' in str(e), e
+        assert _EndlessHandler.sent < 32 * 1024 * 1024, f"Stopped reading early: {_EndlessHandler.sent} bytes sent"
+        assert not any(str(server.server_port) in origin for origin in app._upstream_sessions), "Result URLs are not pooled"
+
+        try:
+            asyncio.run(asgi_app.async_load_stage_output({'success': True, 'processed_image': 'https://cdn.example/huge.png'}))
+            raise AssertionError("Oversized result should fail")
+        except Exception as e:
+            assert 'exceeds' in str(e), e
+        assert len(streamed) <= 6, f"Async download read {len(streamed)} chunks"
+        print(f"✅ Oversized results dropped after {_EndlessHandler.sent // 1024}KB (sync), {len(streamed)} chunks (async)")
+    finally:
+        app.MAX_FILE_SIZE = original_limit
+        asgi_app._async_client = None
+        server.shutdown()
+
+if __name__ == "__main__":
+    print("🧪 Testing pipeline endpoint...")
+    print("=" * 50)
+
+    tests = [
+        test_pipeline_chains_outputs,
+        test_pipeline_stops_on_failure,
+        test_asgi_pipeline,
+        test_oversized_stage_download
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
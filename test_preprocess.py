@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test script for optional upload pre-processing:
+1. Large uploads are downscaled to the operation's maximum and stripped of EXIF
+2. Undecodable or already-small uploads are forwarded untouched
+3. Endpoints report bytes saved in X-Upload-Bytes-Saved
+"""
+
+import sys
+import os
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+from PIL import Image
+
+def make_jpeg(width, height):
+    """Noisy JPEG with an EXIF orientation tag"""
+    picture = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees
+    output = io.BytesIO()
+    picture.save(output, 'JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    bodies = []
+
+    def do_POST(self):
+        self.bodies.append(self.rfile.read(int(self.headers['Content-Length'])))
+        body = b'{"output_url": "https://cdn.example/out.png"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def test_preprocess_downscales_and_strips_exif():
+    """Test resizing, EXIF removal and orientation handling"""
+    import app
+
+    original = make_jpeg(3000, 2000)
+    app.PREPROCESS_UPLOADS = True
+    try:
+        (filename, stream, content_type), stats = app.preprocess_upload(
+            ('photo.jpeg', io.BytesIO(original), 'image/jpeg'), 1024
+        )
+    finally:
+        app.PREPROCESS_UPLOADS = False
+
+    processed = Image.open(stream)
+    assert processed.size == (683, 1024), f"Orientation applied and longest side capped: {processed.size}"
+    assert not processed.getexif(), "EXIF should be stripped"
+    assert filename == 'photo.jpg' and content_type == 'image/jpeg'
+    assert stats['resized'] and stats['bytes_saved'] == len(original) - stats['sent_bytes'] > 0
+    print(f"✅ Pre-processing saved {stats['bytes_saved']} bytes in {stats['ms']}ms")
+
+def test_preprocess_passthrough():
+    """Test that disabled, undecodable and already-optimal uploads are left alone"""
+    import app
+
+    image = ('photo.png', io.BytesIO(b'\x89PNG\r\n\x1a\n' + os.urandom(256)), 'image/png')
+    assert app.preprocess_upload(image, 1024) == (image, None), "Disabled by default"
+
+    app.PREPROCESS_UPLOADS = True
+    try:
+        assert app.preprocess_upload(image, 1024) == (image, None), "Undecodable uploads pass through"
+
+        small = Image.frombytes('RGB', (64, 64), os.urandom(64 * 64 * 3))
+        output = io.BytesIO()
+        small.save(output, 'JPEG', quality=50)
+        tiny = ('tiny.jpg', io.BytesIO(output.getvalue()), 'image/jpeg')
+        result, stats = app.preprocess_upload(tiny, 1024)
+        assert result is tiny and stats['bytes_saved'] == 0, "Re-encoding that doesn't help is discarded"
+        assert tiny[1].tell() == 0, "Stream is rewound for the upstream request"
+    finally:
+        app.PREPROCESS_UPLOADS = False
+    print("✅ Pre-processing leaves unsuitable uploads untouched")
+
+def test_endpoint_reports_bytes_saved():
+    """Test the shrunken upload reaches the upstream and the header reports the saving"""
+    import app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _UpstreamHandler.bodies = []
+    original_url, original_key = app.OPERATIONS['unblur']['url'], app.PROVIDERS['pixelcut']['api_key']
+    app.OPERATIONS['unblur']['url'] = f'http://127.0.0.1:{server.server_port}/v1/enhance'
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    app.PREPROCESS_UPLOADS = True
+    try:
+        upload = make_jpeg(3200, 2400)
+        response = app.app.test_client().post(
+            '/api/unblur',
+            data={'image': (io.BytesIO(upload), 'photo.jpg', 'image/jpeg')},
+            content_type='multipart/form-data'
+        )
+        assert response.get_json()['processed_image'] == 'https://cdn.example/out.png'
+        saved = int(response.headers['X-Upload-Bytes-Saved'])
+        assert saved > 0 and len(_UpstreamHandler.bodies[0]) < len(upload) - saved + 1024
+        assert app.get_preprocess_stats()['bytes_saved'] >= saved
+        print(f"✅ Endpoint forwarded a smaller upload and reported {saved} bytes saved")
+    finally:
+        app.OPERATIONS['unblur']['url'], app.PROVIDERS['pixelcut']['api_key'] = original_url, original_key
+        app.PREPROCESS_UPLOADS = False
+        server.shutdown()
+
+if __name__ == "__main__":
+    print("🧪 Testing upload pre-processing...")
+    print("=" * 50)
+
+    tests = [
+        test_preprocess_downscales_and_strips_exif,
+        test_preprocess_passthrough,
+        test_endpoint_reports_bytes_saved
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
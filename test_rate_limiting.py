@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Test script for client-side upstream rate limiting:
+1. The token bucket spaces out calls over the configured rate instead of bursting
+2. Retry-After and X-RateLimit headers pause a provider's calls until the upstream allows them
+3. Buckets in the SQLite store are shared by every limiter (worker process) using the file
+4. The retry loop waits out a 429's Retry-After instead of retrying straight away
+"""
+
+import sys
+import os
+import time
+import tempfile
+import threading
+from types import SimpleNamespace
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+class _QuotaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('X-RateLimit-Limit', '100')
+        self.send_header('X-RateLimit-Remaining', '0' if status == 429 else '42')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def fake_response(status_code=200, **headers):
+    return SimpleNamespace(status_code=status_code, headers=headers)
+
+def test_bucket_spaces_calls():
+    """Test burst allowance, evenly spaced slots and rejection past max_wait"""
+    from app import RateLimiter, MemoryRateLimitStore, RateLimited
+
+    limiter = RateLimiter(MemoryRateLimitStore(), limits={'qwen': {'rate': 20, 'burst': 2}}, max_wait=0.12)
+    waits = [limiter.reserve('qwen') for _ in range(4)]
+    assert waits[0] == waits[1] == 0, "The burst goes out at once"
+    assert 0.04 < waits[2] <= 0.05 and 0.09 < waits[3] <= 0.1, waits
+    try:
+        limiter.reserve('qwen')
+        raise AssertionError("Expected a slot beyond max_wait to be refused")
+    except RateLimited as e:
+        assert e.provider == 'qwen' and 0.1 < e.retry_after <= 0.15
+    assert limiter.reserve('hung-test') == 0, "Calls outside the provider registry are not limited"
+
+    stats = limiter.snapshot()['qwen']
+    assert stats['throttled'] == 2 and stats['rejected'] == 1 and stats['tokens'] < 0, stats
+    print(f"✅ Bucket spaced calls by {[round(wait, 3) for wait in waits]}s and refused the overflow")
+
+def test_headers_pause_provider():
+    """Test Retry-After (seconds and HTTP date) and an exhausted X-RateLimit quota"""
+    from app import RateLimiter, MemoryRateLimitStore, parse_retry_after
+
+    now = time.time()
+    assert parse_retry_after('7', now) == 7
+    assert 28 <= parse_retry_after(formatdate(now + 30, usegmt=True), now) <= 30
+    assert parse_retry_after('soon', now) is None
+
+    limiter = RateLimiter(MemoryRateLimitStore(), limits={})
+    limiter.observe('qwen', fake_response(429, **{'Retry-After': '0.5'}))
+    assert 0.4 < limiter.reserve('qwen') <= 0.5
+
+    limiter.observe('pixelcut', fake_response(200, **{
+        'X-RateLimit-Limit': '60', 'X-RateLimit-Remaining': '1', 'X-RateLimit-Reset': str(int(time.time()) + 3)
+    }))
+    assert limiter.reserve('pixelcut') == 0, "The last request of the window goes straight out"
+    assert 1.5 < limiter.reserve('pixelcut') <= 3, "Then calls wait for the window to reset"
+
+    stats = limiter.snapshot()
+    assert stats['qwen']['upstream_429'] == 1 and stats['pixelcut']['upstream_limit'] == 60
+    assert stats['pixelcut']['upstream_remaining'] == 0 and stats['pixelcut']['reset_in'] > 1
+    print(f"✅ Upstream headers pause calls: {stats['pixelcut']}")
+
+def test_sqlite_store_is_shared():
+    """Test that two limiters on one SQLite file draw from the same bucket"""
+    from app import RateLimiter, SQLiteRateLimitStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ratelimits.sqlite3')
+        limits = {'unwatermark': {'rate': 10, 'burst': 1}}
+        worker_a = RateLimiter(SQLiteRateLimitStore(path), limits=limits)
+        worker_b = RateLimiter(SQLiteRateLimitStore(path), limits=limits)
+
+        assert worker_a.reserve('unwatermark') == 0
+        assert 0.05 < worker_b.reserve('unwatermark') <= 0.1, "Worker B queues behind worker A's call"
+        worker_b.observe('unwatermark', fake_response(429))
+        assert worker_a.snapshot()['unwatermark']['paused_for'] > 4, "A 429 seen by B pauses A too"
+        print("✅ SQLite-backed buckets are shared across limiters")
+
+def test_retry_waits_for_retry_after():
+    """Test that a 429 with Retry-After delays the retry instead of burning it"""
+    import requests
+    import app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _QuotaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/quota'
+    original_store = app.rate_limiter.store
+    app.rate_limiter.store = app.MemoryRateLimitStore()
+
+    def _send(attempt_timeout):
+        response = requests.get(url, timeout=attempt_timeout)
+        app.rate_limiter.observe('pixelcut', response)
+        app.check_upstream_status(response)
+        return response.json()
+
+    try:
+        _QuotaHandler.statuses = [429]
+        started = time.monotonic()
+        assert app.call_with_retry('pixelcut', _send, 30, policy=app.RetryPolicy(base_delay=0.01)) == {'ok': True}
+        elapsed = time.monotonic() - started
+        assert elapsed >= 0.9, f"Retried after {elapsed:.2f}s despite Retry-After: 1"
+
+        stats = app.get_rate_limit_stats()['providers']['pixelcut']
+        assert stats['upstream_429'] == 1 and stats['throttled'] == 1 and stats['upstream_remaining'] == 42, stats
+        print(f"✅ Retry waited {elapsed:.2f}s for Retry-After")
+    finally:
+        app.rate_limiter.store = original_store
+        server.shutdown()
+
+if __name__ == "__main__":
+    print("🧪 Testing upstream rate limiting...")
+    print("=" * 50)
+
+    tests = [
+        test_bucket_spaces_calls,
+        test_headers_pause_provider,
+        test_sqlite_store_is_shared,
+        test_retry_waits_for_retry_after
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
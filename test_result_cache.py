@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed result cache:
+1. In-memory LRU evicts by entry count, byte size and TTL
+2. On-disk tier is shared between cache instances (workers) and swept back under its caps
+3. Repeated uploads of the same image skip the upstream call
+"""
+
+import sys
+import os
+import io
+import time
+import tempfile
+sys.path.insert(0, os.path.dirname(__file__))
+
+def test_lru_eviction():
+    """Test entry-count and byte-size eviction order"""
+    from app import ResultCache
+
+    cache = ResultCache(max_entries=2, max_bytes=10_000, ttl_seconds=60)
+    cache.set('a', {'v': 1})
+    cache.set('b', {'v': 2})
+    assert cache.get('a') == {'v': 1}  # 'a' becomes most recently used
+    cache.set('c', {'v': 3})
+    assert cache.get('b') is None, "Least recently used entry should be evicted"
+    assert cache.get('a') == {'v': 1} and cache.get('c') == {'v': 3}
+
+    small = ResultCache(max_entries=100, max_bytes=100, ttl_seconds=60)
+    small.set('x', {'data': 'x' * 60})
+    small.set('y', {'data': 'y' * 60})
+    assert small.get('x') is None and small.size_bytes <= 100
+    print("✅ LRU evicts by entry count and byte size")
+
+def test_ttl_expiry():
+    """Test that expired entries are not served"""
+    from app import ResultCache
+
+    cache = ResultCache(max_entries=10, max_bytes=10_000, ttl_seconds=0.1)
+    cache.set('k', {'v': 1})
+    assert cache.get('k') == {'v': 1}
+    time.sleep(0.15)
+    assert cache.get('k') is None
+    assert cache.stats()['expirations'] == 1
+    print("✅ TTL expiry works")
+
+def test_disk_tier_shared():
+    """Test that a second cache instance reads entries written by the first"""
+    from app import ResultCache
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        writer = ResultCache(max_entries=10, max_bytes=10_000, ttl_seconds=60, disk_dir=cache_dir)
+        reader = ResultCache(max_entries=10, max_bytes=10_000, ttl_seconds=60, disk_dir=cache_dir)
+        writer.set('shared-key', {'processed_image': 'https://cdn.example/out.png'})
+
+        assert reader.get('shared-key') == {'processed_image': 'https://cdn.example/out.png'}
+        assert reader.stats()['disk_hits'] == 1
+        assert reader.get('shared-key') is not None
+        assert reader.stats()['memory_hits'] == 1, "Disk hits should be promoted to memory"
+    print("✅ On-disk tier is shared across workers")
+
+def test_disk_tier_sweep():
+    """Test that writes sweep expired and oldest disk entries, including keys never read again"""
+    from app import ResultCache
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ResultCache(max_entries=100, max_bytes=100_000, ttl_seconds=60, disk_dir=cache_dir,
+                            disk_max_entries=3, disk_max_bytes=100_000, sweep_seconds=0)
+        for i in range(6):
+            cache.set(f'key{i}', {'v': i})
+            os.utime(cache._disk_path(f'key{i}'), (1000 + i, 1000 + i) if i == 0 else None)
+        on_disk = sorted(name for _, _, names in os.walk(cache_dir) for name in names)
+        assert len(on_disk) == 3 and 'key5.json' in on_disk and 'key0.json' not in on_disk, on_disk
+        stats = cache.stats()
+        assert stats['disk_expirations'] == 1 and stats['disk_evictions'] == 2, stats
+
+        by_size = ResultCache(max_entries=100, max_bytes=100_000, ttl_seconds=60, disk_dir=cache_dir,
+                              disk_max_entries=100, disk_max_bytes=500, sweep_seconds=0)
+        by_size.set('big', {'data': 'x' * 400})
+        assert os.path.exists(by_size._disk_path('big'))
+        total = sum(os.path.getsize(os.path.join(d, n)) for d, _, names in os.walk(cache_dir) for n in names)
+        assert total <= 500, f"Byte cap exceeded: {total}"
+    print(f"✅ Disk sweep kept {on_disk}")
+
+def test_endpoint_cache_hit_skips_upstream():
+    """Test that re-submitting the same image returns the cached result"""
+    import app
+
+    calls = []
+    def fake_request(api_url, files, headers, **kwargs):
+        calls.append(kwargs.get('data'))
+        return {'success': True, 'processed_image': f'https://cdn.example/{len(calls)}.png', 'source': 'api'}
+
+    original = app.make_image_api_request
+    app.make_image_api_request = fake_request
+    client = app.app.test_client()
+    image = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x02\x00\x00\x00\x02\x00' + os.urandom(256)
+
+    def upload(path):
+        return client.post(path, data={'image': (io.BytesIO(image), 'photo.png', 'image/png')}, content_type='multipart/form-data')
+
+    try:
+        first = upload('/api/upscale')
+        second = upload('/api/upscale')
+        other_op = upload('/api/unblur')
+
+        assert first.headers['X-Cache'] == 'MISS' and second.headers['X-Cache'] == 'HIT'
+        assert first.get_json() == second.get_json()
+        assert other_op.headers['X-Cache'] == 'MISS', "Different operations must not share entries"
+        assert len(calls) == 2
+        print("✅ Repeated uploads are served from the result cache")
+    finally:
+        app.make_image_api_request = original
+
+if __name__ == "__main__":
+    print("🧪 Testing result cache...")
+    print("=" * 50)
+
+    tests = [
+        test_lru_eviction,
+        test_ttl_expiry,
+        test_disk_tier_shared,
+        test_disk_tier_sweep,
+        test_endpoint_cache_hit_skips_upstream
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script for the unified retry budget:
+1. Attempts are capped per logical request (no nested retry amplification)
+2. Wall-clock budget bounds retries and backoff
+3. Non-retryable errors fail immediately
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+
+def test_attempts_are_capped():
+    """Test that a failing upstream gets exactly max_attempts requests"""
+    from app import RetryPolicy, RetryableUpstreamError, call_with_retry, get_retry_stats
+
+    calls = []
+    def _send(attempt_timeout):
+        calls.append(attempt_timeout)
+        raise RetryableUpstreamError(503)
+
+    policy = RetryPolicy(max_attempts=3, budget_seconds=30, base_delay=0.01, max_delay=0.02)
+    try:
+        call_with_retry('test-capped', _send, timeout=5, policy=policy)
+        raise AssertionError("Expected the call to fail")
+    except AssertionError:
+        raise
+    except Exception as e:
+        assert 'after 3 attempts' in str(e), str(e)
+
+    assert len(calls) == 3, f"Expected 3 upstream requests, got {len(calls)}"
+    stats = get_retry_stats()['providers']['test-capped']
+    assert stats['attempts'] == 3 and stats['retries'] == 2 and stats['budget_exhausted'] == 1
+    print(f"✅ Retries capped at policy limit: {stats}")
+
+def test_time_budget_bounds_retries():
+    """Test that the wall-clock budget stops retries before max_attempts"""
+    from app import RetryPolicy, call_with_retry
+    import requests
+
+    def _send(attempt_timeout):
+        assert attempt_timeout <= 2.5, "Attempt timeout should be clipped to the remaining budget"
+        time.sleep(0.6)
+        raise requests.exceptions.Timeout("read timed out")
+
+    policy = RetryPolicy(max_attempts=10, budget_seconds=2.5, base_delay=0.01, max_delay=0.01)
+    started = time.monotonic()
+    try:
+        call_with_retry('test-budget', _send, timeout=90, policy=policy)
+    except Exception as e:
+        assert 'failed after' in str(e), str(e)
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 3.5, f"Budget of 2.5s overrun: {elapsed:.2f}s"
+    print(f"✅ Retry budget bounded the call to {elapsed:.2f}s")
+
+def test_non_retryable_fails_fast():
+    """Test that non-retryable errors are not retried"""
+    from app import call_with_retry, get_retry_stats
+
+    calls = []
+    def _send(attempt_timeout):
+        calls.append(1)
+        raise Exception('No output URL found in API response')
+
+    try:
+        call_with_retry('test-fatal', _send, timeout=5)
+    except Exception as e:
+        assert 'No output URL' in str(e)
+
+    assert len(calls) == 1
+    assert get_retry_stats()['providers']['test-fatal']['failures'] == 1
+    print("✅ Non-retryable errors fail without retries")
+
+def test_success_after_retry():
+    """Test that a transient failure is retried and then succeeds"""
+    from app import RetryPolicy, RetryableUpstreamError, call_with_retry
+
+    calls = []
+    def _send(attempt_timeout):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RetryableUpstreamError(502)
+        return {'success': True}
+
+    policy = RetryPolicy(max_attempts=3, budget_seconds=10, base_delay=0.01, max_delay=0.01)
+    assert call_with_retry('test-transient', _send, timeout=5, policy=policy) == {'success': True}
+    assert len(calls) == 2
+    print("✅ Transient failures recover within the budget")
+
+if __name__ == "__main__":
+    print("🧪 Testing unified retry budget...")
+    print("=" * 50)
+
+    tests = [
+        test_attempts_are_capped,
+        test_time_budget_bounds_retries,
+        test_non_retryable_fails_fast,
+        test_success_after_retry
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming multipart proxy:
+1. Client upload is re-framed for the upstream chunk by chunk
+2. Extension, magic bytes and size are validated inline
+3. Rejected uploads never forward image bytes upstream
+4. Oversized streamed uploads are answered 413 without counting against the breaker
+"""
+
+import sys
+import os
+import io
+sys.path.insert(0, os.path.dirname(__file__))
+
+from werkzeug.formparser import parse_form_data
+
+PNG_IMAGE = b'\x89PNG\r\n\x1a\n' + os.urandom(200 * 1024)
+
+def build_client_body(filename, content, boundary='client-boundary-123'):
+    """Encode a browser-style multipart upload"""
+    return (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        f'Content-Type: image/png\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode(), boundary
+
+def relay_in_chunks(relay, body, chunk_size):
+    """Feed a body through the relay in fixed-size chunks, collecting upstream bytes"""
+    forwarded = []
+    for offset in range(0, len(body), chunk_size):
+        forwarded.extend(relay.feed(body[offset:offset + chunk_size]))
+    forwarded.extend(relay.finish())
+    return b''.join(forwarded)
+
+def test_relay_reframes_upload():
+    """Test that the upstream body is a valid multipart with the same image"""
+    from app import StreamingUploadRelay
+
+    body, boundary = build_client_body('photo.png', PNG_IMAGE)
+    for chunk_size in (7, 4096, 65536):
+        relay = StreamingUploadRelay(boundary, {'scale': '2'})
+        upstream_body = relay_in_chunks(relay, body, chunk_size)
+
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': relay.content_type,
+            'CONTENT_LENGTH': str(len(upstream_body)),
+            'wsgi.input': io.BytesIO(upstream_body)
+        }
+        _, form, files = parse_form_data(environ)
+        assert form['scale'] == '2'
+        assert 'note' not in form, "Unrelated client fields are not forwarded"
+        assert files['image'].read() == PNG_IMAGE, f"Image corrupted with chunk size {chunk_size}"
+        assert relay.size == len(PNG_IMAGE)
+    print("✅ Streaming relay re-frames uploads for the upstream")
+
+def test_relay_rejects_bad_input_inline():
+    """Test extension, magic-byte and size checks during streaming"""
+    from app import StreamingUploadRelay, UploadRejected, MAX_FILE_SIZE
+
+    cases = [
+        (build_client_body('photo.exe', PNG_IMAGE), 'Unsupported file type'),
+        (build_client_body('photo.png', b'MZ' + os.urandom(1024)), 'not a supported image'),
+        (build_client_body('photo.png', b'\x89PNG\r\n\x1a\n' + b'\x00' * (MAX_FILE_SIZE + 1)), 'exceeds 10MB')
+    ]
+    for (body, boundary), expected in cases:
+        relay = StreamingUploadRelay(boundary)
+        forwarded = []
+        try:
+            for offset in range(0, len(body), 65536):
+                forwarded.extend(relay.feed(body[offset:offset + 65536]))
+            relay.finish()
+            raise AssertionError(f"Expected rejection: {expected}")
+        except UploadRejected as e:
+            assert expected in str(e), str(e)
+        if expected != 'exceeds 10MB':
+            assert forwarded == [], "Nothing may be forwarded before validation passes"
+    print("✅ Bad uploads are rejected inline")
+
+def test_streaming_endpoint():
+    """Test that ?stream=1 forwards the upload through the relay"""
+    import app
+
+    received = []
+    class FakeResponse:
+        status_code = 200
+        headers = {'content-type': 'application/json'}
+        def json(self):
+            return {'output_url': 'https://cdn.example/out.png'}
+
+    class FakeSession:
+        def post(self, url, data=None, headers=None, timeout=None):
+            received.append(b''.join(data))
+            return FakeResponse()
+
+    original = app.get_upstream_session
+    app.get_upstream_session = lambda url: FakeSession()
+    try:
+        client = app.app.test_client()
+        response = client.post(
+            '/api/background-remove?stream=1',
+            data={'image': (io.BytesIO(PNG_IMAGE), 'photo.png', 'image/png')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 200
+        assert response.get_json()['processed_image'] == 'https://cdn.example/out.png'
+        assert PNG_IMAGE in received[0]
+
+        response = client.post(
+            '/api/background-remove?stream=1',
+            data={'image': (io.BytesIO(b'not an image at all'), 'photo.png', 'image/png')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 400
+        print("✅ Streaming endpoint proxies uploads")
+    finally:
+        app.get_upstream_session = original
+
+def test_rejected_upload_releases_probe():
+    """Test that a rejected streamed upload frees the half-open probe for the next request"""
+    import app
+    import time
+
+    class FakeResponse:
+        status_code = 200
+        headers = {'content-type': 'application/json'}
+        def json(self):
+            return {'output_url': 'https://cdn.example/out.png'}
+
+    class FakeSession:
+        def post(self, url, data=None, headers=None, timeout=None):
+            b''.join(data)
+            return FakeResponse()
+
+    original_session, original_breaker = app.get_upstream_session, app.CIRCUIT_BREAKERS['pixelcut']
+    app.get_upstream_session = lambda url: FakeSession()
+    breaker = app.CircuitBreaker('pixelcut', failure_rate=0.5, min_calls=1, window_seconds=60, open_seconds=0.05)
+    app.CIRCUIT_BREAKERS['pixelcut'] = breaker
+    try:
+        breaker.record_failure()
+        assert breaker.snapshot()['state'] == 'open'
+        time.sleep(0.1)
+
+        client = app.app.test_client()
+        response = client.post(
+            '/api/background-remove?stream=1',
+            data={'image': (io.BytesIO(b'GIF89a' + os.urandom(64)), 'x.png', 'image/png')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 400
+
+        response = client.post(
+            '/api/background-remove?stream=1',
+            data={'image': (io.BytesIO(PNG_IMAGE), 'photo.png', 'image/png')},
+            content_type='multipart/form-data'
+        )
+        assert response.get_json()['processed_image'] == 'https://cdn.example/out.png', response.get_json()
+        assert breaker.snapshot()['state'] == 'closed'
+        print("✅ Rejected upload released the half-open probe")
+    finally:
+        app.get_upstream_session = original_session
+        app.CIRCUIT_BREAKERS['pixelcut'] = original_breaker
+
+def test_oversized_upload_not_a_failure():
+    """Test that an oversized streamed upload gets a 413 and leaves the breaker window untouched"""
+    import app
+
+    class FakeSession:
+        def post(self, url, data=None, headers=None, timeout=None):
+            b''.join(data)
+            raise AssertionError("Oversized upload should never complete upstream")
+
+    original_session, original_breaker = app.get_upstream_session, app.CIRCUIT_BREAKERS['pixelcut']
+    app.get_upstream_session = lambda url: FakeSession()
+    breaker = app.CircuitBreaker('pixelcut', failure_rate=0.5, min_calls=1, window_seconds=60, open_seconds=60)
+    app.CIRCUIT_BREAKERS['pixelcut'] = breaker
+    try:
+        client = app.app.test_client()
+        oversized = b'\x89PNG\r\n\x1a\n' + b'\x00' * app.MAX_FILE_SIZE
+        response = client.post(
+            '/api/upscale?stream=1',
+            data={'image': (io.BytesIO(oversized), 'photo.png', 'image/png')},
+            content_type='multipart/form-data'
+        )
+        assert response.status_code == 413, (response.status_code, response.get_json())
+        assert 'exceeds' in response.get_json()['error']
+        snapshot = breaker.snapshot()
+        assert snapshot['state'] == 'closed' and snapshot['window_failures'] == 0, snapshot
+        print("✅ Oversized streamed upload answered 413 without a breaker failure")
+    finally:
+        app.get_upstream_session = original_session
+        app.CIRCUIT_BREAKERS['pixelcut'] = original_breaker
+
+if __name__ == "__main__":
+    print("🧪 Testing streaming multipart proxy...")
+    print("=" * 50)
+
+    tests = [
+        test_relay_reframes_upload,
+        test_relay_rejects_bad_input_inline,
+        test_streaming_endpoint,
+        test_rejected_upload_releases_probe,
+        test_oversized_upload_not_a_failure
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test script for structured, queued logging:
+1. JSON records carry the request id and structured fields
+2. Disabled levels cost nothing and a full queue drops instead of blocking
+3. Per-path sampling drops INFO/DEBUG records but keeps warnings
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import logging
+sys.path.insert(0, os.path.dirname(__file__))
+
+class CountingArg:
+    """Log argument that records whether it was ever rendered"""
+    renders = 0
+
+    def __str__(self):
+        CountingArg.renders += 1
+        return 'rendered'
+
+def make_logger(name, maxsize=100):
+    """Logger writing JSON through its own queue handler; returns (logger, handler, output)"""
+    from app import QueueLogHandler, RequestLogFilter, JsonLogFormatter
+
+    output = io.StringIO()
+    stream_handler = logging.StreamHandler(output)
+    stream_handler.setFormatter(JsonLogFormatter())
+    handler = QueueLogHandler(stream_handler, maxsize=maxsize)
+    handler.addFilter(RequestLogFilter())
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger, handler, output
+
+def records(output):
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+def test_json_records_with_request_id():
+    """Test JSON fields, request id tagging and exception text"""
+    from app import start_trace, finish_trace
+
+    logger, handler, output = make_logger('test.json')
+    root = start_trace('GET /test', 'req-123')
+    try:
+        logger.info("Processed %s in %.1fms", 'upscale', 12.345, extra={'fields': {'operation': 'upscale'}})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception("Failed")
+    finally:
+        finish_trace(root)
+    logger.info("Outside a request")
+    handler.close()
+
+    first, second, third = records(output)
+    assert first['message'] == 'Processed upscale in 12.3ms' and first['level'] == 'INFO', first
+    assert first['request_id'] == 'req-123' and first['operation'] == 'upscale', first
+    assert 'ValueError: boom' in second['exception'], second
+    assert 'request_id' not in third, third
+    print(f"✅ JSON record: {first}")
+
+def test_disabled_levels_and_full_queue():
+    """Test that debug arguments are never rendered at INFO and a full queue never blocks"""
+    logger, handler, output = make_logger('test.lazy', maxsize=5)
+    CountingArg.renders = 0
+    logger.debug("Detail: %s", CountingArg())
+    assert CountingArg.renders == 0, "Disabled records are not formatted"
+
+    handler._pid = os.getpid()  # Marks the writer as running without starting it, so the queue fills up
+    started = time.monotonic()
+    for i in range(50):
+        logger.info("Record %s", i)
+    assert time.monotonic() - started < 0.5, "Logging never waits on the writer"
+    assert handler.stats()['dropped'] == 45 and handler.stats()['queued'] == 5, handler.stats()
+    handler._pid = None
+    print(f"✅ Disabled debug not rendered, full queue dropped {handler.dropped} records")
+
+def test_per_path_sampling():
+    """Test that a path sampled at 0 keeps warnings only, through the Flask app"""
+    import app
+
+    logger, handler, output = make_logger('test.sampled')
+    original_rates = app.LOG_SAMPLE_RATES
+    app.LOG_SAMPLE_RATES = {'/quiet': 0.0, '*': 1.0}
+    try:
+        root = app.start_trace('GET /quiet', path='/quiet')
+        logger.info("Dropped")
+        logger.warning("Kept")
+        app.finish_trace(root)
+
+        root = app.start_trace('GET /loud', path='/loud')
+        logger.info("Also kept")
+        app.finish_trace(root)
+
+        app.LOG_SAMPLE_RATES = {'/': 0.0}
+        response = app.app.test_client().get('/')
+        assert response.status_code == 200
+        assert response.get_json()['logging']['format'] in ('text', 'json')
+    finally:
+        app.LOG_SAMPLE_RATES = original_rates
+    handler.close()
+
+    assert [record['message'] for record in records(output)] == ['Kept', 'Also kept'], output.getvalue()
+    print("✅ Sampled-out path keeps only warnings")
+
+if __name__ == "__main__":
+    print("🧪 Testing structured logging...")
+    print("=" * 50)
+
+    tests = [
+        test_json_records_with_request_id,
+        test_disabled_levels_and_full_queue,
+        test_per_path_sampling
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test script for per-request tracing:
+1. A traced request exports validate, preprocess, upstream, attempt, backoff and encode spans
+2. The request id is echoed to the client and sent to the upstream with a traceparent
+3. Untraced requests still get a request id; spans export as OTLP JSON
+"""
+
+import sys
+import os
+import io
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(__file__))
+
+from test_helpers import make_image
+
+class _FlakyUpstream(BaseHTTPRequestHandler):
+    statuses = []
+    seen_headers = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.seen_headers.append(dict(self.headers))
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = b'{"output_url": "https://cdn.example/out.png"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def use_file_exporter(app, path):
+    """Export every trace to path; returns an undo function"""
+    original = app.TRACE_EXPORT, app.trace_exporter
+    app.TRACE_EXPORT, app.trace_exporter = 'file', app.TraceExporter(mode='file', path=path)
+
+    def undo():
+        app.TRACE_EXPORT, app.trace_exporter = original
+    return undo
+
+def read_traces(path):
+    with open(path, encoding='utf-8') as traces:
+        return [json.loads(line) for line in traces]
+
+def test_flask_span_tree():
+    """Test the exported span tree of a request whose first upstream attempt fails"""
+    import app
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FlakyUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_url, original_key = app.OPERATIONS['unblur']['url'], app.PROVIDERS['pixelcut']['api_key']
+    app.OPERATIONS['unblur']['url'] = f'http://127.0.0.1:{server.server_port}/v1/enhance'
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    _FlakyUpstream.statuses, _FlakyUpstream.seen_headers = [503], []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'traces.jsonl')
+        undo = use_file_exporter(app, path)
+        try:
+            response = app.app.test_client().post(
+                '/api/unblur',
+                data={'image': (io.BytesIO(make_image()), 'photo.jpg', 'image/jpeg')},
+                content_type='multipart/form-data',
+                headers={'X-Request-ID': 'client-req-1'}
+            )
+            app.trace_exporter.flush()
+            traces = read_traces(path)
+        finally:
+            undo()
+            app.OPERATIONS['unblur']['url'], app.PROVIDERS['pixelcut']['api_key'] = original_url, original_key
+            server.shutdown()
+
+    assert response.get_json()['source'] == 'api', response.get_json()
+    assert response.headers['X-Request-ID'] == 'client-req-1'
+    assert [headers['X-Request-ID'] for headers in _FlakyUpstream.seen_headers] == ['client-req-1', 'client-req-1']
+    assert _FlakyUpstream.seen_headers[0]['traceparent'].startswith('00-')
+
+    assert len(traces) == 1 and traces[0]['request_id'] == 'client-req-1'
+    spans = {span['name']: span for span in traces[0]['spans'] if span['name'] != 'attempt'}
+    attempts = [span for span in traces[0]['spans'] if span['name'] == 'attempt']
+    root = spans['POST /api/unblur']
+    assert root['parent_id'] is None and root['attributes']['status_code'] == 200
+    for name in ('validate', 'preprocess', 'upstream', 'backoff', 'encode'):
+        assert name in spans, f"Missing {name} span: {sorted(spans)}"
+    assert spans['validate']['parent_id'] == root['span_id']
+    assert [attempt['attributes']['number'] for attempt in attempts] == [1, 2]
+    assert all(attempt['parent_id'] == spans['upstream']['span_id'] for attempt in attempts)
+    assert 'RetryableUpstreamError' in attempts[0]['attributes']['error'] and 'error' not in attempts[1]['attributes']
+    assert spans['backoff']['parent_id'] == spans['upstream']['span_id']
+    print(f"✅ Exported {len(traces[0]['spans'])} spans, first attempt marked failed")
+
+def test_request_id_without_export():
+    """Test generated and rejected request ids when spans are not exported"""
+    import app
+
+    client = app.app.test_client()
+    generated = client.get('/').headers['X-Request-ID']
+    assert len(generated) == 32 and generated != client.get('/').headers['X-Request-ID']
+    assert client.get('/', headers={'X-Request-ID': 'bad id; x=<script>'}).headers['X-Request-ID'] != 'bad id; x=<script>'
+    assert app.trace_headers() == {}, "No trace outside a request"
+    print("✅ Every response carries a request id, untrusted ids are replaced")
+
+def test_otlp_payload():
+    """Test the OTLP/HTTP JSON shape"""
+    import app
+
+    trace = app.Trace('req-7', sampled=True)
+    root = trace.start_span('POST /api/upscale', kind='server')
+    child = trace.start_span('attempt', root.span_id, number=1)
+    child.end()
+    root.end()
+    spans = app.otlp_payload([trace])['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert spans[0]['kind'] == 2 and spans[0]['parentSpanId'] == '' and len(spans[0]['traceId']) == 32
+    assert spans[1]['parentSpanId'] == root.span_id
+    assert {'key': 'number', 'value': {'intValue': '1'}} in spans[1]['attributes']
+    assert {'key': 'request.id', 'value': {'stringValue': 'req-7'}} in spans[1]['attributes']
+    print("✅ OTLP payload carries trace ids, parents and typed attributes")
+
+def test_asgi_tracing():
+    """Test request id propagation and attempt spans in the ASGI app"""
+    import httpx
+    import app
+    import asgi_app
+    from starlette.testclient import TestClient
+
+    seen = []
+
+    def mock_upstream(request):
+        seen.append(request.headers.get('x-request-id'))
+        return httpx.Response(200, json={'output_url': 'https://cdn.example/out.png'})
+
+    original_key = app.PROVIDERS['pixelcut']['api_key']
+    app.PROVIDERS['pixelcut']['api_key'] = 'test-key'
+    asgi_app._async_client = httpx.AsyncClient(transport=httpx.MockTransport(mock_upstream))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'traces.jsonl')
+        undo = use_file_exporter(app, path)
+        asgi_app.trace_exporter = app.trace_exporter
+        try:
+            response = TestClient(asgi_app.asgi_app).post(
+                '/api/upscale', files={'image': ('photo.jpg', make_image(), 'image/jpeg')}
+            )
+            app.trace_exporter.flush()
+            traces = read_traces(path)
+        finally:
+            undo()
+            asgi_app.trace_exporter = app.trace_exporter
+            asgi_app._async_client = None
+            app.PROVIDERS['pixelcut']['api_key'] = original_key
+
+    request_id = response.headers['x-request-id']
+    assert seen == [request_id], (seen, request_id)
+    names = [span['name'] for span in traces[0]['spans']]
+    assert names[0] == 'POST /api/upscale' and 'attempt' in names and 'encode' in names, names
+    print(f"✅ ASGI request {request_id[:8]}… traced: {names}")
+
+if __name__ == "__main__":
+    print("🧪 Testing request tracing...")
+    print("=" * 50)
+
+    tests = [
+        test_flask_span_tree,
+        test_request_id_without_export,
+        test_otlp_payload,
+        test_asgi_tracing
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test script for the pooled upstream HTTP client:
+1. One long-lived session per upstream origin
+2. Keep-alive connections are reused across calls and worker threads
+"""
+
+import sys
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(__file__))
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_local_server():
+    """Start a keep-alive HTTP server on a random local port"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _OkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_session_is_shared_per_origin():
+    """Test that get_upstream_session() returns one session per origin"""
+    from app import get_upstream_session
+
+    first = get_upstream_session('https://api.pixelcut.ai/v1/background/remove')
+    second = get_upstream_session('https://api.pixelcut.ai/v1/upscale')
+    other = get_upstream_session('https://api.unwatermark.ai/v1/remove')
+
+    assert first is second, "Same origin should share one pooled session"
+    assert first is not other, "Different origins should get separate sessions"
+    print("✅ get_upstream_session() shares one session per origin")
+
+def test_connections_are_reused():
+    """Test that repeated calls to the same host hit the keep-alive pool"""
+    from app import get_upstream_session, get_pool_stats
+
+    server = start_local_server()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/ping"
+        session = get_upstream_session(url)
+        # Other tests may already have talked to 127.0.0.1, so compare against a baseline
+        before = get_pool_stats()['hosts'].get('127.0.0.1', {'hits': 0, 'misses': 0})
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            statuses = list(pool.map(lambda _: session.get(url, timeout=5).status_code, range(20)))
+
+        assert statuses == [200] * 20
+        after = get_pool_stats()['hosts']['127.0.0.1']
+        stats = {key: after[key] - before[key] for key in ('hits', 'misses')}
+        assert stats['misses'] <= 4, f"Expected at most one connect per thread, got {stats}"
+        assert stats['hits'] >= 16, f"Expected keep-alive reuse, got {stats}"
+        print(f"✅ Pooled connections reused across threads: {stats}")
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    print("🧪 Testing pooled upstream client...")
+    print("=" * 50)
+
+    tests = [
+        test_session_is_shared_per_origin,
+        test_connections_are_reused
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test.__name__} failed: {e}")
+        print()
+
+    print("=" * 50)
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    sys.exit(0 if passed == len(tests) else 1)